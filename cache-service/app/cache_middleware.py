@@ -1,31 +1,572 @@
-from .utils.redis_client import redis_client
+import asyncio
+import functools
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple, Union
 
-async def cache_middleware(cache_key: str, fetch_function):
+from pydantic import BaseModel
+
+from .utils.http_client import NotModified, UpstreamValidators
+from .utils.invalidation import INVALIDATION_CHANNEL, invalidation_message, publish_invalidation
+from .utils.memory_cache import TierStats, memory_cache
+from .utils.access_log import access_log
+from .utils.formats import dumps
+from .utils.metrics import Gauge, REDIS_LATENCY, record_cache_result, registry
+from .utils.payload import CachedPayload
+from .utils.codec import encode
+from .utils.memory_budget import families_due_for_check, queue_accounting, select_evictions
+from .utils.redis_client import as_text, get_redis_client, jittered_ttl
+from .utils.resilience import CircuitOpen, UpstreamError
+from .utils.single_flight import SingleFlight, acquire_lease, acquire_leases, release_lease, release_leases
+
+logger = logging.getLogger(__name__)
+
+# How long one worker may hold the refresh lease for a key
+CACHE_LEASE_TTL_MS = int(os.getenv('CACHE_LEASE_TTL_MS', 15000))
+# By default the last known value is kept this many times longer than the soft TTL
+CACHE_STALE_TTL_FACTOR = int(os.getenv('CACHE_STALE_TTL_FACTOR', 24))
+# How many upstream fetches a multi-key lookup runs at once
+CACHE_FETCH_CONCURRENCY = int(os.getenv('CACHE_FETCH_CONCURRENCY', 8))
+
+single_flight = SingleFlight()
+redis_stats = TierStats()
+
+# Keeps a reference to running background refreshes so they are not garbage collected
+_background_refreshes: Set[asyncio.Task] = set()
+
+registry.register(Gauge("single_flight_in_flight", "Upstream fetches currently running in this worker.", lambda: len(single_flight)))
+registry.register(Gauge("cache_background_refreshes", "Background revalidations currently running in this worker.", lambda: len(_background_refreshes)))
+registry.register(Gauge("memory_cache_bytes", "Bytes held by the in-process cache tier.", lambda: memory_cache.current_bytes))
+
+
+def stale_key(cache_key: str) -> str:
     """
-    General caching middleware that checks if data is cached in Redis and serves it if available.
-    Otherwise, it calls the fetch_function to get fresh data.
+    Returns the key holding the last known value for a cache key, kept until the hard TTL.
+    """
+    return f"{cache_key}:stale"
+
+
+def version_key(cache_key: str) -> str:
+    """
+    Returns the key holding the upstream version the cached value was fetched at.
+    """
+    return f"{cache_key}:version"
+
+
+def validators_key(cache_key: str) -> str:
+    """
+    Returns the key holding the upstream ETag/Last-Modified validators of the cached value.
+    """
+    return f"{cache_key}:validators"
+
+
+def serialize(data: Any) -> str:
+    """
+    Serializes fetched data to the JSON string stored in Redis.
+    """
+    if isinstance(data, BaseModel):
+        return data.model_dump_json()
+    if hasattr(data, "to_json"):
+        # Compact containers such as PrecipitationColumns encode themselves
+        return data.to_json().decode()
+    return dumps(data).decode()
+
+
+def cache_stats() -> dict:
+    """
+    Returns the hit/miss counters of each cache tier and the in-memory usage.
+    """
+    return {
+        "memory": {**memory_cache.stats.as_dict(), **memory_cache.usage()},
+        "redis": redis_stats.as_dict(),
+        "background_refreshes": len(_background_refreshes)
+    }
+
+
+class CacheSpec:
+    """
+    How one cache key is fetched from upstream and how long it is kept.
 
     :param cache_key: The key to store the data in Redis
     :param fetch_function: The function to call to fetch the data if it's not cached
-    :return: The cached or fresh data
+    :param ttl: The soft TTL of the cached data in seconds
+    :param memory_ttl: The expiry of the in-process copy in seconds, defaults to ttl
+    :param stale_ttl: The hard TTL in seconds, defaults to ttl * CACHE_STALE_TTL_FACTOR
+    :param persist: Never expire the last known value, for data that no longer changes
+    :param version_function: Returns the current upstream version, to skip unchanged refreshes
+    :param conditional: Pass the upstream validators to fetch_function, which raises NotModified
+        when the upstream answers 304
     """
-    print(f"Checking cache for '{cache_key}'")
-    # Check if cache exists
-    cached_data = redis_client.get(cache_key)
+
+    __slots__ = ("cache_key", "fetch_function", "ttl", "memory_ttl", "stale_ttl", "version_function", "conditional")
+
+    def __init__(
+        self,
+        cache_key: str,
+        fetch_function: Callable[..., Awaitable[Any]],
+        ttl: int = 3600,
+        memory_ttl: Optional[float] = None,
+        stale_ttl: Optional[int] = None,
+        persist: bool = False,
+        version_function: Optional[Callable[[], Awaitable[str]]] = None,
+        conditional: bool = False
+    ):
+        self.cache_key = cache_key
+        self.fetch_function = fetch_function
+        self.ttl = ttl
+        self.memory_ttl = ttl if memory_ttl is None else memory_ttl
+        if persist:
+            self.stale_ttl = None
+        else:
+            self.stale_ttl = ttl * CACHE_STALE_TTL_FACTOR if stale_ttl is None else stale_ttl
+        self.version_function = version_function
+        self.conditional = conditional
+
+
+async def wait_for_value(cache_key: str, timeout: float) -> Optional[str]:
+    """
+    Polls Redis for a key another worker is refreshing.
+
+    :param cache_key: The key being refreshed.
+    :param timeout: The longest time to wait, in seconds.
+    :return: The value once written, or None if it did not show up in time.
+    """
+    redis_client = get_redis_client()
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while time.monotonic() < deadline:
+        await asyncio.sleep(delay)
+        with REDIS_LATENCY.time("get"):
+            cached_data = await redis_client.get(cache_key)
+        if cached_data:
+            return cached_data
+        delay = min(delay * 2, 0.5)
+    return None
+
+
+def queue_store(
+    pipe,
+    spec: CacheSpec,
+    payload: Union[str, bytes],
+    version: Optional[str] = None,
+    validators: Optional[UpstreamValidators] = None
+) -> None:
+    """
+    Queues the writes of a fresh value, its last known copy, its metadata and its memory accounting on a pipeline.
+
+    The payload is stored compressed by the storage codec, and both TTLs are
+    jittered so keys written in the same burst do not all expire together.
+
+    :param pipe: The Redis pipeline.
+    :param spec: The key and its expiry policy.
+    :param payload: The JSON payload.
+    :param version: The upstream version the payload was fetched at, if tracked.
+    :param validators: The upstream validators of the payload, if fetched conditionally.
+    """
+    cache_key = spec.cache_key
+    stale_ttl = None if spec.stale_ttl is None else jittered_ttl(spec.stale_ttl)
+
+    def set_until_hard_ttl(key, value):
+        if stale_ttl is None:
+            pipe.set(key, value)
+        else:
+            pipe.set(key, value, ex=stale_ttl)
+
+    stored = encode(payload)
+    pipe.set(cache_key, stored, ex=jittered_ttl(spec.ttl))
+    set_until_hard_ttl(stale_key(cache_key), stored)
+    if version is not None:
+        set_until_hard_ttl(version_key(cache_key), version)
+    if validators is not None:
+        set_until_hard_ttl(validators_key(cache_key), validators.to_json())
+    # The fresh value and the last known copy are stored separately
+    queue_accounting(pipe, cache_key, 2 * len(stored), stale_ttl)
+
+
+async def store(
+    spec: CacheSpec,
+    payload: Union[str, bytes],
+    version: Optional[str] = None,
+    validators: Optional[UpstreamValidators] = None
+) -> None:
+    """
+    Writes a fresh value, its last known copy and its metadata in one pipelined round trip.
+
+    The parameters are those of queue_store.
+    """
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        queue_store(pipe, spec, payload, version, validators)
+        with REDIS_LATENCY.time("pipeline"):
+            await pipe.execute()
+    await enforce_memory_budgets([spec.cache_key])
+
+
+async def store_many(entries: List[Tuple[CacheSpec, Any]]) -> List[CachedPayload]:
+    """
+    Writes many freshly fetched values and their invalidation messages in a single pipelined round trip.
+
+    :param entries: (spec, fetched data) pairs.
+    :return: The stored payloads, in the same order.
+    """
+    payloads = [CachedPayload(serialize(data).encode()) for _, data in entries]
+    await write_many([(spec, payload, None, None) for (spec, _), payload in zip(entries, payloads)])
+    return payloads
+
+
+async def write_many(
+    entries: List[Tuple[CacheSpec, CachedPayload, Optional[str], Optional[UpstreamValidators]]]
+) -> None:
+    """
+    Writes many fresh payloads, their metadata and their invalidation messages in a single pipelined round trip,
+    and keeps an in-process copy of each.
+
+    :param entries: (spec, payload, version, validators) tuples, as taken by queue_store.
+    """
+    if not entries:
+        return
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for spec, payload, version, validators in entries:
+            queue_store(pipe, spec, payload.body, version, validators)
+            pipe.publish(INVALIDATION_CHANNEL, invalidation_message(spec.cache_key))
+        with REDIS_LATENCY.time("pipeline"):
+            await pipe.execute()
+    for spec, payload, _, _ in entries:
+        memory_cache.set(spec.cache_key, payload, spec.memory_ttl)
+    await enforce_memory_budgets([spec.cache_key for spec, *_ in entries])
+
+
+async def enforce_memory_budgets(cache_keys: List[str]) -> List[str]:
+    """
+    Evicts keys from the families of the given keys that are over their memory budget.
+
+    Each family is checked at most every CACHE_MEMORY_CHECK_INTERVAL seconds per
+    worker. Evicted keys are deleted with their last known copy and metadata,
+    and dropped from every worker's in-memory tier.
+
+    :param cache_keys: The keys just written, which are never evicted.
+    :return: The evicted keys.
+    """
+    evicted = []
+    for family in families_due_for_check(cache_keys):
+        evicted.extend(await select_evictions(family, keep=cache_keys))
+    if not evicted:
+        return evicted
+    logger.info("Evicting %d keys over their family memory budget", len(evicted))
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for cache_key in evicted:
+            pipe.delete(cache_key, stale_key(cache_key), version_key(cache_key), validators_key(cache_key))
+            pipe.publish(INVALIDATION_CHANNEL, invalidation_message(cache_key))
+        with REDIS_LATENCY.time("pipeline"):
+            await pipe.execute()
+    for cache_key in evicted:
+        memory_cache.delete(cache_key)
+    return evicted
+
+
+async def rearm(
+    spec: CacheSpec,
+    previous_data: str,
+    version: Optional[str] = None,
+    validators: Optional[UpstreamValidators] = None
+) -> CachedPayload:
+    """
+    Makes the last known value fresh again after the upstream confirmed it did not change.
+    """
+    payload = CachedPayload.from_json(previous_data)
+    await store(spec, payload.body, version, validators)
+    memory_cache.set(spec.cache_key, payload, spec.memory_ttl)
+    return payload
+
+
+async def refresh(spec: CacheSpec, force: bool = False) -> CachedPayload:
+    """
+    Refreshes a key from upstream, letting only one worker across the cluster do it.
+
+    Workers that lose the lease serve the last known value if there is one,
+    otherwise they wait for the lease holder to write the fresh value. The last
+    known value is re-armed without downloading it again when the upstream
+    version did not change, or when the upstream answers the conditional
+    request with 304 Not Modified.
+
+    :param spec: The key to refresh and its fetch and expiry policy.
+    :param force: Revalidate the key even if it is still fresh, to refresh it ahead of expiry.
+    :return: The JSON payload.
+    """
+    cache_key = spec.cache_key
+    redis_client = get_redis_client()
+
+    token = await acquire_lease(cache_key, CACHE_LEASE_TTL_MS)
+    if token is None:
+        logger.debug("Another worker is refreshing '%s'", cache_key)
+        with REDIS_LATENCY.time("get"):
+            previous_data = await redis_client.get(stale_key(cache_key))
+        if previous_data:
+            return CachedPayload.from_json(previous_data, stale=True)
+        cached_data = await wait_for_value(cache_key, CACHE_LEASE_TTL_MS / 1000)
+        if cached_data:
+            return CachedPayload.from_json(cached_data)
+        # The lease holder did not finish in time, fetch it ourselves
+
+    try:
+        # The previous lease holder may have filled the key while we were acquiring
+        with REDIS_LATENCY.time("mget"):
+            cached_data, previous_data, previous_version, previous_validators = await redis_client.mget([
+                cache_key, stale_key(cache_key), version_key(cache_key), validators_key(cache_key)
+            ])
+        if token is not None and cached_data and not force:
+            return CachedPayload.from_json(cached_data)
+        previous_version = as_text(previous_version)
+
+        try:
+            version = None
+            if spec.version_function is not None:
+                version = await spec.version_function()
+                if previous_data and previous_version == version:
+                    logger.debug("Upstream version unchanged since last fetch of '%s', extending it", cache_key)
+                    # The validators describe the same value, they are extended with it
+                    validators = UpstreamValidators.from_json(previous_validators) if previous_validators else None
+                    return await rearm(spec, previous_data, version, validators)
+
+            if spec.conditional:
+                # Only revalidate against the upstream if there is a copy to fall back to
+                validators = UpstreamValidators.from_json(previous_validators if previous_data else None)
+                try:
+                    fresh_data = await spec.fetch_function(validators)
+                except NotModified:
+                    logger.debug("Upstream answered 304 for '%s', extending it", cache_key)
+                    return await rearm(spec, previous_data, version, validators)
+            else:
+                validators = None
+                fresh_data = await spec.fetch_function()
+        except UpstreamError as e:
+            if not previous_data:
+                raise
+            # Keep serving the last known value until the upstream recovers
+            level = logging.DEBUG if isinstance(e, CircuitOpen) else logging.WARNING
+            logger.log(level, "Upstream unavailable for '%s', serving the last known value: %s", cache_key, e)
+            return CachedPayload.from_json(previous_data, stale=True)
+        serialized = serialize(fresh_data)
+
+        logger.debug("Storing in cache with key '%s' for %d seconds", cache_key, spec.ttl)
+        await store(spec, serialized, version, validators)
+
+        payload = CachedPayload.from_json(serialized)
+        memory_cache.set(cache_key, payload, spec.memory_ttl)
+        # Make the other workers drop their now outdated in-memory copy
+        await publish_invalidation(cache_key)
+        return payload
+    finally:
+        if token is not None:
+            await release_lease(cache_key, token)
+
+
+def schedule_refresh(spec: CacheSpec) -> None:
+    """
+    Refreshes a key in the background, unless a refresh of it is already running.
+
+    :param spec: The key to refresh and its fetch and expiry policy.
+    """
+    if single_flight.in_flight(spec.cache_key):
+        return
+
+    async def run():
+        try:
+            await single_flight.do(spec.cache_key, lambda: refresh(spec))
+        except Exception as e:
+            logger.warning("Background refresh of '%s' failed: %s", spec.cache_key, e)
+
+    task = asyncio.create_task(run())
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+
+
+async def refresh_many(specs: List[CacheSpec], concurrency: int = CACHE_FETCH_CONCURRENCY) -> List[CachedPayload]:
+    """
+    Fetches many keys that have no cached value at all and writes them back in one pipelined round trip.
+
+    Every key is first registered in the single flight: keys this worker is
+    already fetching join that call and take no lease, since it holds or waits
+    for the lease itself. The leases of the other keys are then taken and
+    released in one round trip each; registering first means a lookup of the
+    same key arriving meanwhile joins the batch instead of losing the lease to
+    it and waiting for its whole TTL. Keys leased by another worker go through
+    refresh, which waits for that worker. The others are fetched concurrently,
+    at most `concurrency` at a time.
+
+    :param specs: The keys to fetch and their fetch and expiry policies.
+    :param concurrency: The most upstream fetches to run at the same time.
+    :return: The payloads in the same order as the specs.
+    :raises UpstreamError: If any key could not be fetched; the keys fetched are still stored.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    fetched = []
+
+    async def fetch(spec: CacheSpec) -> CachedPayload:
+        async with semaphore:
+            version = None
+            if spec.version_function is not None:
+                version = await spec.version_function()
+            if spec.conditional:
+                # Nothing to revalidate, the validators only collect the upstream's
+                validators = UpstreamValidators()
+                data = await spec.fetch_function(validators)
+            else:
+                validators = None
+                data = await spec.fetch_function()
+        payload = CachedPayload(serialize(data).encode())
+        fetched.append((spec, payload, version, validators))
+        return payload
+
+    async def fetch_leased(spec: CacheSpec) -> CachedPayload:
+        # Shielded, as every flight awaits the same round trip
+        tokens = await asyncio.shield(leases)
+        if tokens[spec.cache_key] is None:
+            return await refresh(spec)
+        return await fetch(spec)
+
+    # No await from here until every flight is registered
+    joined = {spec.cache_key for spec in specs if single_flight.in_flight(spec.cache_key)}
+    leases = asyncio.ensure_future(acquire_leases([spec.cache_key for spec in specs if spec.cache_key not in joined], CACHE_LEASE_TTL_MS))
+    flights = [single_flight.start(spec.cache_key, functools.partial(fetch_leased, spec)) for spec in specs]
+
+    try:
+        results = await asyncio.gather(*map(asyncio.shield, flights), return_exceptions=True)
+        logger.debug("Storing %d fetched keys in one pipeline", len(fetched))
+        await write_many(fetched)
+    finally:
+        if leases.done() and not leases.cancelled() and leases.exception() is None:
+            await release_leases(leases.result())
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def resolve(spec: CacheSpec, cached_data: Optional[str], previous_data: Optional[str]) -> CachedPayload:
+    """
+    Turns the fresh and last known values read from Redis into a payload, refreshing as needed.
+
+    :param spec: The key and its fetch and expiry policy.
+    :param cached_data: The fresh value read from Redis, if any.
+    :param previous_data: The last known value read from Redis, if any.
+    :return: The cached or fresh data as a JSON payload.
+    """
+    cache_key = spec.cache_key
     if cached_data:
-        print("Found cached data")
-        # If it does, return the cached data
-        return cached_data
-    
-    print("No cached data found")
-    # If not cached, call the fetch function
-    fresh_data = await fetch_function()
-    print(f"Received fresh data: {fresh_data}")
-
-    # Cache the fresh data for 1 hour
-    print(f"Storing in cache with key '{cache_key}' for 1 hour")
-    redis_client.setex(cache_key, 3600, str(fresh_data))
-
-    # Return the fresh data
-    return fresh_data
+        redis_stats.hits += 1
+        record_cache_result("redis", cache_key, True)
+        payload = CachedPayload.from_json(cached_data)
+        memory_cache.set(cache_key, payload, spec.memory_ttl)
+        # If it is fresh, return the cached data
+        return payload
+    redis_stats.misses += 1
+    record_cache_result("redis", cache_key, False)
+
+    if previous_data:
+        # Past the soft TTL: serve the last known value and revalidate in the background
+        logger.debug("Serving stale data for '%s' while revalidating", cache_key)
+        schedule_refresh(spec)
+        return CachedPayload.from_json(previous_data, stale=True)
+
+    logger.debug("No cached data found for '%s'", cache_key)
+    # Past the hard TTL, join or start the single refresh for this key
+    return await single_flight.do(cache_key, lambda: refresh(spec))
+
+
+async def cache_middleware(
+    cache_key: str,
+    fetch_function: Callable[..., Awaitable[Any]],
+    ttl: int = 3600,
+    memory_ttl: Optional[float] = None,
+    stale_ttl: Optional[int] = None,
+    persist: bool = False,
+    version_function: Optional[Callable[[], Awaitable[str]]] = None,
+    conditional: bool = False
+) -> CachedPayload:
+    """
+    General caching middleware that checks if data is cached in Redis and serves it if available.
+    Otherwise, it calls the fetch_function to get fresh data.
+
+    Hot keys are answered from an in-process LRU in front of Redis without any
+    network I/O; writes are broadcast over Redis pub/sub so other workers drop
+    their outdated copy. Concurrent misses on the same key share a single
+    upstream fetch in this process, and a Redis lease ensures only one worker
+    refreshes it at a time.
+
+    Values have a soft and a hard TTL: past the soft TTL the last known value is
+    served immediately while a background task revalidates it; only past the
+    hard TTL does a request wait for upstream.
+
+    Values are returned as the stored, already-validated JSON bytes, so a hit
+    costs no model construction or re-serialization.
+
+    The parameters are those of CacheSpec.
+
+    :return: The cached or fresh data as a JSON payload
+    """
+    spec = CacheSpec(cache_key, fetch_function, ttl, memory_ttl, stale_ttl, persist, version_function, conditional)
+    return await cache_lookup(spec)
+
+
+async def cache_lookup(spec: CacheSpec) -> CachedPayload:
+    """
+    Resolves one key described by a CacheSpec, as cache_middleware does.
+
+    :param spec: The key and its fetch and expiry policy.
+    :return: The cached or fresh data as a JSON payload
+    """
+    access_log.record(spec.cache_key)
+    # Check the in-process tier first
+    payload = memory_cache.get(spec.cache_key)
+    record_cache_result("memory", spec.cache_key, payload is not None)
+    if payload is not None:
+        return payload
+
+    # Then check the fresh and last known values in Redis in one round trip
+    with REDIS_LATENCY.time("mget"):
+        cached_data, previous_data = await get_redis_client().mget([spec.cache_key, stale_key(spec.cache_key)])
+    return await resolve(spec, cached_data, previous_data)
+
+
+async def cache_middleware_many(specs: List[CacheSpec], concurrency: int = CACHE_FETCH_CONCURRENCY) -> List[CachedPayload]:
+    """
+    Resolves several keys at once: one in-process lookup pass, a single Redis MGET
+    for everything else, then the missing keys fetched concurrently and written
+    back in a single pipeline.
+
+    :param specs: The keys to resolve and their fetch and expiry policies.
+    :param concurrency: The most upstream fetches to run at the same time.
+    :return: The payloads in the same order as the specs.
+    """
+    for spec in specs:
+        access_log.record(spec.cache_key)
+    results: List[Optional[CachedPayload]] = [memory_cache.get(spec.cache_key) for spec in specs]
+    for spec, payload in zip(specs, results):
+        record_cache_result("memory", spec.cache_key, payload is not None)
+    pending = [index for index, payload in enumerate(results) if payload is None]
+    if not pending:
+        return results
+
+    keys = []
+    for index in pending:
+        keys.append(specs[index].cache_key)
+        keys.append(stale_key(specs[index].cache_key))
+    with REDIS_LATENCY.time("mget"):
+        values = await get_redis_client().mget(keys)
 
+    missing = []
+    for position, index in enumerate(pending):
+        cached_data, previous_data = values[2 * position], values[2 * position + 1]
+        if cached_data or previous_data:
+            results[index] = await resolve(specs[index], cached_data, previous_data)
+        else:
+            missing.append(index)
+    if missing:
+        redis_stats.misses += len(missing)
+        for index in missing:
+            record_cache_result("redis", specs[index].cache_key, False)
+        fetched = await refresh_many([specs[index] for index in missing], concurrency)
+        for index, payload in zip(missing, fetched):
+            results[index] = payload
+    return results
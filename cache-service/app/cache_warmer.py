@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Callable, List, Optional, Set
+
+from .cache_middleware import CacheSpec, refresh, single_flight, stale_key
+from .utils.access_log import access_log, decay_access_counts, hottest_keys
+from .utils.memory_cache import memory_cache
+from .utils.redis_client import get_redis_client
+from .utils.single_flight import acquire_lease
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two warming cycles, 0 disables the warmer and adjacent prefetching
+CACHE_WARMER_INTERVAL = int(os.getenv('CACHE_WARMER_INTERVAL', 0))
+# How many of the most accessed keys are kept warm
+CACHE_WARMER_TOP_KEYS = int(os.getenv('CACHE_WARMER_TOP_KEYS', 20))
+# Keys are refreshed once less than this fraction of their TTL is left
+CACHE_WARMER_REFRESH_AHEAD = float(os.getenv('CACHE_WARMER_REFRESH_AHEAD', 0.1))
+# Upstream refreshes the warmer and prefetcher may start per minute, across all workers
+CACHE_WARMER_RATE_LIMIT = int(os.getenv('CACHE_WARMER_RATE_LIMIT', 30))
+# Access counts are multiplied by this after every cycle, so old popularity fades
+CACHE_WARMER_DECAY = float(os.getenv('CACHE_WARMER_DECAY', 0.9))
+# Prefetches waiting or running at once in this worker; further ones are dropped
+CACHE_PREFETCH_MAX_PENDING = int(os.getenv('CACHE_PREFETCH_MAX_PENDING', 16))
+
+WARMER_LEASE_KEY = "cache:warmer"
+RATE_LIMIT_KEY = "cache:warmer:rate"
+
+# Turn a cache key back into the spec it was written with, or None if unknown
+_key_resolvers: List[Callable[[str], Optional[CacheSpec]]] = []
+# Keys warmed every cycle, however often they are accessed
+_pinned_keys: List[str] = []
+
+_warmer_task: Optional[asyncio.Task] = None
+_prefetch_tasks: Set[asyncio.Task] = set()
+
+
+def register_key_resolver(resolver: Callable[[str], Optional[CacheSpec]]) -> None:
+    """
+    Lets the warmer refresh a family of keys.
+
+    :param resolver: Returns the CacheSpec of a key of the family, or None for other keys.
+    """
+    _key_resolvers.append(resolver)
+
+
+def pin_keys(*cache_keys: str) -> None:
+    """
+    Keeps the given keys warm even before anyone requests them.
+    """
+    for cache_key in cache_keys:
+        if cache_key not in _pinned_keys:
+            _pinned_keys.append(cache_key)
+
+
+def spec_for_key(cache_key: str) -> Optional[CacheSpec]:
+    """
+    Returns the spec of a key from the registered resolvers, or None if no family knows it.
+    """
+    for resolver in _key_resolvers:
+        spec = resolver(cache_key)
+        if spec is not None:
+            return spec
+    return None
+
+
+def warmer_enabled() -> bool:
+    return CACHE_WARMER_INTERVAL > 0
+
+
+async def acquire_upstream_slot() -> bool:
+    """
+    Takes one of the CACHE_WARMER_RATE_LIMIT upstream refreshes of the current minute.
+
+    The counter lives in Redis, so the limit holds for the whole cluster.
+
+    :return: False if the limit of the current minute is reached.
+    """
+    window_key = f"{RATE_LIMIT_KEY}:{int(time.time() // 60)}"
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        pipe.incr(window_key)
+        pipe.expire(window_key, 120)
+        count, _ = await pipe.execute()
+    return count <= CACHE_WARMER_RATE_LIMIT
+
+
+async def due_for_refresh(specs: List[CacheSpec]) -> List[CacheSpec]:
+    """
+    Returns the specs whose fresh value is missing or has less than CACHE_WARMER_REFRESH_AHEAD of its TTL left.
+    """
+    if not specs:
+        return []
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for spec in specs:
+            pipe.pttl(spec.cache_key)
+        remaining = await pipe.execute()
+    # -2: missing, -1: no expiry
+    return [
+        spec for spec, pttl in zip(specs, remaining)
+        if pttl == -2 or 0 <= pttl < spec.ttl * 1000 * CACHE_WARMER_REFRESH_AHEAD
+    ]
+
+
+async def warm_once() -> int:
+    """
+    Runs one warming cycle.
+
+    Every worker flushes its access counts; the one holding the warmer lease
+    then refreshes the pinned keys and the hottest keys close to expiry,
+    within the upstream rate limit. The lease is held for the whole interval,
+    so the cluster runs one cycle per interval.
+
+    :return: The number of keys refreshed.
+    """
+    await access_log.flush()
+    token = await acquire_lease(WARMER_LEASE_KEY, CACHE_WARMER_INTERVAL * 1000)
+    if token is None:
+        return 0
+
+    cache_keys = list(dict.fromkeys(_pinned_keys + await hottest_keys(CACHE_WARMER_TOP_KEYS)))
+    specs = [spec for spec in map(spec_for_key, cache_keys) if spec is not None]
+    warmed = 0
+    for spec in await due_for_refresh(specs):
+        if single_flight.in_flight(spec.cache_key):
+            continue
+        if not await acquire_upstream_slot():
+            logger.info("Cache warmer rate limit reached, resuming next cycle")
+            break
+        try:
+            await single_flight.do(spec.cache_key, lambda spec=spec: refresh(spec, force=True))
+            warmed += 1
+        except Exception as e:
+            logger.warning("Warming '%s' failed: %s", spec.cache_key, e)
+
+    await decay_access_counts(CACHE_WARMER_DECAY)
+    logger.info("Cache warmer refreshed %d keys", warmed)
+    return warmed
+
+
+async def prefetch(specs: List[CacheSpec]) -> int:
+    """
+    Fetches the given keys if they are in neither cache tier, within the upstream rate limit.
+
+    :return: The number of keys fetched.
+    """
+    specs = [spec for spec in specs if spec.cache_key not in memory_cache and not single_flight.in_flight(spec.cache_key)]
+    if not specs:
+        return 0
+    keys = [key for spec in specs for key in (spec.cache_key, stale_key(spec.cache_key))]
+    values = await get_redis_client().mget(keys)
+    fetched = 0
+    for position, spec in enumerate(specs):
+        if values[2 * position] or values[2 * position + 1]:
+            continue
+        if not await acquire_upstream_slot():
+            break
+        await single_flight.do(spec.cache_key, lambda spec=spec: refresh(spec))
+        fetched += 1
+    return fetched
+
+
+def schedule_prefetch(specs: List[CacheSpec]) -> None:
+    """
+    Prefetches keys likely to be requested next in the background, if the warmer is enabled.
+
+    :param specs: The keys to prefetch.
+    """
+    if not warmer_enabled() or not specs or len(_prefetch_tasks) >= CACHE_PREFETCH_MAX_PENDING:
+        return
+
+    async def run():
+        try:
+            await prefetch(specs)
+        except Exception as e:
+            logger.warning("Prefetch failed: %s", e)
+
+    task = asyncio.create_task(run())
+    _prefetch_tasks.add(task)
+    task.add_done_callback(_prefetch_tasks.discard)
+
+
+async def run_warmer(interval: int) -> None:
+    """
+    Runs a warming cycle every interval seconds until cancelled.
+    """
+    while True:
+        try:
+            await warm_once()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("Cache warmer cycle failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+def start_cache_warmer() -> Optional[asyncio.Task]:
+    """
+    Starts recording key accesses and the warming loop if CACHE_WARMER_INTERVAL is set. Called from the app lifespan.
+    """
+    global _warmer_task
+    if not warmer_enabled():
+        return None
+    access_log.enabled = True
+    if _warmer_task is None or _warmer_task.done():
+        _warmer_task = asyncio.create_task(run_warmer(CACHE_WARMER_INTERVAL))
+    return _warmer_task
+
+
+async def stop_cache_warmer() -> None:
+    """
+    Cancels the warming loop and pending prefetches.
+    """
+    global _warmer_task
+    access_log.enabled = False
+    tasks = list(_prefetch_tasks)
+    if _warmer_task is not None:
+        tasks.append(_warmer_task)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _warmer_task = None
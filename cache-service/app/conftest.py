@@ -0,0 +1,233 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from .utils import redis_client as redis_client_module
+from .utils.memory_budget import PRUNE_EXPIRED_SCRIPT
+from .utils.memory_cache import memory_cache
+from .utils.resilience import upstream_breaker
+from .utils.single_flight import RELEASE_LEASE_SCRIPT
+
+
+class FakePipeline:
+    """
+    Queues commands and applies them to the FakeRedis on execute.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        self.client.pipelines_executed += 1
+        results = [await getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class FakeRedis:
+    """
+    A minimal in-memory stand-in for the asyncio Redis client, covering the commands the service uses.
+
+    Expiries are recorded in `ttls` but not enforced, so tests can assert on them.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self.published = []
+        self.pipelines_executed = 0
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    async def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        self.ttls[key] = px / 1000 if px else ex
+        return True
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def eval(self, script, numkeys, *args):
+        if script == RELEASE_LEASE_SCRIPT:
+            key, token = args
+            if self.data.get(key) == token:
+                return await self.delete(key)
+            return 0
+        if script == PRUNE_EXPIRED_SCRIPT:
+            sizes, expiry, now, limit = args
+            expired = (await self.zrangebyscore(expiry, "-inf", now))[:int(limit)]
+            if expired:
+                await self.hdel(sizes, *expired)
+                await self.zrem(expiry, *expired)
+            return len(expired)
+        raise NotImplementedError(script)
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+        return 0
+
+    async def pttl(self, key):
+        if key not in self.data:
+            return -2
+        ttl = self.ttls.get(key)
+        return -1 if ttl is None else int(ttl * 1000)
+
+    async def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
+
+    async def expire(self, key, ttl):
+        self.ttls[key] = ttl
+        return key in self.data
+
+    async def zincrby(self, key, amount, member):
+        scores = self.data.setdefault(key, {})
+        scores[member] = scores.get(member, 0) + amount
+        return scores[member]
+
+    async def zrevrange(self, key, start, end):
+        ranked = sorted(self.data.get(key, {}).items(), key=lambda item: -item[1])
+        return [member for member, _ in ranked][start:None if end == -1 else end + 1]
+
+    async def zunionstore(self, dest, keys):
+        scores = {}
+        for key, weight in keys.items():
+            for member, score in self.data.get(key, {}).items():
+                scores[member] = scores.get(member, 0) + score * weight
+        self.data[dest] = scores
+        return len(scores)
+
+    async def zremrangebyrank(self, key, start, end):
+        ranked = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        removed = ranked[start:None if end == -1 else end + 1] if end >= -len(ranked) else []
+        for member, _ in removed:
+            del self.data[key][member]
+        return len(removed)
+
+    async def sadd(self, key, *members):
+        values = self.data.setdefault(key, set())
+        added = len(set(members) - values)
+        values.update(members)
+        return added
+
+    async def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    async def hset(self, key, field, value):
+        fields = self.data.setdefault(key, {})
+        added = field not in fields
+        fields[field] = str(value)
+        return int(added)
+
+    async def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    async def hdel(self, key, *fields):
+        values = self.data.get(key, {})
+        return sum(values.pop(field, None) is not None for field in fields)
+
+    async def zadd(self, key, mapping):
+        scores = self.data.setdefault(key, {})
+        added = len(set(mapping) - set(scores))
+        scores.update(mapping)
+        return added
+
+    async def zrange(self, key, start, end):
+        ranked = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        return [member for member, _ in ranked][start:None if end == -1 else end + 1]
+
+    async def zrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        ranked = sorted(self.data.get(key, {}).items(), key=lambda item: item[1])
+        return [member for member, score in ranked if low <= score <= high]
+
+    async def zrem(self, key, *members):
+        scores = self.data.get(key, {})
+        return sum(scores.pop(member, None) is not None for member in members)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+@pytest.fixture(autouse=True)
+def clear_memory_cache():
+    """
+    Starts every test with an empty in-process cache tier.
+    """
+    memory_cache.clear()
+    yield
+    memory_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_upstream_breaker():
+    """
+    Starts every test with a closed circuit breaker.
+    """
+    upstream_breaker.reset()
+    yield
+    upstream_breaker.reset()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    """
+    Installs an in-memory FakeRedis as the shared Redis client.
+    """
+    client = FakeRedis()
+    monkeypatch.setattr(redis_client_module, '_redis_client', client)
+    # Exact expiries, so tests can assert on them
+    monkeypatch.setattr(redis_client_module, 'CACHE_TTL_JITTER', 0)
+    return client
+
+
+def mock_api_response(data, status=200, headers=None):
+    """
+    Builds a mock for aiohttp.ClientSession.get usable as an async context manager.
+    """
+    response = MagicMock()
+    response.status = status
+    response.headers = headers or {}
+    response.json = AsyncMock(return_value=data)
+    mock_get = MagicMock()
+    mock_get.return_value.__aenter__.return_value = response
+    return mock_get
+
+
+class StreamedBody:
+    """
+    Stands in for aiohttp's response.content, yielding the given lines as they are consumed.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.consumed = 0
+
+    def __aiter__(self):
+        self._iterator = iter(self.lines)
+        return self
+
+    async def __anext__(self):
+        try:
+            line = next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+        self.consumed += 1
+        return line
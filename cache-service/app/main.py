@@ -1,12 +1,66 @@
-from fastapi import FastAPI, HTTPException
+import logging
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from .models.dataset_models import DatasetResponse
-from .models.precipitation_model import PrecipitationResponse
-from .services.dataset_service import get_dataset
-from .services.precipitation_service import get_weekly_precipitation
+from .models.precipitation_model import PrecipitationResponse, PrecipitationBatchResponse, PrecipitationAggregateResponse
+from .services.dataset_service import get_dataset_payload, DATASET_CACHE_CONTROL, DATASET_CACHE_KEY
+from .services.precipitation_service import (
+    get_weekly_precipitation_payload, get_precipitation_cache_control, get_precipitation_range,
+    get_precipitation_batch_payload, get_precipitation_batch_cache_control, week_event_topics
+)
+from .services.aggregation_service import aggregate_precipitation
+from .services.catalog_service import get_dataset_metadata_payload, get_dataset_records_payload, records_params, dataset_cache_control, DatasetNotFound, DATASET_METADATA_TTL
+from .services.export_service import stream_precipitation_export, EXPORT_FORMATS
+from .utils.redis_client import init_redis_client, close_redis_client
+from .utils.http_client import init_http_client, close_http_client
+from .utils.invalidation import start_invalidation_listener, stop_invalidation_listener
+from .utils.event_hub import event_hub, TooManySubscribers, SSE_RETRY_MS
+from .store.ingest import start_store_sync, stop_store_sync
+from .cache_warmer import start_cache_warmer, stop_cache_warmer
+from .cache_middleware import cache_stats
+from .utils.payload import payload_response
+from .utils.formats import format_response
+from .utils.logging_config import configure_logging
+from .utils.metrics import HTTP_LATENCY, registry
+from .utils.resilience import CircuitOpen, UpstreamError
+from .utils.memory_budget import memory_usage
+from contextlib import asynccontextmanager
+import math
+import time
 from datetime import datetime
+from typing import Optional
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Sets up the shared resources used by the request handlers and releases them on shutdown.
+    """
+    # Create the shared Redis connection pool and upstream HTTP session
+    await init_redis_client()
+    await init_http_client()
+    # Drop in-memory entries when another worker refreshes them, and push refreshed keys to event streams
+    start_invalidation_listener()
+    event_hub.start()
+    # Keep the local precipitation mirror up to date, if one is configured
+    start_store_sync()
+    # Refresh hot keys before they expire and prefetch adjacent weeks, if enabled
+    start_cache_warmer()
+    yield
+    await stop_cache_warmer()
+    await stop_store_sync()
+    await event_hub.stop()
+    await stop_invalidation_listener()
+    # Close every pooled upstream and Redis connection
+    await close_http_client()
+    await close_redis_client()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,55 +68,349 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["ETag"],  # Let the frontend read the validators
 )
 
+
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    """
+    Records the latency of every request, labelled by route template so ids and dates do not multiply series.
+    """
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_LATENCY.observe(time.perf_counter() - start, request.method, route.path if route else "unmatched", str(status))
+
+
+def upstream_unavailable(e: UpstreamError) -> HTTPException:
+    """
+    Maps an upstream failure with no cached copy to fall back to: 503 while the circuit breaker is open, 502 otherwise.
+    """
+    if isinstance(e, CircuitOpen):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    return HTTPException(status_code=502, detail=str(e))
+
+
 @app.get("/dataset", response_model=DatasetResponse)
-async def get_bologna_dataset() -> DatasetResponse:
+async def get_bologna_dataset(request: Request):
     """
     Endpoint to fetch and return the Bologna precipitation dataset.
 
+    The body is the cached JSON validated at ingest, sent as-is, with a strong
+    ETag; a matching If-None-Match is answered with 304.
+
     :return: The Bologna precipitation dataset.
     :rtype: DatasetResponse
     """
     try:
-        # Call the get_dataset service to fetch the dataset
-        dataset = await get_dataset()
+        # Call the dataset service to fetch the stored dataset payload
+        payload = await get_dataset_payload()
 
-        # Return the dataset
-        return dataset
+        # Return the stored bytes without re-validating them
+        return payload_response(payload, request, DATASET_CACHE_CONTROL)
 
+    except UpstreamError as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise upstream_unavailable(e)
     except Exception as e:
         # If an exception occurs, raise an HTTPException
         raise HTTPException(status_code=500, detail=str(e))
     
 
+@app.get("/datasets/{dataset_id}")
+async def get_catalog_dataset(dataset_id: str, request: Request):
+    """
+    Endpoint to fetch the metadata of any dataset of the Bologna catalog.
+
+    :param dataset_id: The catalog dataset id, e.g. "precipitazioni_bologna".
+    :type dataset_id: str
+    :return: The dataset metadata, as returned by the catalog.
+    :rtype: dict
+    """
+    try:
+        payload = await get_dataset_metadata_payload(dataset_id)
+        return payload_response(payload, request, dataset_cache_control(DATASET_METADATA_TTL))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_id}' not found")
+    except UpstreamError as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise upstream_unavailable(e)
+    except Exception as e:
+        logger.exception("Request failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/datasets/{dataset_id}/records")
+async def get_catalog_dataset_records(
+    dataset_id: str,
+    request: Request,
+    select: Optional[str] = None,
+    where: Optional[str] = None,
+    order_by: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0
+):
+    """
+    Endpoint to fetch one page of records of any dataset of the Bologna catalog.
+
+    The query parameters are forwarded to the catalog records API. Records are
+    cached per query, for as long as the dataset's update frequency allows.
+
+    :param dataset_id: The catalog dataset id.
+    :type dataset_id: str
+    :return: The records page, as returned by the catalog.
+    :rtype: dict
+    """
+    try:
+        params = records_params(select, where, order_by, limit, offset)
+        payload, cache_control = await get_dataset_records_payload(dataset_id, params)
+        return payload_response(payload, request, cache_control, negotiate_format=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except DatasetNotFound:
+        raise HTTPException(status_code=404, detail=f"Dataset '{dataset_id}' not found")
+    except UpstreamError as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise upstream_unavailable(e)
+    except Exception as e:
+        logger.exception("Request failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/precipitation", response_model=PrecipitationResponse)
-async def get_weekly_precipitation_data(date: str):
+async def get_weekly_precipitation_data(date: str, request: Request):
     """
     Endpoint to fetch weekly precipitation data.
 
+    The body is the cached JSON validated at ingest, sent as-is, with a strong
+    ETag; a matching If-None-Match is answered with 304.
+
     :param date: The date for which to fetch the weekly precipitation data.
     :type date: str
     :return: The weekly precipitation data.
     :rtype: WeeklyPrecipitationResponse
     """
     try:
-        print("Fetching weekly precipitation data for " + date)
+        logger.debug("Fetching weekly precipitation data for %s", date)
         # Convert the date from a string to a datetime object
         start_date = datetime.strptime(date, "%Y-%m-%d")
 
-        print("Fetching weekly precipitation data for week starting " + str(start_date))
         # Fetch the weekly precipitation data
-        precipitation_data = await get_weekly_precipitation(start_date)
+        payload = await get_weekly_precipitation_payload(start_date)
 
-        print("Fetched data: " + str(precipitation_data))
-        # Return the fetched data
-        return precipitation_data.model_dump()
+        logger.debug("Fetched %d bytes of precipitation data", len(payload.body))
+        # Return the stored bytes without re-validating them
+        return payload_response(payload, request, get_precipitation_cache_control(start_date), negotiate_format=True)
     except ValueError as e:
-        print("Error: " + str(e))
+        logger.info("Invalid request: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+    except UpstreamError as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise upstream_unavailable(e)
     except Exception as e:
-        print("Error: " + str(e))
+        logger.exception("Request failed: %s", e)
         # Raise an error if any other exception occurs
         raise HTTPException(status_code=500, detail=str(e))
-    
\ No newline at end of file
+
+
+@app.get("/precipitation/range", response_model=PrecipitationResponse)
+async def get_precipitation_range_data(start: str, end: str, request: Request):
+    """
+    Endpoint to fetch precipitation data for an arbitrary date range.
+
+    The range is assembled from cached weekly chunks, so a year-long chart costs
+    one request and one Redis round trip.
+
+    :param start: The first date of the range (YYYY-MM-DD).
+    :type start: str
+    :param end: The last date of the range (YYYY-MM-DD).
+    :type end: str
+    :return: The precipitation records of the range, in date order.
+    :rtype: PrecipitationResponse
+    """
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        end_date = datetime.strptime(end, "%Y-%m-%d")
+        logger.debug("Fetching precipitation data from %s to %s", start, end)
+        precipitation_data = await get_precipitation_range(start_date, end_date)
+        return format_response(precipitation_data, request)
+    except ValueError as e:
+        logger.info("Invalid request: %s", e)
+        # Invalid dates or range
+        raise HTTPException(status_code=400, detail=str(e))
+    except UpstreamError as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise upstream_unavailable(e)
+    except Exception as e:
+        logger.exception("Request failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/precipitation/batch", response_model=PrecipitationBatchResponse)
+async def get_precipitation_batch_data(dates: str, request: Request):
+    """
+    Endpoint to fetch the weekly precipitation data of many dates in one request.
+
+    Dates in the same week share one entry, and every week is read with a
+    single Redis round trip, so a dashboard showing many days costs one request
+    instead of one per date.
+
+    :param dates: Comma-separated dates (YYYY-MM-DD).
+    :type dates: str
+    :return: The week of every date and the records of every week.
+    :rtype: PrecipitationBatchResponse
+    """
+    try:
+        requested_dates = [datetime.strptime(date.strip(), "%Y-%m-%d") for date in dates.split(",") if date.strip()]
+        logger.debug("Fetching precipitation data for %d dates", len(requested_dates))
+        payload = await get_precipitation_batch_payload(requested_dates)
+        return payload_response(payload, request, get_precipitation_batch_cache_control(requested_dates))
+    except ValueError as e:
+        logger.info("Invalid request: %s", e)
+        # Invalid or too many dates
+        raise HTTPException(status_code=400, detail=str(e))
+    except UpstreamError as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise upstream_unavailable(e)
+    except Exception as e:
+        logger.exception("Request failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/precipitation/aggregate", response_model=PrecipitationAggregateResponse)
+async def get_precipitation_aggregate(start: str, end: str, request: Request, group_by: str = "month", percentiles: Optional[str] = None):
+    """
+    Endpoint to aggregate precipitation data by ISO week, month, year or stagione.
+
+    Each group reports the sum, mean and maximum of `avg_184_d`, the number of
+    rainy days and the requested percentiles.
+
+    :param start: The first date of the range (YYYY-MM-DD).
+    :type start: str
+    :param end: The last date of the range (YYYY-MM-DD).
+    :type end: str
+    :param group_by: One of "week", "month", "year" or "stagione".
+    :type group_by: str
+    :param percentiles: Comma-separated percentiles, e.g. "50,90,99".
+    :type percentiles: str
+    :return: The statistics of every group, in order.
+    :rtype: PrecipitationAggregateResponse
+    """
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        end_date = datetime.strptime(end, "%Y-%m-%d")
+        requested_percentiles = [float(pct) for pct in percentiles.split(",") if pct] if percentiles is not None else None
+        logger.debug("Aggregating precipitation data by %s from %s to %s", group_by, start, end)
+        aggregate = await aggregate_precipitation(start_date, end_date, group_by, requested_percentiles)
+        return format_response(aggregate, request)
+    except ValueError as e:
+        logger.info("Invalid request: %s", e)
+        # Invalid dates, grouping or percentiles
+        raise HTTPException(status_code=400, detail=str(e))
+    except UpstreamError as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise upstream_unavailable(e)
+    except Exception as e:
+        logger.exception("Request failed: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/precipitation/export")
+async def export_precipitation(start: str, end: str, format: str = "ndjson"):
+    """
+    Endpoint to stream every precipitation record of a date range as NDJSON or CSV.
+
+    Records are encoded and sent as they are read, so any range can be
+    exported with constant memory.
+
+    :param start: The first date of the range (YYYY-MM-DD).
+    :type start: str
+    :param end: The last date of the range (YYYY-MM-DD).
+    :type end: str
+    :param format: "ndjson" (default) or "csv".
+    :type format: str
+    :return: The streamed records.
+    :rtype: StreamingResponse
+    """
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d")
+        end_date = datetime.strptime(end, "%Y-%m-%d")
+        logger.debug("Exporting precipitation data from %s to %s as %s", start, end, format)
+        chunks = await stream_precipitation_export(start_date, end_date, format)
+    except ValueError as e:
+        logger.info("Invalid request: %s", e)
+        # Invalid dates or format
+        raise HTTPException(status_code=400, detail=str(e))
+    except UpstreamError as e:
+        logger.warning("Upstream unavailable: %s", e)
+        raise upstream_unavailable(e)
+
+    headers = {"Content-Disposition": f'attachment; filename="precipitation_{start}_{end}.{format}"'}
+    return StreamingResponse(chunks, media_type=EXPORT_FORMATS[format], headers=headers)
+
+
+@app.get("/events")
+async def stream_events(dates: Optional[str] = None, dataset: bool = False):
+    """
+    Endpoint streaming updates as Server-Sent Events, so dashboards need not poll.
+
+    Whenever a followed key is refreshed by any worker and its value changed,
+    an `update` event is sent with the topic ("dataset" or
+    "precipitation:<Monday>") and, unless it is larger than
+    SSE_MAX_PAYLOAD_BYTES, the new value under "data".
+
+    :param dates: Comma-separated dates (YYYY-MM-DD) whose weeks to follow.
+    :type dates: str
+    :param dataset: Whether to follow the dataset metadata, e.g. its `modified` timestamp.
+    :type dataset: bool
+    :return: The event stream.
+    :rtype: StreamingResponse
+    """
+    try:
+        followed_dates = [datetime.strptime(date.strip(), "%Y-%m-%d") for date in (dates or "").split(",") if date.strip()]
+        topics = week_event_topics(followed_dates)
+        if dataset:
+            topics[DATASET_CACHE_KEY] = "dataset"
+        if not topics:
+            raise ValueError("Follow at least one date or the dataset")
+        subscription = event_hub.subscribe(topics)
+    except ValueError as e:
+        logger.info("Invalid request: %s", e)
+        # Invalid or too many dates
+        raise HTTPException(status_code=400, detail=str(e))
+    except TooManySubscribers:
+        logger.warning("Refusing an event stream, %d are already open", len(event_hub))
+        raise HTTPException(status_code=503, detail="Too many event streams", headers={"Retry-After": str(math.ceil(SSE_RETRY_MS / 1000))})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(event_hub.stream(subscription), media_type="text/event-stream", headers=headers)
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Endpoint to report hit/miss counts of the in-memory and Redis cache tiers.
+
+    :return: The counters of each tier, the in-memory usage and the Redis usage of every key family.
+    :rtype: dict
+    """
+    return {**cache_stats(), "redis_memory": await memory_usage()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Endpoint exposing this worker's metrics in the Prometheus text format.
+
+    Covers cache hits and misses per key family and tier, upstream, Redis and
+    endpoint latency histograms, and in-flight and coalesced fetches.
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,154 @@
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .precipitation_model import PrecipitationRecord, PrecipitationResponse
+from ..store.precipitation_store import CODE_DTYPE, DAY_DTYPE, VALUE_DTYPE
+from ..utils.formats import dumps, loads
+
+# Every container shares one table of stagione names, so codes mean the same in all of them
+CATEGORIES: List[str] = []
+_category_codes: Dict[str, int] = {}
+
+
+def intern_category(name: str) -> int:
+    """
+    Returns the shared code of a stagione name, adding it to the table on first use.
+
+    :raises ValueError: If the name is not a string, or the table is full.
+    """
+    code = _category_codes.get(name)
+    if code is None:
+        if not isinstance(name, str):
+            raise ValueError(f"Invalid stagione {name!r}")
+        if len(CATEGORIES) > np.iinfo(CODE_DTYPE).max:
+            raise ValueError("Too many distinct stagione values")
+        code = _category_codes[name] = len(CATEGORIES)
+        CATEGORIES.append(name)
+    return code
+
+
+class PrecipitationColumns:
+    """
+    A compact, columnar set of precipitation records, sorted by date.
+
+    Records are held as three typed NumPy arrays instead of one Pydantic object
+    per row: the day number since 1970-01-01 (int32), `avg_184_d` (float64) and
+    `stagione` as a uint8 code into the shared CATEGORIES table, about 13 bytes
+    per record. It is what fetches produce and ranges are assembled from;
+    records are only turned into dicts or PrecipitationResponse models when a
+    response is built.
+    """
+
+    __slots__ = ("days", "values", "codes")
+
+    def __init__(self, days: np.ndarray, values: np.ndarray, codes: np.ndarray):
+        self.days = days
+        self.values = values
+        self.codes = codes
+
+    @classmethod
+    def empty(cls) -> "PrecipitationColumns":
+        return cls(np.empty(0, dtype=DAY_DTYPE), np.empty(0, dtype=VALUE_DTYPE), np.empty(0, dtype=CODE_DTYPE))
+
+    @classmethod
+    def from_records(cls, records: Sequence[Dict[str, Any]]) -> "PrecipitationColumns":
+        """
+        Builds the columns from records shaped like PrecipitationRecord, checking each field's type.
+
+        :param records: Dicts with `date` (YYYY-MM-DD, optionally followed by a time), `avg_184_d` and `stagione`.
+        :return: The records as columns, sorted by date.
+        :raises ValueError: If a record misses a field or has an invalid value.
+        """
+        try:
+            days = np.array([record["date"][:10] for record in records], dtype="datetime64[D]").astype(DAY_DTYPE)
+            values = np.fromiter((float(record["avg_184_d"]) for record in records), dtype=VALUE_DTYPE, count=len(records))
+            codes = np.fromiter((intern_category(record["stagione"]) for record in records), dtype=CODE_DTYPE, count=len(records))
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid precipitation record: {e!r}") from e
+        return cls(days, values, codes).sorted()
+
+    @classmethod
+    def from_json(cls, body: bytes) -> "PrecipitationColumns":
+        """
+        Builds the columns from a JSON body shaped like PrecipitationResponse.
+        """
+        return cls.from_records(loads(body)["results"])
+
+    @classmethod
+    def from_codes(cls, days: np.ndarray, values: np.ndarray, codes: np.ndarray, categories: Sequence[str]) -> "PrecipitationColumns":
+        """
+        Builds the columns from arrays whose category codes index their own table, e.g. the local mirror's.
+
+        The arrays are copied, so memory-mapped columns are not kept open.
+        """
+        lookup = np.array([intern_category(name) for name in categories], dtype=CODE_DTYPE)
+        codes = lookup[codes] if len(codes) else np.empty(0, dtype=CODE_DTYPE)
+        return cls(np.array(days, dtype=DAY_DTYPE), np.array(values, dtype=VALUE_DTYPE), codes)
+
+    @classmethod
+    def concat(cls, parts: Iterable["PrecipitationColumns"]) -> "PrecipitationColumns":
+        """
+        Joins several containers, e.g. consecutive weeks, into one sorted by date.
+        """
+        parts = list(parts)
+        if not parts:
+            return cls.empty()
+        return cls(
+            np.concatenate([part.days for part in parts]),
+            np.concatenate([part.values for part in parts]),
+            np.concatenate([part.codes for part in parts])
+        ).sorted()
+
+    def sorted(self) -> "PrecipitationColumns":
+        """
+        Returns the records in date order, itself if they already are.
+        """
+        if np.all(self.days[1:] >= self.days[:-1]):
+            return self
+        order = np.argsort(self.days, kind="stable")
+        return PrecipitationColumns(self.days[order], self.values[order], self.codes[order])
+
+    def between(self, first_day: int, last_day: int) -> "PrecipitationColumns":
+        """
+        Returns views of the records between two day numbers, inclusive.
+        """
+        lo = int(np.searchsorted(self.days, first_day, side="left"))
+        hi = int(np.searchsorted(self.days, last_day, side="right"))
+        return PrecipitationColumns(self.days[lo:hi], self.values[lo:hi], self.codes[lo:hi])
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    @property
+    def nbytes(self) -> int:
+        return self.days.nbytes + self.values.nbytes + self.codes.nbytes
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the records as a dict shaped like PrecipitationResponse.
+        """
+        dates = np.datetime_as_string(self.days.astype("datetime64[D]")).tolist()
+        categories = CATEGORIES
+        results = [
+            {"date": day, "avg_184_d": value, "stagione": categories[code]}
+            for day, value, code in zip(dates, self.values.tolist(), self.codes.tolist())
+        ]
+        return {"total_count": len(results), "results": results}
+
+    def to_json(self) -> bytes:
+        """
+        Returns the records as the JSON body of a PrecipitationResponse.
+        """
+        return dumps(self.to_dict())
+
+    def to_model(self, total_count: Optional[int] = None) -> PrecipitationResponse:
+        """
+        Builds the PrecipitationResponse model of the records, for callers that need one.
+
+        The fields were checked when the columns were built, so the models are not validated again.
+
+        :param total_count: The total reported in the model, defaults to the number of records.
+        """
+        results = [PrecipitationRecord.model_construct(**record) for record in self.to_dict()["results"]]
+        return PrecipitationResponse.model_construct(total_count=len(results) if total_count is None else total_count, results=results)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, List
 
 class PrecipitationRecord(BaseModel):
     date: str
@@ -9,3 +9,24 @@ class PrecipitationRecord(BaseModel):
 class PrecipitationResponse(BaseModel):
     total_count: int
     results: List[PrecipitationRecord]
+
+class PrecipitationBatchResponse(BaseModel):
+    # The Monday (YYYY-MM-DD) of the week of each requested date
+    dates: Dict[str, str]
+    # The records of each week, keyed by its Monday
+    weeks: Dict[str, PrecipitationResponse]
+
+class PrecipitationAggregate(BaseModel):
+    period: str
+    count: int
+    sum: float
+    mean: float
+    max: float
+    rainy_days: int
+    percentiles: Dict[str, float]
+
+class PrecipitationAggregateResponse(BaseModel):
+    group_by: str
+    start: str
+    end: str
+    results: List[PrecipitationAggregate]
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from .precipitation_columns import CATEGORIES, PrecipitationColumns
+from .precipitation_model import PrecipitationResponse
+from ..store.precipitation_store import date_to_day
+
+
+def test_from_records_sorts_and_round_trips():
+    """
+    Test that records are packed in date order with shared category codes and rebuilt unchanged.
+    """
+    records = [
+        {"date": "2023-03-21T00:00:00+00:00", "avg_184_d": 2.5, "stagione": "Primavera"},
+        {"date": "2023-01-01", "avg_184_d": 0.0, "stagione": "Inverno"},
+        {"date": "2023-01-02", "avg_184_d": 7, "stagione": "Inverno"}
+    ]
+
+    columns = PrecipitationColumns.from_records(records)
+
+    assert columns.days.tolist() == [date_to_day("2023-01-01"), date_to_day("2023-01-02"), date_to_day("2023-03-21")]
+    assert [CATEGORIES[code] for code in columns.codes] == ["Inverno", "Inverno", "Primavera"]
+    assert columns.nbytes == 3 * (4 + 8 + 1)
+    assert columns.to_dict() == {
+        "total_count": 3,
+        "results": [
+            {"date": "2023-01-01", "avg_184_d": 0.0, "stagione": "Inverno"},
+            {"date": "2023-01-02", "avg_184_d": 7.0, "stagione": "Inverno"},
+            {"date": "2023-03-21", "avg_184_d": 2.5, "stagione": "Primavera"}
+        ]
+    }
+    assert columns.to_model() == PrecipitationResponse(**columns.to_dict())
+    assert PrecipitationColumns.from_json(columns.to_json()).to_dict() == columns.to_dict()
+
+
+@pytest.mark.parametrize("record", [
+    {"date": "2023-01-01", "avg_184_d": None, "stagione": "Inverno"},
+    {"date": "2023-01-01", "avg_184_d": "wet", "stagione": "Inverno"},
+    {"date": "not a date", "avg_184_d": 1.0, "stagione": "Inverno"},
+    {"date": "2023-01-01", "avg_184_d": 1.0}
+])
+def test_from_records_rejects_invalid_records(record):
+    """
+    Test that a record with a missing or mistyped field is refused, as the Pydantic model would.
+    """
+    with pytest.raises(ValueError):
+        PrecipitationColumns.from_records([record])
+
+
+def test_concat_and_between_select_a_range_across_parts():
+    """
+    Test that columns from the local mirror's own category table and from records join into one sorted range.
+    """
+    mirror = PrecipitationColumns.from_codes(
+        np.array([date_to_day("2023-01-09"), date_to_day("2023-01-10")]), np.array([1.0, 2.0]), np.array([1, 0]), ["Estate", "Autunno"]
+    )
+    records = PrecipitationColumns.from_records([{"date": "2023-01-03", "avg_184_d": 3.0, "stagione": "Estate"}])
+
+    selected = PrecipitationColumns.concat([mirror, records]).between(date_to_day("2023-01-03"), date_to_day("2023-01-09"))
+
+    assert [(record["date"], record["stagione"]) for record in selected.to_dict()["results"]] == [
+        ("2023-01-03", "Estate"), ("2023-01-09", "Autunno")
+    ]
+    assert len(PrecipitationColumns.concat([])) == 0
@@ -0,0 +1,293 @@
+import asyncio
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ..cache_middleware import enforce_memory_budgets
+from ..models.precipitation_columns import CATEGORIES, PrecipitationColumns
+from ..store.precipitation_store import date_to_day, day_to_date, get_precipitation_store
+from ..utils.codec import decode, encode
+from ..utils.date_utils import CLOSED_WEEK_GRACE_DAYS
+from ..utils.formats import dumps, loads
+from ..utils.memory_budget import queue_accounting
+from ..utils.redis_client import get_redis_client, jittered_ttl, mget
+from .dataset_service import get_dataset_version
+from .precipitation_service import MAX_RANGE_DAYS, get_precipitation_range_columns
+
+GROUP_BY_OPTIONS = ("week", "month", "year", "stagione")
+DEFAULT_PERCENTILES = (50.0, 90.0, 99.0)
+
+# A day with at least this much rain (mm) counts as rainy
+RAINY_DAY_THRESHOLD_MM = float(os.getenv('RAINY_DAY_THRESHOLD_MM', 1.0))
+# Closed-period rollups are keyed by dataset version, so old versions just age out
+ROLLUP_TTL = 30 * 86400
+
+
+class Period:
+    """
+    One calendar period of a grouping, with the group key used by the NumPy reductions.
+    """
+
+    __slots__ = ("key", "label", "first_day", "last_day")
+
+    def __init__(self, key: int, label: str, first_day: int, last_day: int):
+        self.key = key
+        self.label = label
+        self.first_day = first_day
+        self.last_day = last_day
+
+
+def group_keys(days: np.ndarray, group_by: str) -> np.ndarray:
+    """
+    Maps day numbers to the integer key of their calendar period, vectorized.
+
+    Weeks are keyed by the day number of their Monday (1970-01-01 was a
+    Thursday), months by the months since 1970-01 and years by the year.
+    """
+    if group_by == "week":
+        return days - (days + 3) % 7
+    dates = days.astype("datetime64[D]")
+    if group_by == "month":
+        return dates.astype("datetime64[M]").astype(np.int64)
+    return dates.astype("datetime64[Y]").astype(np.int64) + 1970
+
+
+def iter_periods(group_by: str, first_day: int, last_day: int) -> List[Period]:
+    """
+    Lists the calendar periods overlapping a range of day numbers, in order.
+    """
+    periods = []
+    current = day_to_date(first_day)
+    last = day_to_date(last_day)
+    if group_by == "week":
+        current -= timedelta(days=current.weekday())
+    elif group_by == "month":
+        current = current.replace(day=1)
+    else:
+        current = current.replace(month=1, day=1)
+
+    while current <= last:
+        if group_by == "week":
+            following = current + timedelta(days=7)
+            iso_year, iso_week, _ = current.isocalendar()
+            key, label = date_to_day(current), f"{iso_year}-W{iso_week:02d}"
+        elif group_by == "month":
+            following = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+            key, label = (current.year - 1970) * 12 + current.month - 1, f"{current.year}-{current.month:02d}"
+        else:
+            following = date(current.year + 1, 1, 1)
+            key, label = current.year, str(current.year)
+        periods.append(Period(key, label, date_to_day(current), date_to_day(following) - 1))
+        current = following
+    return periods
+
+
+def grouped_stats(keys: np.ndarray, values: np.ndarray, percentiles: Sequence[float]) -> Dict[int, Dict]:
+    """
+    Computes the statistics of every group with NumPy grouped reductions.
+
+    :param keys: The group key of every row; rows of a group need not be contiguous.
+    :param values: The `avg_184_d` value of every row.
+    :param percentiles: The percentiles to compute, between 0 and 100.
+    :return: A mapping of group key to its statistics.
+    """
+    if len(values) == 0:
+        return {}
+    if np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind="stable")
+        keys, values = keys[order], values[order]
+
+    starts = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    counts = np.diff(np.append(starts, len(values)))
+    sums = np.add.reduceat(values, starts)
+    maxima = np.maximum.reduceat(values, starts)
+    rainy_days = np.add.reduceat((values >= RAINY_DAY_THRESHOLD_MM).astype(np.int64), starts)
+
+    stats = {}
+    for index, start in enumerate(starts.tolist()):
+        group_values = values[start:start + counts[index]]
+        quantiles = np.percentile(group_values, percentiles) if len(percentiles) else []
+        stats[int(keys[start])] = {
+            "count": int(counts[index]),
+            "sum": round(float(sums[index]), 3),
+            "mean": round(float(sums[index] / counts[index]), 3),
+            "max": round(float(maxima[index]), 3),
+            "rainy_days": int(rainy_days[index]),
+            "percentiles": {f"p{pct:g}": round(float(quantile), 3) for pct, quantile in zip(percentiles, quantiles)}
+        }
+    return stats
+
+
+async def load_columns(start_date: datetime, end_date: datetime) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[str]]:
+    """
+    Loads the day, value and category code columns of a date range.
+
+    Uses the local mirror when it covers the range, otherwise the cached weekly
+    chunks, read in slices of at most MAX_RANGE_DAYS days so ranges of any
+    length can be aggregated.
+    """
+    store = get_precipitation_store()
+    if store is not None and store.covers(end_date):
+        days, values, codes = store.columns(start_date, end_date)
+        return days, values, codes, store.categories
+
+    slices = []
+    slice_start = start_date
+    while slice_start <= end_date:
+        slice_end = min(end_date, slice_start + timedelta(days=MAX_RANGE_DAYS - 1))
+        # One slice at a time, each already fetches its missing weeks concurrently
+        slices.append(await get_precipitation_range_columns(slice_start, slice_end))
+        slice_start = slice_end + timedelta(days=1)
+    columns = PrecipitationColumns.concat(slices)
+    return columns.days, columns.values, columns.codes, CATEGORIES
+
+
+def rollup_key(version: str, group_by: str, percentiles: Sequence[float], label: str) -> str:
+    """
+    Returns the Redis key of the precomputed rollup of a closed period, or of a closed range grouped by stagione.
+    """
+    pcts = ",".join(f"{pct:g}" for pct in percentiles)
+    return f"precipitation_rollup_{version}_{group_by}_{pcts}_{label}"
+
+
+def missing_runs(periods: List[Period], cached: Dict[int, Dict]) -> List[List[Period]]:
+    """
+    Splits the periods without a cached rollup into runs of consecutive periods, each loaded as one range.
+    """
+    runs: List[List[Period]] = []
+    previous = None
+    for index, period in enumerate(periods):
+        if period.key in cached:
+            continue
+        if runs and previous == index - 1:
+            runs[-1].append(period)
+        else:
+            runs.append([period])
+        previous = index
+    return runs
+
+
+async def compute_run(run: List[Period], first_day: int, last_day: int, group_by: str, percentiles: Sequence[float]) -> Dict[int, Dict]:
+    """
+    Computes the statistics of a run of consecutive periods from their columns, clipped to the requested range.
+    """
+    run_start = datetime.combine(day_to_date(max(first_day, run[0].first_day)), datetime.min.time())
+    run_end = datetime.combine(day_to_date(min(last_day, run[-1].last_day)), datetime.min.time())
+    days, values, _, _ = await load_columns(run_start, run_end)
+    return grouped_stats(group_keys(np.asarray(days, dtype=np.int64), group_by), np.asarray(values), percentiles)
+
+
+async def store_rollups(rollups: Dict[str, Dict]) -> None:
+    """
+    Writes closed-period rollups in one pipelined round trip, in the storage codec and counted in their family's memory budget.
+
+    Unlike queue_store, no last known copy or metadata is written: a rollup is
+    keyed by dataset version and never changes, it is only recomputed once expired.
+
+    :param rollups: A mapping of rollup key to statistics; empty statistics mark a period without records.
+    """
+    if not rollups:
+        return
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for key, group in rollups.items():
+            stored = encode(dumps(group))
+            ttl = jittered_ttl(ROLLUP_TTL)
+            pipe.set(key, stored, ex=ttl)
+            queue_accounting(pipe, key, len(stored), ttl)
+        await pipe.execute()
+    await enforce_memory_budgets(list(rollups))
+
+
+async def aggregate_precipitation(
+    start_date: datetime,
+    end_date: datetime,
+    group_by: str,
+    percentiles: Optional[Sequence[float]] = None,
+    today: Optional[datetime] = None
+) -> Dict:
+    """
+    Aggregates precipitation records by ISO week, month, year or stagione.
+
+    Calendar periods that are closed and lie entirely inside the range are read
+    from precomputed rollups in one MGET. Only the runs of consecutive periods
+    without one are loaded and computed from the columns, and the closed ones
+    among them are written back in one pipeline, including those without any
+    record. Grouping by stagione spans the whole range, so it is cached as one
+    rollup of the range when the whole range is closed.
+
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range.
+    :param group_by: One of "week", "month", "year" or "stagione".
+    :param percentiles: The percentiles to compute, defaults to DEFAULT_PERCENTILES.
+    :param today: The current date, defaults to now.
+    :return: A dict shaped like PrecipitationAggregateResponse.
+    :raises ValueError: If the grouping, range or percentiles are invalid.
+    """
+    if group_by not in GROUP_BY_OPTIONS:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY_OPTIONS)}")
+    if end_date < start_date:
+        raise ValueError("The end date must not be before the start date")
+    percentiles = tuple(DEFAULT_PERCENTILES if percentiles is None else percentiles)
+    if any(not 0 <= pct <= 100 for pct in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+
+    response = {"group_by": group_by, "start": start_date.strftime("%Y-%m-%d"), "end": end_date.strftime("%Y-%m-%d")}
+    first_day, last_day = date_to_day(start_date), date_to_day(end_date)
+
+    closed_before = date_to_day(today or datetime.now()) - CLOSED_WEEK_GRACE_DAYS
+
+    if group_by == "stagione":
+        range_key = None
+        if last_day < closed_before:
+            version = await get_dataset_version()
+            range_key = rollup_key(version, group_by, percentiles, f"{response['start']}_{response['end']}")
+            cached = (await mget([range_key]))[0]
+            if cached:
+                response["results"] = loads(decode(cached))["results"]
+                return response
+
+        _, values, codes, categories = await load_columns(start_date, end_date)
+        stats = grouped_stats(np.asarray(codes, dtype=np.int64), np.asarray(values), percentiles)
+        response["results"] = sorted(
+            ({"period": categories[code], **group} for code, group in stats.items()),
+            key=lambda group: group["period"]
+        )
+        if range_key is not None:
+            await store_rollups({range_key: {"results": response["results"]}})
+        return response
+
+    periods = iter_periods(group_by, first_day, last_day)
+    cacheable = [
+        period for period in periods
+        if period.first_day >= first_day and period.last_day <= last_day and period.last_day < closed_before
+    ]
+
+    rollups: Dict[int, Optional[Dict]] = {}
+    version = None
+    if cacheable:
+        version = await get_dataset_version()
+        cached = await mget(rollup_key(version, group_by, percentiles, period.label) for period in cacheable)
+        for period, value in zip(cacheable, cached):
+            if value:
+                rollups[period.key] = loads(decode(value))
+
+    runs = missing_runs(periods, rollups)
+    if runs:
+        computed: Dict[int, Dict] = {}
+        for stats in await asyncio.gather(*(compute_run(run, first_day, last_day, group_by, percentiles) for run in runs)):
+            computed.update(stats)
+
+        new_rollups = {}
+        cacheable_keys = {period.key for period in cacheable}
+        for period in (period for run in runs for period in run):
+            group = computed.get(period.key, {})
+            rollups[period.key] = group
+            if period.key in cacheable_keys:
+                new_rollups[rollup_key(version, group_by, percentiles, period.label)] = group
+        await store_rollups(new_rollups)
+
+    # Periods without any record have an empty rollup and are left out
+    response["results"] = [{"period": period.label, **rollups[period.key]} for period in periods if rollups.get(period.key)]
+    return response
@@ -0,0 +1,349 @@
+import asyncio
+import hashlib
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from ..cache_middleware import CacheSpec, cache_lookup, store_many, CACHE_FETCH_CONCURRENCY
+from ..utils.formats import dumps, loads
+from ..utils.http_client import NotModified, UpstreamValidators, OPENDATA_API_URL
+from ..utils.payload import CachedPayload
+from ..utils.resilience import UpstreamError, fetch_upstream
+
+logger = logging.getLogger(__name__)
+
+CATALOG_URL = f"{OPENDATA_API_URL}/catalog/datasets"
+
+# Dataset ids are used in upstream URLs and cache keys, so only allow the catalog's own alphabet
+DATASET_ID_PATTERN = re.compile(r"^[a-z0-9_\-]{1,128}$")
+
+CATALOG_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=3, sock_read=12)
+
+# Metadata is small and cheap to revalidate with its ETag
+DATASET_METADATA_TTL = 3600
+# Records TTL for datasets without a known update frequency
+DEFAULT_RECORDS_TTL = 3600
+
+# Records TTL per DCAT accrualperiodicity / update_frequency
+UPDATE_FREQUENCY_TTLS = {
+    "CONT": 300,
+    "UPDATE_CONT": 300,
+    "HOURLY": 900,
+    "DAILY": 3600,
+    "WEEKLY": 6 * 3600,
+    "BIWEEKLY": 12 * 3600,
+    "MONTHLY": 86400,
+    "BIMONTHLY": 86400,
+    "QUARTERLY": 3 * 86400,
+    "BIENNIAL": 7 * 86400,
+    "ANNUAL": 7 * 86400,
+    "IRREG": DEFAULT_RECORDS_TTL,
+    "NEVER": 30 * 86400
+}
+
+# Free-text update frequencies found in the catalog, mapped to DCAT codes
+UPDATE_FREQUENCY_ALIASES = {
+    "CONTINUOUS": "CONT",
+    "CONTINUO": "CONT",
+    "ORARIO": "HOURLY",
+    "GIORNALIERO": "DAILY",
+    "GIORNALIERA": "DAILY",
+    "SETTIMANALE": "WEEKLY",
+    "MENSILE": "MONTHLY",
+    "TRIMESTRALE": "QUARTERLY",
+    "ANNUALE": "ANNUAL",
+    "YEARLY": "ANNUAL",
+    "IRREGULAR": "IRREG",
+    "IRREGOLARE": "IRREG",
+    "MAI": "NEVER"
+}
+
+# Record query parameters forwarded to the upstream, part of the cache key
+RECORDS_PARAMS = ("select", "where", "order_by", "limit", "offset")
+# The records endpoint returns at most 100 records per request
+MAX_RECORDS_LIMIT = 100
+
+
+# The records TTL of each dataset, with the ETag of the metadata it was read from
+_records_ttls: Dict[str, Tuple[str, int]] = {}
+
+
+class DatasetNotFound(Exception):
+    """
+    Raised when the catalog has no dataset with the requested id.
+    """
+
+
+def validate_dataset_id(dataset_id: str) -> str:
+    """
+    :raises ValueError: If the id is not a valid catalog dataset id.
+    """
+    if not DATASET_ID_PATTERN.match(dataset_id):
+        raise ValueError(f"Invalid dataset id '{dataset_id}'")
+    return dataset_id
+
+
+def metadata_key(dataset_id: str) -> str:
+    """
+    Returns the cache key of a dataset's metadata, in the dataset's own namespace.
+    """
+    return f"dataset:{dataset_id}:metadata"
+
+
+def records_key(dataset_id: str, params: Dict[str, Any]) -> str:
+    """
+    Returns the cache key of one records query of a dataset, in the dataset's own namespace.
+    """
+    digest = hashlib.blake2b(dumps(sorted(params.items())), digest_size=12).hexdigest()
+    return f"dataset:{dataset_id}:records:{digest}"
+
+
+def update_frequency_code(value: Optional[str]) -> Optional[str]:
+    """
+    Normalizes a DCAT frequency URI, code or free-text update frequency to a DCAT code.
+    """
+    if not value:
+        return None
+    code = value.rstrip("/").rsplit("/", 1)[-1].strip().upper().replace(" ", "_")
+    return UPDATE_FREQUENCY_ALIASES.get(code, code)
+
+
+def records_ttl(metadata: Dict) -> int:
+    """
+    Returns how long the records of a dataset may be cached, from how often it is updated.
+
+    The DCAT `accrualperiodicity` is used when set, then the `update_frequency`
+    of the default metadata; datasets declaring neither get DEFAULT_RECORDS_TTL.
+
+    :param metadata: The dataset metadata, as returned by the catalog.
+    :return: The soft TTL in seconds.
+    """
+    metas = metadata.get("metas") or {}
+    candidates = [
+        (metas.get("dcat") or {}).get("accrualperiodicity"),
+        (metas.get("default") or {}).get("update_frequency")
+    ]
+    for candidate in candidates:
+        ttl = UPDATE_FREQUENCY_TTLS.get(update_frequency_code(candidate))
+        if ttl is not None:
+            return ttl
+    return DEFAULT_RECORDS_TTL
+
+
+async def fetch_catalog_json(url: str, params: Dict[str, Any], validators: Optional[UpstreamValidators] = None) -> Dict:
+    """
+    Fetches one JSON document from the catalog API.
+
+    :param url: The catalog URL.
+    :param params: The query parameters.
+    :param validators: Validators of the cached copy, sent as a conditional request and
+        updated from the response.
+    :return: The parsed document.
+    :raises NotModified: If the validators still match the upstream data.
+    :raises DatasetNotFound: If the upstream answers 404.
+    :raises UpstreamError: If the API request fails.
+    """
+    headers = validators.request_headers() if validators else None
+    response = await fetch_upstream("catalog", url, params=params, headers=headers, timeout=CATALOG_TIMEOUT)
+    if response.status == 304 and validators:
+        raise NotModified()
+    if response.status == 404:
+        raise DatasetNotFound(url)
+    if response.status != 200:
+        raise UpstreamError("Failed to fetch from the catalog", response.status)
+    if validators:
+        validators.update(response.headers)
+    return response.data
+
+
+async def fetch_dataset_metadata(dataset_id: str, validators: Optional[UpstreamValidators] = None) -> Dict:
+    """
+    Fetches the metadata of one dataset of the catalog.
+    """
+    logger.debug("Fetching metadata of dataset '%s'", dataset_id)
+    params = {'timezone': 'UTC', 'include_links': 'false', 'include_app_metas': 'false'}
+    return await fetch_catalog_json(f"{CATALOG_URL}/{dataset_id}", params, validators)
+
+
+def dataset_metadata_spec(dataset_id: str) -> CacheSpec:
+    """
+    Returns how the metadata of a dataset is cached.
+    """
+    return CacheSpec(
+        metadata_key(dataset_id),
+        lambda validators: fetch_dataset_metadata(dataset_id, validators),
+        ttl=DATASET_METADATA_TTL,
+        # Keep an in-process copy for 5 minutes
+        memory_ttl=300,
+        conditional=True
+    )
+
+
+async def get_dataset_metadata_payload(dataset_id: str) -> CachedPayload:
+    """
+    Get the metadata of any catalog dataset from cache, or fetch and cache it.
+
+    :param dataset_id: The catalog dataset id.
+    :return CachedPayload: The metadata as stored JSON bytes.
+    :raises ValueError: If the id is invalid.
+    :raises DatasetNotFound: If the catalog has no such dataset.
+    """
+    validate_dataset_id(dataset_id)
+    return await cache_lookup(dataset_metadata_spec(dataset_id))
+
+
+async def get_dataset_metadata_version(dataset_id: str) -> Optional[str]:
+    """
+    Get the `data_processed` timestamp of a dataset, from its cached metadata.
+    """
+    metadata = loads((await get_dataset_metadata_payload(dataset_id)).body)
+    return ((metadata.get("metas") or {}).get("default") or {}).get("data_processed")
+
+
+def records_params(
+    select: Optional[str] = None,
+    where: Optional[str] = None,
+    order_by: Optional[str] = None,
+    limit: int = MAX_RECORDS_LIMIT,
+    offset: int = 0
+) -> Dict[str, Any]:
+    """
+    Builds the upstream query of a records request, dropping unset parameters.
+
+    :raises ValueError: If limit or offset are out of range.
+    """
+    if not 0 < limit <= MAX_RECORDS_LIMIT:
+        raise ValueError(f"The limit must be between 1 and {MAX_RECORDS_LIMIT}")
+    if offset < 0:
+        raise ValueError("The offset must not be negative")
+    values = dict(zip(RECORDS_PARAMS, (select, where, order_by, limit, offset)))
+    return {name: value for name, value in values.items() if value is not None}
+
+
+async def fetch_dataset_records(dataset_id: str, params: Dict[str, Any], validators: Optional[UpstreamValidators] = None) -> Dict:
+    """
+    Fetches one page of records of a dataset.
+    """
+    logger.debug("Fetching records of dataset '%s'", dataset_id)
+    query = {**params, 'timezone': 'UTC', 'include_links': 'false', 'include_app_metas': 'false'}
+    return await fetch_catalog_json(f"{CATALOG_URL}/{dataset_id}/records", query, validators)
+
+
+async def get_records_ttl(dataset_id: str) -> int:
+    """
+    Returns the records TTL of a dataset from its cached metadata, parsing the metadata only when it changed.
+
+    :raises ValueError: If the id is invalid.
+    :raises DatasetNotFound: If the catalog has no such dataset.
+    """
+    metadata = await get_dataset_metadata_payload(dataset_id)
+    known = _records_ttls.get(dataset_id)
+    if known is not None and known[0] == metadata.etag:
+        return known[1]
+    ttl = records_ttl(loads(metadata.body))
+    _records_ttls[dataset_id] = (metadata.etag, ttl)
+    return ttl
+
+
+async def get_dataset_records_payload(dataset_id: str, params: Dict[str, Any]) -> Tuple[CachedPayload, str]:
+    """
+    Get one page of records of any catalog dataset from cache, or fetch and cache it.
+
+    The TTL follows the dataset's declared update frequency, and refreshes only
+    re-download the records when the dataset's `data_processed` changed and the
+    upstream did not answer 304.
+
+    :param dataset_id: The catalog dataset id.
+    :param params: The records query, built with records_params.
+    :return Tuple[CachedPayload, str]: The records as stored JSON bytes, and their Cache-Control policy.
+    :raises ValueError: If the id is invalid.
+    :raises DatasetNotFound: If the catalog has no such dataset.
+    """
+    ttl = await get_records_ttl(dataset_id)
+    spec = CacheSpec(
+        records_key(dataset_id, params),
+        lambda validators: fetch_dataset_records(dataset_id, params, validators),
+        ttl=ttl,
+        memory_ttl=300,
+        version_function=lambda: get_dataset_metadata_version(dataset_id),
+        conditional=True
+    )
+    return await cache_lookup(spec), dataset_cache_control(ttl)
+
+
+def dataset_cache_control(ttl: int) -> str:
+    """
+    Returns the Cache-Control policy of data cached for ttl seconds.
+
+    Clients reuse it for a twelfth of the TTL, at most 5 minutes, then
+    revalidate it with its ETag.
+    """
+    return f"public, max-age={min(ttl, DATASET_METADATA_TTL) // 12}, stale-while-revalidate={ttl}"
+
+
+async def fetch_catalog_pages(concurrency: int) -> List[Dict]:
+    """
+    Fetches the metadata of every dataset of the catalog, the pages after the first concurrently.
+    """
+    params = {'limit': MAX_RECORDS_LIMIT, 'timezone': 'UTC', 'include_links': 'false', 'include_app_metas': 'false'}
+    first_page = await fetch_catalog_json(CATALOG_URL, {**params, 'offset': 0})
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_page(offset: int) -> Dict:
+        async with semaphore:
+            return await fetch_catalog_json(CATALOG_URL, {**params, 'offset': offset})
+
+    offsets = range(MAX_RECORDS_LIMIT, first_page['total_count'], MAX_RECORDS_LIMIT)
+    pages = [first_page] + list(await asyncio.gather(*(fetch_page(offset) for offset in offsets)))
+    return [metadata for page in pages for metadata in page['results']]
+
+
+async def prefetch_catalog(dataset_ids: Optional[List[str]] = None, concurrency: int = CACHE_FETCH_CONCURRENCY) -> int:
+    """
+    Fills the cache with the metadata of many datasets at once.
+
+    Without ids the whole catalog is read page by page, 100 datasets per
+    request; with ids each dataset is fetched, concurrently. Everything is then
+    written to Redis with a single pipeline.
+
+    :param dataset_ids: The datasets to prefetch, or None for the whole catalog.
+    :param concurrency: How many upstream requests run at once.
+    :return: The number of datasets cached.
+    """
+    if dataset_ids is None:
+        datasets = await fetch_catalog_pages(concurrency)
+    else:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_one(dataset_id: str) -> Dict:
+            async with semaphore:
+                return await fetch_dataset_metadata(validate_dataset_id(dataset_id))
+
+        datasets = await asyncio.gather(*(fetch_one(dataset_id) for dataset_id in dataset_ids))
+
+    entries = [
+        (dataset_metadata_spec(metadata['dataset_id']), metadata)
+        for metadata in datasets
+        if DATASET_ID_PATTERN.match(metadata.get('dataset_id', ''))
+    ]
+    await store_many(entries)
+    logger.info("Prefetched the metadata of %d datasets", len(entries))
+    return len(entries)
+
+
+if __name__ == "__main__":
+    # python -m app.services.catalog_service [dataset_id ...]: prefetch the catalog metadata
+    import sys
+    from ..utils.http_client import close_http_client
+    from ..utils.redis_client import close_redis_client
+
+    async def main():
+        try:
+            await prefetch_catalog(sys.argv[1:] or None)
+        finally:
+            await close_http_client()
+            await close_redis_client()
+
+    asyncio.run(main())
@@ -1,52 +1,95 @@
 import aiohttp
-from ..utils.redis_client import redis_client
-import json
+import logging
+from typing import Optional
+from ..cache_middleware import CacheSpec, cache_lookup
+from ..cache_warmer import register_key_resolver, pin_keys
+from ..utils.http_client import NotModified, UpstreamValidators, OPENDATA_API_URL
 from ..models.dataset_models import DatasetResponse 
+from ..utils.payload import CachedPayload
+from ..utils.resilience import UpstreamError, fetch_upstream
 
-API_URL = "https://opendata.comune.bologna.it/api/explore/v2.1/catalog/datasets/precipitazioni_bologna?timezone=UTC&include_links=false&include_app_metas=false"
+logger = logging.getLogger(__name__)
 
-async def fetch_dataset_from_api() -> DatasetResponse:
+API_URL = f"{OPENDATA_API_URL}/catalog/datasets/precipitazioni_bologna?timezone=UTC&include_links=false&include_app_metas=false"
+
+# The metadata document is small, so a slow response means the upstream is struggling
+DATASET_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=3, sock_read=7)
+
+# Clients may reuse the metadata for 5 minutes, then revalidate it with its ETag
+DATASET_CACHE_CONTROL = "public, max-age=300, stale-while-revalidate=3300"
+
+DATASET_CACHE_KEY = "opendata_bologna_dataset"
+
+async def fetch_dataset_from_api(validators: Optional[UpstreamValidators] = None) -> DatasetResponse:
     """
     Fetch dataset from the Opendata API and validate using Pydantic model.
 
+    :param validators: Validators of the cached copy, sent as a conditional request and
+        updated from the response.
     :return DatasetResponse: A Pydantic model representing the dataset.
+    :raises NotModified: If the validators still match the upstream data.
     """
-    print("Fetching dataset from API")
-    async with aiohttp.ClientSession() as session:
-        async with session.get(API_URL) as response:
-            print(f"API response status code: {response.status}")
-            if response.status == 200:
-                data = await response.json()
-                print("API response data:", data)
-                # Validate the response using the Pydantic model
-                return DatasetResponse(**data)
-            else:
-                # Raise an exception if the request fails
-                print("Failed to fetch dataset from API")
-                raise Exception("Failed to fetch dataset")
+    logger.debug("Fetching dataset from API")
+    headers = validators.request_headers() if validators else None
+    response = await fetch_upstream("dataset", API_URL, headers=headers, timeout=DATASET_TIMEOUT)
+    logger.debug("API response status code: %d", response.status)
+    if response.status == 304 and validators:
+        raise NotModified()
+    if response.status == 200:
+        if validators:
+            validators.update(response.headers)
+        # Validate the response using the Pydantic model
+        return DatasetResponse(**response.data)
+    else:
+        # Raise an exception if the request fails
+        logger.warning("Failed to fetch dataset from API: %d", response.status)
+        raise UpstreamError("Failed to fetch dataset", response.status)
 
-async def get_dataset() -> DatasetResponse:
+def dataset_spec() -> CacheSpec:
+    """
+    Returns how the dataset metadata is cached: for 1 hour (3600 seconds) in
+    Redis, with an in-process copy for 5 minutes, revalidated conditionally.
+    """
+    return CacheSpec(DATASET_CACHE_KEY, fetch_dataset_from_api, ttl=3600, memory_ttl=300, conditional=True)
+
+
+async def get_dataset_payload() -> CachedPayload:
     """
     Get the dataset from cache or fetch it from the API and cache the result.
 
     The dataset is cached for 1 hour (3600 seconds) in Redis to avoid
-    re-fetching the data on every request.
+    re-fetching the data on every request. Concurrent misses share a single
+    upstream fetch.
+
+    :return CachedPayload: The validated dataset as stored JSON bytes.
+    """
+    # Get the data from cache, or fetch and cache it
+    return await cache_lookup(dataset_spec())
+
+
+async def get_dataset() -> DatasetResponse:
+    """
+    Get the dataset as a Pydantic model, from cache or from the API.
 
     :return DatasetResponse: A Pydantic model representing the dataset.
     """
-    cache_key = "opendata_bologna_dataset"
-    
-    # Try to get the data from Redis cache
-    cached_data = redis_client.get(cache_key)
-    if cached_data:
-        # If the data is cached, return it as a Pydantic model
-        return DatasetResponse(**json.loads(cached_data))
-    
-    # If not cached, fetch the dataset from the API
-    dataset = await fetch_dataset_from_api()
-
-    # Cache the data for 1 hour (3600 seconds)
-    redis_client.setex(cache_key, 3600, json.dumps(dataset.model_dump()))
-    
-    # Return the dataset
-    return dataset
+    payload = await get_dataset_payload()
+    return DatasetResponse.model_validate_json(payload.body)
+
+
+async def get_dataset_version() -> str:
+    """
+    Get the version of the dataset records, taken from the cached dataset metadata.
+
+    The version changes whenever the upstream data is reprocessed, so callers can
+    skip re-downloading records when it is unchanged.
+
+    :return str: The `data_processed` timestamp of the dataset.
+    """
+    dataset = await get_dataset()
+    return dataset.metas.default.data_processed
+
+
+# Every precipitation refresh checks the dataset version, so keep the metadata warm
+register_key_resolver(lambda cache_key: dataset_spec() if cache_key == DATASET_CACHE_KEY else None)
+pin_keys(DATASET_CACHE_KEY)
@@ -0,0 +1,163 @@
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from ..store.ingest import iter_export_rows
+from ..store.precipitation_store import get_precipitation_store, PrecipitationStore
+from ..utils.formats import dumps
+from ..utils.resilience import UpstreamError
+
+# Media type of each export format
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+# Records encoded into each chunk sent to the client
+EXPORT_CHUNK_ROWS = 1000
+
+CSV_COLUMNS = ("date", "avg_184_d", "stagione")
+
+
+def validate_record(row: Dict[str, str]) -> Optional[Tuple[str, float, str]]:
+    """
+    Checks one upstream row without building a Pydantic model.
+
+    :param row: The row keyed by column name.
+    :return: The (date, avg_184_d, stagione) record, or None if it has no measurement.
+    :raises ValueError: If the row is malformed.
+    """
+    value = row.get('avg_184_d')
+    if not value:
+        return None
+    return row['date'][:10], float(value), row['stagione']
+
+
+async def iter_upstream_records(start_date: datetime, end_date: datetime) -> AsyncIterator[Tuple[str, float, str]]:
+    """
+    Streams the records of a date range from the upstream CSV export, as they arrive.
+    """
+    params = {
+        'select': 'date,avg_184_d,stagione',
+        'where': f"date >= '{start_date.strftime('%Y-%m-%d')}' AND date <= '{end_date.strftime('%Y-%m-%d')}'",
+        'order_by': 'date',
+        'delimiter': ';',
+        'timezone': 'UTC'
+    }
+    async for row in iter_export_rows(params):
+        try:
+            record = validate_record(row)
+        except (KeyError, ValueError) as e:
+            raise UpstreamError(f"Malformed precipitation export row: {e!r}") from e
+        if record is not None:
+            yield record
+
+
+async def iter_store_records(store: PrecipitationStore, start_date: datetime, end_date: datetime) -> AsyncIterator[Tuple[str, float, str]]:
+    """
+    Streams the records of a date range from the local mirror, converting one chunk of rows at a time.
+    """
+    days, values, codes = store.columns(start_date, end_date)
+    categories = store.categories
+    for lo in range(0, len(days), EXPORT_CHUNK_ROWS):
+        hi = lo + EXPORT_CHUNK_ROWS
+        dates = np.datetime_as_string(days[lo:hi].astype("datetime64[D]")).tolist()
+        for day, value, code in zip(dates, values[lo:hi].tolist(), codes[lo:hi].tolist()):
+            yield day, value, categories[code]
+
+
+def encode_ndjson(records: Iterable[Tuple[str, float, str]]) -> bytes:
+    """
+    Encodes records as newline-delimited JSON objects.
+    """
+    return b"".join(
+        dumps({"date": day, "avg_184_d": value, "stagione": stagione}) + b"\n"
+        for day, value, stagione in records
+    )
+
+
+def encode_csv(records: Iterable[Tuple[str, float, str]]) -> bytes:
+    """
+    Encodes records as CSV rows, without the header.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(records)
+    return buffer.getvalue().encode()
+
+
+async def open_records(records: AsyncIterator[Tuple[str, float, str]]) -> AsyncIterator[Tuple[str, float, str]]:
+    """
+    Reads the first record before returning the stream, so a source that cannot be read fails before anything is sent.
+
+    :param records: The record stream.
+    :return: The same records, the first one already read.
+    :raises UpstreamError: If the upstream export cannot be opened.
+    """
+    try:
+        first = await records.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def resumed() -> AsyncIterator[Tuple[str, float, str]]:
+        if first is None:
+            return
+        yield first
+        async for record in records:
+            yield record
+
+    return resumed()
+
+
+async def encode_records(records: AsyncIterator[Tuple[str, float, str]], export_format: str) -> AsyncIterator[bytes]:
+    """
+    Serializes a record stream into chunks of EXPORT_CHUNK_ROWS records.
+    """
+    encode = encode_csv if export_format == "csv" else encode_ndjson
+    if export_format == "csv":
+        yield encode_csv([CSV_COLUMNS])
+
+    chunk = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield encode(chunk)
+            chunk = []
+    if chunk:
+        yield encode(chunk)
+
+
+async def stream_precipitation_export(start_date: datetime, end_date: datetime, export_format: str = "ndjson") -> AsyncIterator[bytes]:
+    """
+    Returns the encoded records of a date range as a stream of byte chunks.
+
+    Records flow from the local mirror, when it covers the range, or from the
+    upstream CSV export, through a light per-row check and the serializer, one
+    chunk at a time. Memory per request stays constant however long the range
+    is, and the first chunk is sent before the upstream has sent the last row.
+
+    The arguments are checked and the first record is read here, before
+    anything is streamed, so invalid requests and an upstream export that
+    cannot be opened are still answered with a proper status code instead of
+    a truncated 200.
+
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range.
+    :param export_format: "ndjson" or "csv".
+    :return: An async iterator of encoded chunks.
+    :raises ValueError: If the format is unknown or the range is reversed.
+    :raises UpstreamError: If the upstream export cannot be opened.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"The format must be one of {', '.join(EXPORT_FORMATS)}")
+    if end_date < start_date:
+        raise ValueError("The end date must not be before the start date")
+
+    store = get_precipitation_store()
+    if store is not None and store.covers(end_date):
+        records = iter_store_records(store, start_date, end_date)
+    else:
+        records = iter_upstream_records(start_date, end_date)
+    return encode_records(await open_records(records), export_format)
@@ -1,73 +1,327 @@
 import aiohttp
-import json
-from datetime import datetime
-from ..utils.redis_client import redis_client
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from ..cache_middleware import CacheSpec, cache_lookup, cache_middleware_many
+from ..cache_warmer import register_key_resolver, pin_keys, schedule_prefetch
+from ..utils.http_client import NotModified, UpstreamValidators, OPENDATA_API_URL
+from ..utils.resilience import UpstreamError, fetch_upstream
 from ..models.precipitation_model import PrecipitationResponse
-from ..utils.date_utils import get_week_range
+from ..models.precipitation_columns import PrecipitationColumns
+from ..utils.payload import CachedPayload
+from ..utils.formats import dumps
+from ..utils.date_utils import get_week_range, is_closed_week, iter_week_ranges
+from .dataset_service import get_dataset_version
+from ..store.precipitation_store import date_to_day, get_precipitation_store
 
-PRECIPITATION_API_URL = "https://opendata.comune.bologna.it/api/explore/v2.1/catalog/datasets/precipitazioni_bologna/records"
+logger = logging.getLogger(__name__)
 
-async def fetch_precipitation_data(start_date: datetime, end_date: datetime) -> PrecipitationResponse:
+PRECIPITATION_API_URL = f"{OPENDATA_API_URL}/catalog/datasets/precipitazioni_bologna/records"
+
+# Record queries run a filter on the upstream side, so allow a longer read
+PRECIPITATION_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=3, sock_read=12)
+
+# Weeks still open may receive new records, so revalidate them daily
+OPEN_WEEK_TTL = 86400
+# Closed weeks only need an occasional cheap version check
+CLOSED_WEEK_TTL = 30 * 86400
+
+# Browser/proxy caching policies for open and closed weeks
+OPEN_WEEK_CACHE_CONTROL = "public, max-age=3600, stale-while-revalidate=82800"
+CLOSED_WEEK_CACHE_CONTROL = "public, max-age=604800, immutable"
+
+# The records endpoint returns at most 100 records per request
+PAGE_SIZE = 100
+# The longest range served by get_precipitation_range
+MAX_RANGE_DAYS = int(os.getenv('PRECIPITATION_MAX_RANGE_DAYS', 3660))
+# The most dates resolved by one get_precipitation_batch_payload call
+MAX_BATCH_DATES = int(os.getenv('PRECIPITATION_MAX_BATCH_DATES', 366))
+
+# Dates whose weeks (and neighbouring weeks) are kept warm, the dashboard opens on 2023-01-01
+PRECIPITATION_WARM_DATES = [value for value in os.getenv('PRECIPITATION_WARM_DATES', '2023-01-01').split(',') if value]
+
+WEEK_KEY_PATTERN = re.compile(r"^precipitation_data_(\d{4}-\d{2}-\d{2} 00:00:00)_(\d{4}-\d{2}-\d{2} 00:00:00)$")
+
+async def fetch_precipitation_data(
+    start_date: datetime,
+    end_date: datetime,
+    validators: Optional[UpstreamValidators] = None
+) -> PrecipitationColumns:
     """
     Fetches precipitation data from the Bologna Open Data API for a given date range.
 
+    Records are requested in date order, one page of PAGE_SIZE at a time, until
+    the whole range has been read.
+
     :param start_date: The start date of the range to fetch data for.
     :param end_date: The end date of the range to fetch data for.
-    :return: A PrecipitationResponse model containing the fetched data.
-    :raises Exception: If the API request fails.
+    :param validators: Validators of the cached copy, sent as a conditional request and
+        updated from the response.
+    :return: The fetched records as compact columns.
+    :raises NotModified: If the validators still match the upstream data.
+    :raises UpstreamError: If the API request fails.
+    :raises ValueError: If a record is invalid.
     """
-    print("Fetching precipitation data for", start_date, "to", end_date)
+    logger.debug("Fetching precipitation data for %s to %s", start_date, end_date)
     params = {
         'where': f"date >= '{start_date}' AND date <= '{end_date}'",  # Set the date range for the query
-        'limit': 100,  # Limit the number of records fetched
+        'order_by': 'date',  # Keep pages stable and in date order
+        'limit': PAGE_SIZE,  # Limit the number of records fetched per page
         'timezone': 'UTC',  # Specify the timezone
         'include_links': 'false',  # Exclude additional links from the response
         'include_app_metas': 'false'  # Exclude application metadata from the response
     }
-    
-    # Create an asynchronous HTTP session
-    async with aiohttp.ClientSession() as session:
+
+    results = []
+    total_count = None
+    while total_count is None or len(results) < total_count:
+        first_page = total_count is None
+        page_params = {**params, 'offset': len(results)}
+        # Only the first page is conditional, its validators cover the whole query
+        headers = validators.request_headers() if validators and first_page else None
         # Make a GET request to the API with specified parameters
-        async with session.get(PRECIPITATION_API_URL, params=params) as response:
-            if response.status == 200:
-                # Parse the JSON response and validate it with the Pydantic model
-                data = await response.json()
-                print("API Response:", data)  # Log the raw API response
-                return PrecipitationResponse(**data)
-            else:
-                # Raise an exception if the request fails
-                raise Exception("Failed to fetch precipitation data", response.status)
+        response = await fetch_upstream("precipitation", PRECIPITATION_API_URL, params=page_params, headers=headers, timeout=PRECIPITATION_TIMEOUT)
+        if response.status == 304 and validators and first_page:
+            raise NotModified()
+        if response.status != 200:
+            # Raise an exception if the request fails
+            raise UpstreamError("Failed to fetch precipitation data", response.status)
+        if validators and first_page:
+            validators.update(response.headers)
+        data = response.data
 
-async def get_weekly_precipitation(date: datetime) -> PrecipitationResponse:
+        total_count = data['total_count']
+        if not data['results']:
+            break
+        results.extend(data['results'])
+
+    # Check the records while packing them into typed columns
+    return PrecipitationColumns.from_records(results)
+
+
+def week_cache_key(week_start: datetime, week_end: datetime) -> str:
+    """
+    Returns the cache key of the precipitation data of one Monday-Sunday week.
+    """
+    return f"precipitation_data_{week_start}_{week_end}"
+
+
+def week_spec_from_key(cache_key: str) -> Optional[CacheSpec]:
+    """
+    Returns the spec of a weekly precipitation key, or None for other keys.
+    """
+    match = WEEK_KEY_PATTERN.match(cache_key)
+    if match is None:
+        return None
+    return weekly_precipitation_spec(datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2)))
+
+
+def adjacent_week_specs(week_start: datetime, today: Optional[datetime] = None) -> List[CacheSpec]:
+    """
+    Returns the specs of the weeks before and after a week, skipping weeks that have not started yet.
+    """
+    today = today or datetime.now()
+    specs = []
+    for offset in (-7, 7):
+        start = week_start + timedelta(days=offset)
+        if start <= today:
+            specs.append(weekly_precipitation_spec(start, start + timedelta(days=6)))
+    return specs
+
+
+def weekly_precipitation_spec(week_start: datetime, week_end: datetime) -> CacheSpec:
+    """
+    Returns how the precipitation data of one Monday-Sunday week is cached.
+
+    Open weeks are revalidated after 24 hours (86400 seconds). Closed weeks are
+    kept indefinitely and only revalidated monthly. Revalidation re-downloads a
+    week only if the dataset's `data_processed` version changed since it was
+    cached, and the upstream did not answer 304 to the conditional request.
+
+    :param week_start: The Monday of the week.
+    :param week_end: The Sunday of the week.
+    :return: The cache spec of the week.
+    """
+    closed = is_closed_week(week_end)
+    return CacheSpec(
+        week_cache_key(week_start, week_end),
+        lambda validators: fetch_precipitation_data(week_start, week_end, validators),
+        ttl=CLOSED_WEEK_TTL if closed else OPEN_WEEK_TTL,
+        # Keep an in-process copy for 1 hour
+        memory_ttl=3600,
+        persist=closed,
+        version_function=get_dataset_version,
+        conditional=True
+    )
+
+
+async def get_weekly_precipitation_payload(date: datetime) -> CachedPayload:
     """
     Retrieves weekly precipitation data, either from the cache or by fetching it.
     
-    If the data is not cached, it fetches it from the Bologna Open Data API using
-    the fetch_precipitation_data function.
-    
-    Finally, it caches the result for 24 hours (86400 seconds) in Redis.
+    Weeks covered by the local mirror are answered from it with no network
+    call. Otherwise, if the data is not cached, it fetches it from the Bologna
+    Open Data API using the fetch_precipitation_data function. Concurrent misses
+    for the same week share a single upstream fetch.
     """
-    print(f"Calculating week range for date: {date}")
     week_start, week_end = get_week_range(date)
-    print(f"Week start: {week_start}, Week end: {week_end}")
 
-    cache_key = f"precipitation_data_{week_start}_{week_end}"
-    print(f"Checking cache for key: {cache_key}")
-    
-    # Check if the data is cached
-    cached_data = redis_client.get(cache_key)
-    if cached_data:
-        print("Found cached data")
-        # If the data is cached, return it as a Pydantic model
-        return PrecipitationResponse(**json.loads(cached_data))
-    
-    print("Cache miss, fetching data from API")
-    # Fetch data from the API if not cached
-    precipitation_data = await fetch_precipitation_data(week_start, week_end)
-    print(f"Fetched data: {precipitation_data}")
+    store = get_precipitation_store()
+    if store is not None and store.covers(week_end):
+        return CachedPayload(dumps(store.query(week_start, week_end)))
+
+    # Get the data from cache, or fetch and cache it
+    payload = await cache_lookup(weekly_precipitation_spec(week_start, week_end))
+    # Users step through weeks, so fetch the neighbours before they ask
+    schedule_prefetch(adjacent_week_specs(week_start))
+    return payload
+
+
+async def get_weekly_precipitation(date: datetime) -> PrecipitationResponse:
+    """
+    Retrieves weekly precipitation data as a Pydantic model, from cache or from the API.
+    """
+    payload = await get_weekly_precipitation_payload(date)
+    return PrecipitationResponse.model_validate_json(payload.body)
+
+
+def get_precipitation_cache_control(date: datetime) -> str:
+    """
+    Returns the Cache-Control policy for the week containing the given date.
+
+    Closed weeks no longer change, so clients may keep them for a week without
+    revalidating; open weeks are revalidated hourly with their ETag.
+    """
+    _, week_end = get_week_range(date)
+    return CLOSED_WEEK_CACHE_CONTROL if is_closed_week(week_end) else OPEN_WEEK_CACHE_CONTROL
+
+
+async def get_precipitation_range_columns(start_date: datetime, end_date: datetime) -> PrecipitationColumns:
+    """
+    Retrieves precipitation data for an arbitrary date range as columns, assembled from per-week cache chunks.
+
+    Ranges covered by the local mirror are two binary searches over its sorted
+    date column. Otherwise the range is split into canonical Monday-Sunday
+    weeks, all read with a single Redis MGET; only the missing weeks are
+    fetched upstream, concurrently.
+
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range.
+    :return: The records of the range, in date order.
+    :raises ValueError: If the range is reversed or longer than MAX_RANGE_DAYS.
+    """
+    if end_date < start_date:
+        raise ValueError("The end date must not be before the start date")
+    if (end_date - start_date).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"The range must not be longer than {MAX_RANGE_DAYS} days")
+
+    store = get_precipitation_store()
+    if store is not None and store.covers(end_date):
+        return PrecipitationColumns.from_codes(*store.columns(start_date, end_date), store.categories)
+
+    specs = [weekly_precipitation_spec(week_start, week_end) for week_start, week_end in iter_week_ranges(start_date, end_date)]
+    payloads = await cache_middleware_many(specs)
+    weeks = PrecipitationColumns.concat(PrecipitationColumns.from_json(payload.body) for payload in payloads)
+    return weeks.between(date_to_day(start_date), date_to_day(end_date))
+
+
+async def get_precipitation_range(start_date: datetime, end_date: datetime) -> dict:
+    """
+    Retrieves precipitation data for an arbitrary date range, as get_precipitation_range_columns does.
+
+    :return: A dict shaped like PrecipitationResponse, with the records in date order.
+    :raises ValueError: If the range is reversed or longer than MAX_RANGE_DAYS.
+    """
+    return (await get_precipitation_range_columns(start_date, end_date)).to_dict()
+
+
+def batch_weeks(dates: List[datetime]) -> Dict[str, Tuple[datetime, datetime]]:
+    """
+    Dedupes dates to the canonical Monday-Sunday weeks containing them.
+
+    :param dates: The requested dates.
+    :return: The (week start, week end) of each distinct week, keyed by its Monday (YYYY-MM-DD), in first-seen order.
+    """
+    weeks = {}
+    for date in dates:
+        week_start, week_end = get_week_range(date)
+        weeks.setdefault(week_start.strftime("%Y-%m-%d"), (week_start, week_end))
+    return weeks
+
+
+async def get_precipitation_batch_payload(dates: List[datetime]) -> CachedPayload:
+    """
+    Retrieves the weekly precipitation data of many dates in one round trip.
+
+    The dates are deduped to their weeks first, so each week is read and sent
+    once however many dates fall in it. Weeks covered by the local mirror are
+    answered from it; the others are read with a single Redis MGET, and the
+    missing ones fetched concurrently and written back in a single pipeline.
+
+    The body maps every date to the Monday of its week and every week to its
+    cached PrecipitationResponse JSON, spliced in as stored without parsing it.
+
+    :param dates: The requested dates.
+    :return: A JSON payload shaped like PrecipitationBatchResponse, stale if any week is.
+    :raises ValueError: If no dates or more than MAX_BATCH_DATES are requested.
+    """
+    if not dates:
+        raise ValueError("At least one date is required")
+    if len(dates) > MAX_BATCH_DATES:
+        raise ValueError(f"At most {MAX_BATCH_DATES} dates can be requested at once")
+
+    weeks = batch_weeks(dates)
+    bodies: Dict[str, bytes] = {}
+    stale = False
+    store = get_precipitation_store()
+    cached_weeks = []
+    for week, (week_start, week_end) in weeks.items():
+        if store is not None and store.covers(week_end):
+            bodies[week] = dumps(store.query(week_start, week_end))
+        else:
+            cached_weeks.append(week)
+    if cached_weeks:
+        payloads = await cache_middleware_many([weekly_precipitation_spec(*weeks[week]) for week in cached_weeks])
+        for week, payload in zip(cached_weeks, payloads):
+            bodies[week] = payload.body
+            stale = stale or payload.stale
+
+    date_weeks = {date.strftime("%Y-%m-%d"): get_week_range(date)[0].strftime("%Y-%m-%d") for date in dates}
+    body = b"".join((
+        b'{"dates":', dumps(date_weeks), b',"weeks":{',
+        b",".join(dumps(week) + b":" + bodies[week] for week in weeks),
+        b"}}"
+    ))
+    return CachedPayload(body, stale)
+
+
+def week_event_topics(dates: List[datetime]) -> Dict[str, str]:
+    """
+    Returns the cache key of the week of each date, mapped to the event stream topic its updates are sent as.
+
+    :param dates: The followed dates.
+    :return: Topics named "precipitation:<Monday>" (YYYY-MM-DD), keyed by cache key.
+    :raises ValueError: If more than MAX_BATCH_DATES dates are followed.
+    """
+    if len(dates) > MAX_BATCH_DATES:
+        raise ValueError(f"At most {MAX_BATCH_DATES} dates can be followed at once")
+    return {week_cache_key(week_start, week_end): f"precipitation:{week}" for week, (week_start, week_end) in batch_weeks(dates).items()}
+
+
+def get_precipitation_batch_cache_control(dates: List[datetime]) -> str:
+    """
+    Returns the Cache-Control policy of a batch, which is immutable only if every week in it is closed.
+    """
+    if all(is_closed_week(week_end) for _, week_end in batch_weeks(dates).values()):
+        return CLOSED_WEEK_CACHE_CONTROL
+    return OPEN_WEEK_CACHE_CONTROL
 
-    # Cache the result for 24 hours (86400 seconds)
-    redis_client.setex(cache_key, 86400, json.dumps(precipitation_data.model_dump()))
-    print(f"Data cached with key: {cache_key} for 24 hours")
 
-    return precipitation_data
+register_key_resolver(week_spec_from_key)
+for warm_date in PRECIPITATION_WARM_DATES:
+    # Keep the week of each warm date and its neighbours warm
+    warm_date = datetime.strptime(warm_date, "%Y-%m-%d")
+    for warm_week_start, warm_week_end in iter_week_ranges(warm_date - timedelta(days=7), warm_date + timedelta(days=7)):
+        pin_keys(week_cache_key(warm_week_start, warm_week_end))
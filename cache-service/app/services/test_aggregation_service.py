@@ -0,0 +1,133 @@
+import json
+import pytest
+import numpy as np
+from datetime import datetime
+from unittest.mock import patch, AsyncMock
+from . import aggregation_service
+from .aggregation_service import aggregate_precipitation, grouped_stats, group_keys, rollup_key
+from ..utils.codec import decode
+from .precipitation_service import MAX_RANGE_DAYS
+from ..models.precipitation_columns import PrecipitationColumns
+from ..store.precipitation_store import PrecipitationStore, date_to_day
+
+TODAY = datetime(2024, 6, 1)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    A local mirror holding every day of 2023, with 2 mm of rain on even days of the month.
+    """
+    monkeypatch.setenv('PRECIPITATION_STORE_DIR', str(tmp_path))
+    first = date_to_day("2023-01-01")
+    days = np.arange(first, first + 365)
+    dates = days.astype("datetime64[D]").astype(object)
+    values = [2.0 if day.day % 2 == 0 else 0.0 for day in dates]
+    stagioni = ["Inverno" if day.month in (1, 2, 12) else "Altro" for day in dates]
+    store = PrecipitationStore(str(tmp_path))
+    store.append(days, values, stagioni)
+    return store
+
+
+def test_grouped_stats_match_per_group_numpy():
+    """
+    Test that the grouped reductions match computing each group separately, for unordered keys.
+    """
+    keys = np.array([2, 1, 2, 1, 3])
+    values = np.array([4.0, 1.0, 0.0, 3.0, 5.0])
+
+    stats = grouped_stats(keys, values, [50])
+
+    assert stats[1] == {"count": 2, "sum": 4.0, "mean": 2.0, "max": 3.0, "rainy_days": 2, "percentiles": {"p50": 2.0}}
+    assert stats[2]["rainy_days"] == 1
+    assert stats[3]["max"] == 5.0
+
+
+def test_week_keys_start_on_monday():
+    """
+    Test that ISO week keys are the day number of the week's Monday.
+    """
+    days = np.array([date_to_day(f"2023-01-{day:02d}") for day in (1, 2, 8, 9)])
+
+    assert group_keys(days, "week").tolist() == [date_to_day("2022-12-26"), date_to_day("2023-01-02"), date_to_day("2023-01-02"), date_to_day("2023-01-09")]
+
+
+@pytest.mark.asyncio
+async def test_monthly_rollups_are_cached_for_closed_periods(store, fake_redis):
+    """
+    Test that closed months are computed once, cached, and then served from the rollups.
+    """
+    with patch('app.services.aggregation_service.get_dataset_version', AsyncMock(return_value="v1")):
+        first = await aggregate_precipitation(datetime(2023, 1, 1), datetime(2023, 12, 31), "month", [50], today=TODAY)
+        january_key = rollup_key("v1", "month", (50.0,), "2023-01")
+        assert json.loads(decode(fake_redis.data[january_key]))["sum"] == 30.0
+
+        with patch('app.services.aggregation_service.load_columns') as load_columns:
+            second = await aggregate_precipitation(datetime(2023, 1, 1), datetime(2023, 12, 31), "month", [50], today=TODAY)
+            load_columns.assert_not_called()
+
+    assert second == first
+    assert [group["period"] for group in first["results"]][:2] == ["2023-01", "2023-02"]
+    assert first["results"][0]["rainy_days"] == 15
+
+
+@pytest.mark.asyncio
+async def test_only_periods_without_rollup_are_loaded(store, fake_redis):
+    """
+    Test that once closed months are cached, only the partial months at the edges of the range are loaded, each on its own.
+    """
+    with patch('app.services.aggregation_service.get_dataset_version', AsyncMock(return_value="v1")):
+        first = await aggregate_precipitation(datetime(2022, 11, 15), datetime(2023, 12, 15), "month", [50], today=TODAY)
+        # December 2022 has no record, its empty rollup is cached too
+        assert json.loads(decode(fake_redis.data[rollup_key("v1", "month", (50.0,), "2022-12")])) == {}
+
+        with patch('app.services.aggregation_service.load_columns', wraps=aggregation_service.load_columns) as load_columns:
+            second = await aggregate_precipitation(datetime(2022, 11, 15), datetime(2023, 12, 15), "month", [50], today=TODAY)
+
+    assert sorted(call.args for call in load_columns.call_args_list) == [
+        (datetime(2022, 11, 15), datetime(2022, 11, 30)),
+        (datetime(2023, 12, 1), datetime(2023, 12, 15))
+    ]
+    assert second == first
+    assert [group["period"] for group in first["results"]][0] == "2023-01"
+    assert first["results"][-1]["count"] == 15
+
+
+@pytest.mark.asyncio
+async def test_group_by_stagione(store, fake_redis):
+    """
+    Test that grouping by stagione spans the whole range, and a closed range is then served from its rollup.
+    """
+    with patch('app.services.aggregation_service.get_dataset_version', AsyncMock(return_value="v1")):
+        data = await aggregate_precipitation(datetime(2023, 1, 1), datetime(2023, 12, 31), "stagione", [], today=TODAY)
+
+        with patch('app.services.aggregation_service.load_columns') as load_columns:
+            again = await aggregate_precipitation(datetime(2023, 1, 1), datetime(2023, 12, 31), "stagione", [], today=TODAY)
+            load_columns.assert_not_called()
+
+    assert [group["period"] for group in data["results"]] == ["Altro", "Inverno"]
+    assert sum(group["count"] for group in data["results"]) == 365
+    assert again == data
+
+
+@pytest.mark.asyncio
+async def test_ranges_longer_than_max_range_days_are_loaded_in_slices(fake_redis, monkeypatch):
+    """
+    Test that without a local mirror a multi-decade range is read in slices of at most MAX_RANGE_DAYS days.
+    """
+    monkeypatch.delenv('PRECIPITATION_STORE_DIR', raising=False)
+    slices = []
+
+    async def range_columns(start_date, end_date):
+        slices.append((end_date - start_date).days + 1)
+        days = np.arange(date_to_day(start_date), date_to_day(end_date) + 1, dtype=np.int32)
+        return PrecipitationColumns(days, np.ones(len(days)), np.zeros(len(days), dtype=np.uint8))
+
+    with patch('app.services.aggregation_service.get_precipitation_range_columns', range_columns), \
+            patch('app.services.aggregation_service.get_dataset_version', AsyncMock(return_value="v1")):
+        data = await aggregate_precipitation(datetime(2000, 1, 1), datetime(2023, 12, 31), "year", [], today=TODAY)
+
+    assert max(slices) <= MAX_RANGE_DAYS and len(slices) == 3
+    assert [group["period"] for group in data["results"]] == [str(year) for year in range(2000, 2024)]
+    assert [group["count"] for group in data["results"]][:2] == [366, 365]
+    assert sum(group["count"] for group in data["results"]) == date_to_day("2024-01-01") - date_to_day("2000-01-01")
@@ -0,0 +1,100 @@
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
+from ..conftest import mock_api_response
+from ..utils.codec import decode
+from .catalog_service import (
+    records_ttl, records_params, get_dataset_records_payload, prefetch_catalog,
+    get_dataset_metadata_payload, metadata_key, DatasetNotFound, DEFAULT_RECORDS_TTL
+)
+
+
+def dataset(dataset_id, accrualperiodicity=None, update_frequency=None):
+    return {
+        "dataset_id": dataset_id,
+        "metas": {
+            "dcat": {"accrualperiodicity": accrualperiodicity},
+            "default": {"update_frequency": update_frequency, "data_processed": "2024-01-01T00:00:00+00:00"}
+        }
+    }
+
+
+def test_records_ttl_follows_update_frequency():
+    """
+    Test that the records TTL comes from the DCAT frequency, then the update frequency, then the default.
+    """
+    assert records_ttl(dataset("a", "http://publications.europa.eu/resource/authority/frequency/WEEKLY")) == 6 * 3600
+    assert records_ttl(dataset("a", None, "Mensile")) == 86400
+    assert records_ttl(dataset("a", "unknown", None)) == DEFAULT_RECORDS_TTL
+    assert records_ttl({"dataset_id": "a"}) == DEFAULT_RECORDS_TTL
+
+
+@pytest.mark.asyncio
+async def test_records_are_cached_per_dataset_and_query(fake_redis):
+    """
+    Test that records are stored in the dataset's namespace, with the TTL of its update frequency.
+    """
+    metadata = mock_api_response(dataset("parcheggi", "DAILY"))
+    records = {"total_count": 1, "results": [{"posti_liberi": 12}]}
+
+    with patch('aiohttp.ClientSession.get', metadata):
+        await get_dataset_metadata_payload("parcheggi")
+    with patch('aiohttp.ClientSession.get', mock_api_response(records)) as mock_get:
+        payload, cache_control = await get_dataset_records_payload("parcheggi", records_params(where="posti_liberi > 0", limit=10))
+        assert mock_get.call_args.args[0].endswith("/parcheggi/records")
+        assert mock_get.call_args.kwargs["params"]["where"] == "posti_liberi > 0"
+
+    # A hit reuses the TTL read from the unchanged metadata, without parsing it again
+    with patch('app.services.catalog_service.loads') as metadata_loads:
+        hit, hit_cache_control = await get_dataset_records_payload("parcheggi", records_params(where="posti_liberi > 0", limit=10))
+        metadata_loads.assert_not_called()
+    assert hit.body == payload.body
+    assert cache_control == hit_cache_control == "public, max-age=300, stale-while-revalidate=3600"
+
+    records_keys = [key for key in fake_redis.data if key.startswith("dataset:parcheggi:records:") and key.count(":") == 3]
+    assert len(records_keys) == 1
+    assert fake_redis.ttls[records_keys[0]] == 3600
+    assert payload.body == decode(fake_redis.data[records_keys[0]])
+
+
+@pytest.mark.asyncio
+async def test_unknown_dataset_and_invalid_id(fake_redis):
+    """
+    Test that a 404 from the catalog and a malformed id are reported as such.
+    """
+    with patch('aiohttp.ClientSession.get', mock_api_response({}, status=404)):
+        with pytest.raises(DatasetNotFound):
+            await get_dataset_metadata_payload("missing")
+    with pytest.raises(ValueError):
+        await get_dataset_metadata_payload("../precipitazioni_bologna")
+
+
+@pytest.mark.asyncio
+async def test_prefetch_whole_catalog_in_one_pipeline(fake_redis):
+    """
+    Test that the catalog pages are fetched concurrently and all metadata is written in one pipeline.
+    """
+    pages = {
+        0: {"total_count": 150, "results": [dataset(f"dataset_{index}") for index in range(100)]},
+        100: {"total_count": 150, "results": [dataset(f"dataset_{index}") for index in range(100, 150)]}
+    }
+
+    def page_response(url, params, **kwargs):
+        response = MagicMock()
+        response.status = 200
+        response.headers = {}
+        response.json = AsyncMock(return_value=pages[params["offset"]])
+        context = MagicMock()
+        context.__aenter__.return_value = response
+        return context
+
+    with patch('aiohttp.ClientSession.get', MagicMock(side_effect=page_response)):
+        count = await prefetch_catalog()
+
+    assert count == 150
+    assert fake_redis.pipelines_executed == 1
+    assert metadata_key("dataset_149") in fake_redis.data
+    assert len(fake_redis.published) == 150
+
+    with patch('aiohttp.ClientSession.get') as mock_get:
+        await get_dataset_metadata_payload("dataset_7")
+        mock_get.assert_not_called()
@@ -1,12 +1,59 @@
 import pytest
-import aiohttp
-from unittest.mock import patch, AsyncMock
-from ..utils.redis_client import redis_client
+import json
+from unittest.mock import patch
+from ..conftest import mock_api_response
+from ..utils.codec import decode
 from ..models.dataset_models import DatasetResponse
 from .dataset_service import fetch_dataset_from_api, get_dataset  # Adjust the import as needed
 
 API_URL = "https://opendata.comune.bologna.it/api/explore/v2.1/catalog/datasets/precipitazioni_bologna?timezone=UTC&include_links=false&include_app_metas=false"
 
+MOCK_DATASET = {
+    "visibility": "domain",
+    "dataset_id": "precipitazioni_bologna",
+    "dataset_uid": "da_abc123",
+    "has_records": True,
+    "features": ["timeserie"],
+    "attachments": [],
+    "alternative_exports": [],
+    "data_visible": True,
+    "fields": [
+        {
+            "name": "date",
+            "description": None,
+            "annotations": {"timeserie_precision": "day"},
+            "label": "Data",
+            "type": "date"
+        }
+    ],
+    "metas": {
+        "dcat": {"contact_name": "Comune di Bologna", "contact_email": "opendata@comune.bologna.it"},
+        "semantic": {},
+        "dcat_ap_it": {},
+        "default": {
+            "title": "Precipitazioni Bologna",
+            "description": "Precipitazioni giornaliere",
+            "theme": ["Ambiente"],
+            "license": "CC BY 4.0",
+            "license_url": "https://creativecommons.org/licenses/by/4.0/",
+            "language": "it",
+            "metadata_languages": ["it"],
+            "timezone": "UTC",
+            "modified": "2024-01-01T00:00:00+00:00",
+            "modified_updates_on_metadata_change": False,
+            "modified_updates_on_data_change": True,
+            "data_processed": "2024-01-01T00:00:00+00:00",
+            "metadata_processed": "2024-01-01T00:00:00+00:00",
+            "geographic_reference_auto": False,
+            "references": "https://opendata.comune.bologna.it",
+            "records_count": 3,
+            "federated": False
+        }
+    }
+}
+
+
+
 @pytest.mark.asyncio
 async def test_fetch_dataset_from_api():
     """
@@ -17,21 +64,16 @@ async def test_fetch_dataset_from_api():
     It checks if the returned dataset is an instance of DatasetResponse and matches
     the expected mock response data.
     """
-    mock_response_data = {
-        # Add mock data that matches the structure expected by DatasetResponse
-    }
+    mock_response_data = MOCK_DATASET
     
-    with patch('aiohttp.ClientSession.get', new_callable=AsyncMock) as mock_get:
-        mock_get.return_value.__aenter__.return_value.status = 200
-        mock_get.return_value.__aenter__.return_value.json = AsyncMock(return_value=mock_response_data)
-        
+    with patch('aiohttp.ClientSession.get', mock_api_response(mock_response_data)):
         dataset = await fetch_dataset_from_api()
         
         assert isinstance(dataset, DatasetResponse)
         assert dataset == DatasetResponse(**mock_response_data)
 
 @pytest.mark.asyncio
-async def test_get_dataset():
+async def test_get_dataset(fake_redis):
     """
     Test the get_dataset function.
 
@@ -41,25 +83,20 @@ async def test_get_dataset():
     the expected mock response data, and also verifies that the data was cached
     in Redis with the correct key and expiration time.
     """
-    mock_response_data = {
-        # Add mock data that matches the structure expected by DatasetResponse
-    }
+    mock_response_data = MOCK_DATASET
     
-    with patch('redis_client.get', return_value=None):
-        with patch('aiohttp.ClientSession.get', new_callable=AsyncMock) as mock_get:
-            mock_get.return_value.__aenter__.return_value.status = 200
-            mock_get.return_value.__aenter__.return_value.json = AsyncMock(return_value=mock_response_data)
-            
-            dataset = await get_dataset()
-            
-            assert isinstance(dataset, DatasetResponse)
-            assert dataset == DatasetResponse(**mock_response_data)
-            
-            # Check if the data was cached
-            redis_client.setex.assert_called_once_with("opendata_bologna_dataset", 3600, json.dumps(dataset.model_dump()))
+    with patch('aiohttp.ClientSession.get', mock_api_response(mock_response_data)):
+        dataset = await get_dataset()
+        
+        assert isinstance(dataset, DatasetResponse)
+        assert dataset == DatasetResponse(**mock_response_data)
+        
+        # Check if the data was cached
+        assert decode(fake_redis.data["opendata_bologna_dataset"]) == dataset.model_dump_json().encode()
+        assert fake_redis.ttls["opendata_bologna_dataset"] == 3600
 
 @pytest.mark.asyncio
-async def test_get_dataset_from_cache():
+async def test_get_dataset_from_cache(fake_redis):
     """
     Test the get_dataset function when data is retrieved from cache.
 
@@ -68,12 +105,13 @@ async def test_get_dataset_from_cache():
     API call. It checks if the returned dataset is an instance of
     DatasetResponse and matches the expected mock cached data from Redis.
     """
-    mock_cached_data = {
-        # Add mock data that matches the structure expected by DatasetResponse
-    }
+    mock_cached_data = MOCK_DATASET
+    
+    fake_redis.data["opendata_bologna_dataset"] = json.dumps(mock_cached_data)
     
-    with patch('redis_client.get', return_value=json.dumps(mock_cached_data)):
+    with patch('aiohttp.ClientSession.get') as mock_get:
         dataset = await get_dataset()
         
         assert isinstance(dataset, DatasetResponse)
         assert dataset == DatasetResponse(**mock_cached_data)
+        mock_get.assert_not_called()
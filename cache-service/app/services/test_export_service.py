@@ -0,0 +1,84 @@
+import json
+import pytest
+from datetime import datetime
+from unittest.mock import patch, MagicMock
+from ..conftest import StreamedBody
+from ..store.precipitation_store import PrecipitationStore, date_to_day
+from .export_service import stream_precipitation_export
+from ..utils.resilience import UpstreamError
+
+
+async def collect(chunks):
+    return b"".join([chunk async for chunk in chunks]).decode()
+
+
+@pytest.mark.asyncio
+async def test_export_from_store_as_ndjson(tmp_path, monkeypatch):
+    """
+    Test that ranges covered by the local mirror are exported one JSON record per line.
+    """
+    monkeypatch.setenv('PRECIPITATION_STORE_DIR', str(tmp_path))
+    store = PrecipitationStore(str(tmp_path))
+    store.append([date_to_day(f"2023-01-0{day}") for day in (1, 2, 3)], [1.0, 2.0, 3.0], ["Inverno"] * 3)
+
+    with patch('aiohttp.ClientSession.get') as mock_get:
+        body = await collect(await stream_precipitation_export(datetime(2023, 1, 2), datetime(2023, 1, 3)))
+        mock_get.assert_not_called()
+
+    assert [json.loads(line) for line in body.splitlines()] == [
+        {"date": "2023-01-02", "avg_184_d": 2.0, "stagione": "Inverno"},
+        {"date": "2023-01-03", "avg_184_d": 3.0, "stagione": "Inverno"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_export_streams_upstream_rows_as_csv(monkeypatch):
+    """
+    Test that upstream rows are sent in chunks before the whole export has been read, skipping empty measurements.
+    """
+    monkeypatch.delenv('PRECIPITATION_STORE_DIR', raising=False)
+    monkeypatch.setattr('app.services.export_service.EXPORT_CHUNK_ROWS', 1)
+    content = StreamedBody([
+        b"date;avg_184_d;stagione\n",
+        b"2023-01-01T00:00:00+00:00;1.5;Inverno\n",
+        b"2023-01-02T00:00:00+00:00;;Inverno\n",
+        b"2023-01-03T00:00:00+00:00;0.0;Inverno\n"
+    ])
+    response = MagicMock()
+    response.status = 200
+    response.content = content
+    mock_get = MagicMock()
+    mock_get.return_value.__aenter__.return_value = response
+
+    with patch('aiohttp.ClientSession.get', mock_get):
+        chunks = await stream_precipitation_export(datetime(2023, 1, 1), datetime(2023, 1, 3), "csv")
+        header = await chunks.__anext__()
+        first = await chunks.__anext__()
+        assert content.consumed < len(content.lines)
+        rest = await collect(chunks)
+
+    assert (header + first).decode() + rest == "date,avg_184_d,stagione\n2023-01-01,1.5,Inverno\n2023-01-03,0.0,Inverno\n"
+    assert mock_get.call_args.kwargs["params"]["where"] == "date >= '2023-01-01' AND date <= '2023-01-03'"
+
+
+@pytest.mark.asyncio
+async def test_export_rejects_unknown_format():
+    """
+    Test that an unknown format is rejected before anything is streamed.
+    """
+    with pytest.raises(ValueError):
+        await stream_precipitation_export(datetime(2023, 1, 1), datetime(2023, 1, 3), "xml")
+
+
+@pytest.mark.asyncio
+async def test_failed_upstream_export_raises_before_streaming(monkeypatch):
+    """
+    Test that an upstream export failing to open raises before the first chunk, so it can still be answered with a 502.
+    """
+    monkeypatch.delenv('PRECIPITATION_STORE_DIR', raising=False)
+    mock_get = MagicMock()
+    mock_get.return_value.__aenter__.return_value.status = 503
+
+    with patch('aiohttp.ClientSession.get', mock_get):
+        with pytest.raises(UpstreamError):
+            await stream_precipitation_export(datetime(2023, 1, 1), datetime(2023, 1, 3), "csv")
@@ -1,14 +1,28 @@
 import pytest
-import aiohttp
+import json
 from unittest.mock import patch, AsyncMock
-from datetime import datetime
-from ..utils.redis_client import redis_client
+from ..conftest import mock_api_response
+from ..utils.codec import decode
+from .test_dataset_service import MOCK_DATASET
+from datetime import datetime, timedelta
 from ..models.precipitation_model import PrecipitationResponse
-from .precipitation_service import fetch_precipitation_data, get_weekly_precipitation  # Adjust the import as needed
-from ..utils.date_utils import get_week_range
+from ..models.precipitation_columns import PrecipitationColumns
+from .precipitation_service import fetch_precipitation_data, get_weekly_precipitation, get_precipitation_range, get_precipitation_batch_payload, CLOSED_WEEK_TTL  # Adjust the import as needed
+from ..utils.date_utils import get_week_range, iter_week_ranges
 
 PRECIPITATION_API_URL = "https://opendata.comune.bologna.it/api/explore/v2.1/catalog/datasets/precipitazioni_bologna/records"
 
+MOCK_PRECIPITATION = {
+    "total_count": 3,
+    "results": [
+        {"date": "2022-12-26", "avg_184_d": 0.0, "stagione": "Inverno"},
+        {"date": "2022-12-27", "avg_184_d": 4.2, "stagione": "Inverno"},
+        {"date": "2022-12-28", "avg_184_d": 11.6, "stagione": "Inverno"}
+    ]
+}
+
+
+
 @pytest.mark.asyncio
 async def test_fetch_precipitation_data():
     """
@@ -16,27 +30,22 @@ async def test_fetch_precipitation_data():
 
     This test uses a mocked API response to ensure that the fetch_precipitation_data
     function correctly fetches and validates the precipitation data from the Opendata API.
-    It checks if the returned data is an instance of PrecipitationResponse and matches
+    It checks if the returned data is packed into PrecipitationColumns and matches
     the expected mock response data.
     """
-    mock_response_data = {
-        # Add mock data that matches the structure expected by PrecipitationResponse
-    }
+    mock_response_data = MOCK_PRECIPITATION
     
     start_date = datetime(2023, 1, 1)
     end_date = datetime(2023, 1, 7)
     
-    with patch('aiohttp.ClientSession.get', new_callable=AsyncMock) as mock_get:
-        mock_get.return_value.__aenter__.return_value.status = 200
-        mock_get.return_value.__aenter__.return_value.json = AsyncMock(return_value=mock_response_data)
-        
+    with patch('aiohttp.ClientSession.get', mock_api_response(mock_response_data)):
         precipitation_data = await fetch_precipitation_data(start_date, end_date)
         
-        assert isinstance(precipitation_data, PrecipitationResponse)
-        assert precipitation_data == PrecipitationResponse(**mock_response_data)
+        assert isinstance(precipitation_data, PrecipitationColumns)
+        assert precipitation_data.to_model() == PrecipitationResponse(**mock_response_data)
 
 @pytest.mark.asyncio
-async def test_get_weekly_precipitation():
+async def test_get_weekly_precipitation(fake_redis):
     """
     Test the get_weekly_precipitation function.
 
@@ -46,28 +55,29 @@ async def test_get_weekly_precipitation():
     and matches the expected mock response data, and also verifies that the data was
     cached in Redis with the correct key and expiration time.
     """
-    mock_response_data = {
-        # Add mock data that matches the structure expected by PrecipitationResponse
-    }
+    mock_response_data = MOCK_PRECIPITATION
+    # The dataset metadata provides the version the week is cached at
+    fake_redis.data["opendata_bologna_dataset"] = json.dumps(MOCK_DATASET)
     
     date = datetime(2023, 1, 1)
     week_start, week_end = get_week_range(date)
+    cache_key = f"precipitation_data_{week_start}_{week_end}"
     
-    with patch('redis_client.get', return_value=None):
-        with patch('aiohttp.ClientSession.get', new_callable=AsyncMock) as mock_get:
-            mock_get.return_value.__aenter__.return_value.status = 200
-            mock_get.return_value.__aenter__.return_value.json = AsyncMock(return_value=mock_response_data)
-            
-            precipitation_data = await get_weekly_precipitation(date)
-            
-            assert isinstance(precipitation_data, PrecipitationResponse)
-            assert precipitation_data == PrecipitationResponse(**mock_response_data)
-            
-            # Check if the data was cached
-            redis_client.setex.assert_called_once_with(f"precipitation_data_{week_start}_{week_end}", 86400, json.dumps(precipitation_data.model_dump()))
+    with patch('aiohttp.ClientSession.get', mock_api_response(mock_response_data)):
+        precipitation_data = await get_weekly_precipitation(date)
+        
+        assert isinstance(precipitation_data, PrecipitationResponse)
+        assert precipitation_data == PrecipitationResponse(**mock_response_data)
+        
+        # Check if the data was cached
+        assert decode(fake_redis.data[cache_key]) == precipitation_data.model_dump_json().encode()
+        # A week long past is closed, so its last known value never expires
+        assert fake_redis.ttls[cache_key] == CLOSED_WEEK_TTL
+        assert fake_redis.ttls[f"{cache_key}:stale"] is None
+        assert fake_redis.data[f"{cache_key}:version"] == MOCK_DATASET["metas"]["default"]["data_processed"]
 
 @pytest.mark.asyncio
-async def test_get_weekly_precipitation_from_cache():
+async def test_get_weekly_precipitation_from_cache(fake_redis):
     """
     Test the get_weekly_precipitation function when data is retrieved from cache.
 
@@ -76,15 +86,146 @@ async def test_get_weekly_precipitation_from_cache():
     making an API call. It checks if the returned data is an instance of
     PrecipitationResponse and matches the expected mock cached data from Redis.
     """
-    mock_cached_data = {
-        # Add mock data that matches the structure expected by PrecipitationResponse
-    }
+    mock_cached_data = MOCK_PRECIPITATION
     
     date = datetime(2023, 1, 1)
     week_start, week_end = get_week_range(date)
     
-    with patch('redis_client.get', return_value=json.dumps(mock_cached_data)):
+    fake_redis.data[f"precipitation_data_{week_start}_{week_end}"] = json.dumps(mock_cached_data)
+    
+    with patch('aiohttp.ClientSession.get') as mock_get:
         precipitation_data = await get_weekly_precipitation(date)
         
         assert isinstance(precipitation_data, PrecipitationResponse)
         assert precipitation_data == PrecipitationResponse(**mock_cached_data)
+        mock_get.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_fetch_precipitation_data_paginates():
+    """
+    Test that fetch_precipitation_data keeps requesting pages past the 100-record limit.
+    """
+    records = [{"date": f"2023-01-{day:02d}", "avg_184_d": 1.0, "stagione": "Inverno"} for day in range(1, 31)] * 5
+    pages = [
+        {"total_count": len(records), "results": records[:100]},
+        {"total_count": len(records), "results": records[100:]}
+    ]
+    mock_get = mock_api_response(None)
+    mock_get.return_value.__aenter__.return_value.json = AsyncMock(side_effect=pages)
+
+    with patch('aiohttp.ClientSession.get', mock_get):
+        precipitation_data = await fetch_precipitation_data(datetime(2023, 1, 1), datetime(2023, 5, 31))
+
+    assert len(precipitation_data) == 150
+    offsets = [call.kwargs["params"]["offset"] for call in mock_get.call_args_list]
+    assert offsets == [0, 100]
+
+
+@pytest.mark.asyncio
+async def test_get_precipitation_range_reads_weeks_in_one_round_trip(fake_redis):
+    """
+    Test that a range is assembled in date order from cached weekly chunks read with one MGET.
+    """
+    for week_start, week_end in iter_week_ranges(datetime(2023, 1, 2), datetime(2023, 1, 15)):
+        days = [(week_start + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(7)]
+        week = {"total_count": 7, "results": [{"date": day, "avg_184_d": 1.0, "stagione": "Inverno"} for day in reversed(days)]}
+        fake_redis.data[f"precipitation_data_{week_start}_{week_end}"] = json.dumps(week)
+
+    mget_calls = []
+    original_mget = fake_redis.mget
+
+    async def counting_mget(keys):
+        mget_calls.append(keys)
+        return await original_mget(keys)
+
+    fake_redis.mget = counting_mget
+
+    with patch('aiohttp.ClientSession.get') as mock_get:
+        data = await get_precipitation_range(datetime(2023, 1, 4), datetime(2023, 1, 12))
+
+    mock_get.assert_not_called()
+    assert len(mget_calls) == 1
+    dates = [record["date"] for record in data["results"]]
+    assert dates == [(datetime(2023, 1, 4) + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(9)]
+    assert data["total_count"] == 9
+
+
+@pytest.mark.asyncio
+async def test_get_precipitation_batch_dedupes_dates_to_weeks(fake_redis):
+    """
+    Test that dates in the same week share one entry and all weeks are read with one MGET.
+    """
+    for week_start, week_end in iter_week_ranges(datetime(2023, 1, 2), datetime(2023, 1, 15)):
+        week = {"total_count": 1, "results": [{"date": week_start.strftime("%Y-%m-%d"), "avg_184_d": 1.0, "stagione": "Inverno"}]}
+        fake_redis.data[f"precipitation_data_{week_start}_{week_end}"] = json.dumps(week)
+
+    mget_calls = []
+    original_mget = fake_redis.mget
+
+    async def counting_mget(keys):
+        mget_calls.append(keys)
+        return await original_mget(keys)
+
+    fake_redis.mget = counting_mget
+
+    dates = [datetime(2023, 1, 4), datetime(2023, 1, 10), datetime(2023, 1, 2), datetime(2023, 1, 4)]
+    with patch('aiohttp.ClientSession.get') as mock_get:
+        payload = await get_precipitation_batch_payload(dates)
+
+    mock_get.assert_not_called()
+    assert len(mget_calls) == 1
+    # Two weeks, each read as its fresh and last known value
+    assert len(mget_calls[0]) == 4
+    data = json.loads(payload.body)
+    assert data["dates"] == {"2023-01-04": "2023-01-02", "2023-01-10": "2023-01-09", "2023-01-02": "2023-01-02"}
+    assert list(data["weeks"]) == ["2023-01-02", "2023-01-09"]
+    assert data["weeks"]["2023-01-09"]["results"][0]["date"] == "2023-01-09"
+
+
+@pytest.mark.asyncio
+async def test_get_precipitation_batch_writes_missing_weeks_in_one_pipeline(fake_redis):
+    """
+    Test that missing weeks are fetched and written back, with their versions, in a single pipeline.
+    """
+    fake_redis.data["opendata_bologna_dataset"] = json.dumps(MOCK_DATASET)
+    write_pipelines = []
+    original_pipeline = fake_redis.pipeline
+
+    def recording_pipeline(transaction=True):
+        pipe = original_pipeline(transaction)
+        original_execute = pipe.execute
+
+        async def execute():
+            if any(name == "set" and kwargs.get("ex") for name, _, kwargs in pipe.commands):
+                write_pipelines.append(list(pipe.commands))
+            return await original_execute()
+
+        pipe.execute = execute
+        return pipe
+
+    fake_redis.pipeline = recording_pipeline
+
+    dates = [datetime(2023, 1, 4), datetime(2023, 1, 10), datetime(2023, 1, 18)]
+    with patch('aiohttp.ClientSession.get', mock_api_response(MOCK_PRECIPITATION)) as mock_get:
+        payload = await get_precipitation_batch_payload(dates)
+
+    assert mock_get.call_count == 3
+    assert len(write_pipelines) == 1
+    data = json.loads(payload.body)
+    assert sorted(data["weeks"]) == ["2023-01-02", "2023-01-09", "2023-01-16"]
+    for week_start, week_end in iter_week_ranges(datetime(2023, 1, 2), datetime(2023, 1, 22)):
+        cache_key = f"precipitation_data_{week_start}_{week_end}"
+        assert json.loads(decode(fake_redis.data[cache_key])) == MOCK_PRECIPITATION
+        assert fake_redis.data[f"{cache_key}:version"] == MOCK_DATASET["metas"]["default"]["data_processed"]
+        assert f"lease:{cache_key}" not in fake_redis.data
+
+
+@pytest.mark.asyncio
+async def test_get_precipitation_batch_rejects_too_many_dates(fake_redis):
+    """
+    Test that a batch larger than MAX_BATCH_DATES is refused before any lookup.
+    """
+    dates = [datetime(2023, 1, 1) + timedelta(days=offset) for offset in range(367)]
+    with pytest.raises(ValueError):
+        await get_precipitation_batch_payload(dates)
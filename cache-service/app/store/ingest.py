@@ -0,0 +1,187 @@
+import asyncio
+import csv
+import fcntl
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional
+
+import aiohttp
+
+from ..utils.http_client import get_http_client, OPENDATA_API_URL
+from ..utils.metrics import upstream_timer
+from ..utils.resilience import UpstreamError
+from .precipitation_store import PrecipitationStore, date_to_day, day_to_date, get_precipitation_store
+
+logger = logging.getLogger(__name__)
+
+EXPORT_URL = f"{OPENDATA_API_URL}/catalog/datasets/precipitazioni_bologna/exports/csv"
+
+# The export streams the whole history, so only bound the gaps between chunks
+EXPORT_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=5, sock_read=60)
+
+# Rows parsed before they are appended to the store
+INGEST_BATCH_SIZE = 10000
+
+PRECIPITATION_STORE_SYNC_INTERVAL = int(os.getenv('PRECIPITATION_STORE_SYNC_INTERVAL', 0))
+
+_sync_task: Optional[asyncio.Task] = None
+
+
+class _Batch:
+    """
+    Column buffers for the rows parsed since the last append.
+    """
+
+    def __init__(self):
+        self.days: List[int] = []
+        self.values: List[float] = []
+        self.stagioni: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+
+async def iter_export_rows(params: Dict[str, str]) -> AsyncIterator[Dict[str, str]]:
+    """
+    Streams the rows of a CSV export as they arrive, without buffering the body.
+
+    :param params: The export query parameters; the delimiter must be ';'.
+    :return: An async iterator of rows keyed by column name.
+    :raises UpstreamError: If the export request fails, or the body is cut off.
+    """
+    columns = None
+    session = get_http_client()
+    with upstream_timer("export") as upstream:
+        try:
+            async with session.get(EXPORT_URL, params=params, timeout=EXPORT_TIMEOUT) as response:
+                upstream["status"] = response.status
+                if response.status != 200:
+                    raise UpstreamError("Failed to export precipitation data", response.status)
+                async for raw_line in response.content:
+                    line = raw_line.decode("utf-8-sig").strip()
+                    if not line:
+                        continue
+                    row = next(csv.reader([line], delimiter=";"))
+                    if columns is None:
+                        columns = row
+                        continue
+                    yield dict(zip(columns, row))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UpstreamError(f"Failed to export precipitation data: {e!r}") from e
+
+
+async def sync_precipitation_store(store: PrecipitationStore) -> int:
+    """
+    Streams the records newer than the last ingested date from the export endpoint into the store.
+
+    The CSV body is parsed line by line as it arrives and appended in batches,
+    so memory stays bounded however long the history is. An exclusive file
+    lock keeps concurrent workers from appending at the same time; a worker
+    finding it taken skips the sync, since another one is already doing it.
+
+    :param store: The store to append to.
+    :return: The number of rows appended.
+    """
+    with open(os.path.join(store.directory, ".lock"), "w") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.debug("Precipitation store sync already running in another worker")
+            return 0
+        try:
+            return await _sync_locked(store)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+async def _sync_locked(store: PrecipitationStore) -> int:
+    store.reload_if_changed()
+    params = {
+        'select': 'date,avg_184_d,stagione',
+        'order_by': 'date',
+        'delimiter': ';',
+        'timezone': 'UTC'
+    }
+    if store.last_day is not None:
+        # Incremental sync: only the records after the last ingested date
+        params['where'] = f"date > '{day_to_date(store.last_day).isoformat()}'"
+        logger.info("Syncing precipitation store after %s", day_to_date(store.last_day))
+    else:
+        logger.info("Bulk loading the precipitation store")
+
+    appended = 0
+    batch = _Batch()
+    async for row in iter_export_rows(params):
+        value = row['avg_184_d']
+        if not value:
+            # Records without a measurement cannot be served as PrecipitationRecord
+            continue
+        batch.days.append(date_to_day(row['date']))
+        batch.values.append(float(value))
+        batch.stagioni.append(row['stagione'])
+        if len(batch) >= INGEST_BATCH_SIZE:
+            appended += store.append(batch.days, batch.values, batch.stagioni)
+            batch = _Batch()
+
+    if len(batch):
+        appended += store.append(batch.days, batch.values, batch.stagioni)
+    logger.info("Appended %d rows to the precipitation store", appended)
+    return appended
+
+
+async def run_periodic_sync(interval: int) -> None:
+    """
+    Syncs the store every interval seconds until cancelled.
+    """
+    while True:
+        store = get_precipitation_store()
+        if store is not None:
+            try:
+                await sync_precipitation_store(store)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Precipitation store sync failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+def start_store_sync() -> Optional[asyncio.Task]:
+    """
+    Starts the periodic store sync if PRECIPITATION_STORE_SYNC_INTERVAL is set. Called from the app lifespan.
+    """
+    global _sync_task
+    if PRECIPITATION_STORE_SYNC_INTERVAL <= 0 or get_precipitation_store() is None:
+        return None
+    if _sync_task is None or _sync_task.done():
+        _sync_task = asyncio.create_task(run_periodic_sync(PRECIPITATION_STORE_SYNC_INTERVAL))
+    return _sync_task
+
+
+async def stop_store_sync() -> None:
+    """
+    Cancels the periodic store sync.
+    """
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        try:
+            await _sync_task
+        except asyncio.CancelledError:
+            pass
+    _sync_task = None
+
+
+if __name__ == "__main__":
+    # python -m app.store.ingest: bulk load or incrementally sync PRECIPITATION_STORE_DIR
+    from ..utils.http_client import close_http_client
+
+    async def main():
+        store = get_precipitation_store()
+        if store is None:
+            raise SystemExit("PRECIPITATION_STORE_DIR is not set")
+        try:
+            await sync_precipitation_store(store)
+        finally:
+            await close_http_client()
+
+    asyncio.run(main())
@@ -0,0 +1,195 @@
+import json
+import os
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EPOCH = date(1970, 1, 1)
+
+DAYS_FILE = "days.i4"
+VALUES_FILE = "avg_184_d.f8"
+CODES_FILE = "stagione.u1"
+META_FILE = "meta.json"
+
+DAY_DTYPE = np.int32
+VALUE_DTYPE = np.float64
+CODE_DTYPE = np.uint8
+
+
+def date_to_day(value) -> int:
+    """
+    Converts a date, datetime or YYYY-MM-DD string to a day number since 1970-01-01.
+    """
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    elif isinstance(value, datetime):
+        value = value.date()
+    return (value - EPOCH).days
+
+
+def day_to_date(day: int) -> date:
+    """
+    Converts a day number since 1970-01-01 back to a date.
+    """
+    return EPOCH + timedelta(days=int(day))
+
+
+class PrecipitationStore:
+    """
+    A local, append-only columnar mirror of the precipitazioni_bologna dataset.
+
+    Each column is a flat binary file memory-mapped as a NumPy array: the day
+    number (sorted ascending), `avg_184_d` as float64 and `stagione` as a
+    uint8 category code. `meta.json` holds the row count and the category
+    names; it is replaced atomically after the columns are appended, so
+    readers in other processes never map rows that are not fully written.
+    Range lookups are binary searches over the sorted day column.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.count = 0
+        self.categories: List[str] = []
+        self.days = np.empty(0, dtype=DAY_DTYPE)
+        self.values = np.empty(0, dtype=VALUE_DTYPE)
+        self.codes = np.empty(0, dtype=CODE_DTYPE)
+        self._meta_mtime = None
+        os.makedirs(directory, exist_ok=True)
+        self.reload_if_changed()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def reload_if_changed(self) -> None:
+        """
+        Re-maps the columns if another process appended rows since the last load.
+        """
+        try:
+            mtime = os.stat(self._path(META_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime:
+            return
+        with open(self._path(META_FILE)) as meta_file:
+            meta = json.load(meta_file)
+        self._meta_mtime = mtime
+        self.count = meta["count"]
+        self.categories = meta["categories"]
+        self.days = self._map(DAYS_FILE, DAY_DTYPE)
+        self.values = self._map(VALUES_FILE, VALUE_DTYPE)
+        self.codes = self._map(CODES_FILE, CODE_DTYPE)
+
+    def _map(self, name: str, dtype) -> np.ndarray:
+        if self.count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self._path(name), dtype=dtype, mode="r", shape=(self.count,))
+
+    @property
+    def last_day(self) -> Optional[int]:
+        """
+        The day number of the newest stored record, or None if the store is empty.
+        """
+        return int(self.days[-1]) if self.count else None
+
+    def covers(self, end_date) -> bool:
+        """
+        Returns whether the store holds data up to and including the given date.
+        """
+        self.reload_if_changed()
+        return self.count > 0 and self.last_day >= date_to_day(end_date)
+
+    def search(self, start_date, end_date) -> Tuple[int, int]:
+        """
+        Returns the [lo, hi) row slice of the records between two dates, inclusive.
+        """
+        self.reload_if_changed()
+        lo = int(np.searchsorted(self.days, date_to_day(start_date), side="left"))
+        hi = int(np.searchsorted(self.days, date_to_day(end_date), side="right"))
+        return lo, hi
+
+    def columns(self, start_date, end_date) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns zero-copy views of the day, value and category code columns for a date range.
+        """
+        lo, hi = self.search(start_date, end_date)
+        return self.days[lo:hi], self.values[lo:hi], self.codes[lo:hi]
+
+    def query(self, start_date, end_date) -> Dict:
+        """
+        Returns the records between two dates, inclusive, shaped like PrecipitationResponse.
+        """
+        days, values, codes = self.columns(start_date, end_date)
+        dates = np.datetime_as_string(days.astype("datetime64[D]"))
+        categories = self.categories
+        results = [
+            {"date": day, "avg_184_d": value, "stagione": categories[code]}
+            for day, value, code in zip(dates.tolist(), values.tolist(), codes.tolist())
+        ]
+        return {"total_count": len(results), "results": results}
+
+    def append(self, days: Sequence[int], values: Sequence[float], stagioni: Sequence[str]) -> int:
+        """
+        Appends records newer than the last stored day. Only one process may write at a time.
+
+        :param days: The day numbers of the records.
+        :param values: The `avg_184_d` values of the records.
+        :param stagioni: The `stagione` names of the records.
+        :return: The number of rows appended.
+        :raises ValueError: If the records bring more distinct stagione values than a category code can hold.
+        """
+        self.reload_if_changed()
+        days = np.asarray(days, dtype=DAY_DTYPE)
+        values = np.asarray(values, dtype=VALUE_DTYPE)
+        # New names are only kept once the rows using them are written
+        categories = list(self.categories)
+        category_index = {name: code for code, name in enumerate(categories)}
+        codes = np.empty(len(stagioni), dtype=CODE_DTYPE)
+        for row, name in enumerate(stagioni):
+            code = category_index.get(name)
+            if code is None:
+                if len(categories) > np.iinfo(CODE_DTYPE).max:
+                    raise ValueError("Too many distinct stagione values")
+                code = category_index[name] = len(categories)
+                categories.append(name)
+            codes[row] = code
+
+        order = np.argsort(days, kind="stable")
+        days, values, codes = days[order], values[order], codes[order]
+        if self.count:
+            # Only append what is newer than the data already stored
+            newer = days > self.last_day
+            days, values, codes = days[newer], values[newer], codes[newer]
+        if len(days) == 0:
+            return 0
+        self.categories = categories
+
+        for name, column in ((DAYS_FILE, days), (VALUES_FILE, values), (CODES_FILE, codes)):
+            with open(self._path(name), "r+b" if os.path.exists(self._path(name)) else "wb") as column_file:
+                # Truncate anything past the committed rows left by an interrupted append
+                column_file.truncate(self.count * column.dtype.itemsize)
+                column_file.seek(0, os.SEEK_END)
+                column_file.write(column.tobytes())
+
+        meta_path = self._path(META_FILE)
+        with open(meta_path + ".tmp", "w") as meta_file:
+            json.dump({"count": self.count + len(days), "categories": self.categories}, meta_file)
+        os.replace(meta_path + ".tmp", meta_path)
+        self.reload_if_changed()
+        return len(days)
+
+
+_store: Optional[PrecipitationStore] = None
+
+
+def get_precipitation_store() -> Optional[PrecipitationStore]:
+    """
+    Returns the local precipitation mirror, or None if PRECIPITATION_STORE_DIR is not set.
+    """
+    global _store
+    directory = os.getenv('PRECIPITATION_STORE_DIR')
+    if not directory:
+        return None
+    if _store is None or _store.directory != directory:
+        _store = PrecipitationStore(directory)
+    return _store
@@ -0,0 +1,106 @@
+import pytest
+from datetime import date, datetime
+from unittest.mock import patch, MagicMock
+from .precipitation_store import PrecipitationStore, date_to_day
+from .ingest import sync_precipitation_store
+from ..utils.resilience import UpstreamError
+from ..conftest import StreamedBody
+
+
+def test_append_and_query_range(tmp_path):
+    """
+    Test that appended records are returned in date order by an inclusive range query.
+    """
+    store = PrecipitationStore(str(tmp_path))
+    days = [date_to_day(f"2023-01-0{day}") for day in (3, 1, 2, 4)]
+    store.append(days, [3.0, 1.0, 2.0, 4.0], ["Inverno"] * 4)
+
+    data = store.query(datetime(2023, 1, 2), datetime(2023, 1, 3))
+
+    assert data == {
+        "total_count": 2,
+        "results": [
+            {"date": "2023-01-02", "avg_184_d": 2.0, "stagione": "Inverno"},
+            {"date": "2023-01-03", "avg_184_d": 3.0, "stagione": "Inverno"}
+        ]
+    }
+    assert store.covers(date(2023, 1, 4))
+    assert not store.covers(date(2023, 1, 5))
+
+
+def test_append_only_keeps_newer_records_and_is_visible_to_other_readers(tmp_path):
+    """
+    Test that an incremental append skips already ingested days and other store instances see the new rows.
+    """
+    writer = PrecipitationStore(str(tmp_path))
+    reader = PrecipitationStore(str(tmp_path))
+    writer.append([date_to_day("2023-01-01"), date_to_day("2023-01-02")], [1.0, 2.0], ["Inverno", "Inverno"])
+
+    appended = writer.append([date_to_day("2023-01-02"), date_to_day("2023-03-21")], [9.0, 5.0], ["Inverno", "Primavera"])
+
+    assert appended == 1
+    assert reader.query(datetime(2023, 1, 1), datetime(2023, 12, 31))["results"] == [
+        {"date": "2023-01-01", "avg_184_d": 1.0, "stagione": "Inverno"},
+        {"date": "2023-01-02", "avg_184_d": 2.0, "stagione": "Inverno"},
+        {"date": "2023-03-21", "avg_184_d": 5.0, "stagione": "Primavera"}
+    ]
+
+
+def test_append_rejects_more_categories_than_a_code_holds(tmp_path):
+    """
+    Test that a category past the largest uint8 code is refused instead of wrapping to another category's code.
+    """
+    store = PrecipitationStore(str(tmp_path))
+    first = date_to_day("2023-01-01")
+    store.append(range(first, first + 256), [0.0] * 256, [f"stagione {code}" for code in range(256)])
+
+    with pytest.raises(ValueError):
+        store.append([first + 256], [0.0], ["stagione 256"])
+
+    assert len(store.categories) == 256
+    assert store.query(date(2023, 1, 1), date(2024, 12, 31))["results"][-1]["stagione"] == "stagione 255"
+
+
+@pytest.mark.asyncio
+async def test_sync_streams_export_after_last_ingested_date(tmp_path):
+    """
+    Test that a sync requests only records after the last ingested date and appends the streamed CSV rows.
+    """
+    store = PrecipitationStore(str(tmp_path))
+    store.append([date_to_day("2023-01-01")], [1.0], ["Inverno"])
+
+    response = MagicMock()
+    response.status = 200
+    response.content = StreamedBody([
+        "﻿date;avg_184_d;stagione\n".encode(),
+        b"2023-01-02;2.5;Inverno\n",
+        b"2023-01-03;;Inverno\n",
+        b"2023-01-04;0.0;Inverno\n"
+    ])
+    mock_get = MagicMock()
+    mock_get.return_value.__aenter__.return_value = response
+
+    with patch('aiohttp.ClientSession.get', mock_get):
+        appended = await sync_precipitation_store(store)
+
+    assert appended == 2
+    assert mock_get.call_args.kwargs["params"]["where"] == "date > '2023-01-01'"
+    assert [record["date"] for record in store.query(date(2023, 1, 1), date(2023, 1, 31))["results"]] == [
+        "2023-01-01", "2023-01-02", "2023-01-04"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_export_raises_upstream_error(tmp_path):
+    """
+    Test that an export answered with an error status raises UpstreamError, like every other upstream call.
+    """
+    store = PrecipitationStore(str(tmp_path))
+    mock_get = MagicMock()
+    mock_get.return_value.__aenter__.return_value.status = 503
+
+    with patch('aiohttp.ClientSession.get', mock_get):
+        with pytest.raises(UpstreamError) as error:
+            await sync_precipitation_store(store)
+
+    assert error.value.status == 503
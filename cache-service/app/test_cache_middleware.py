@@ -0,0 +1,153 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from .cache_middleware import CACHE_STALE_TTL_FACTOR, CacheSpec, cache_lookup, cache_middleware, refresh_many, stale_key, version_key, validators_key, _background_refreshes
+from .utils.codec import decode
+from .utils.single_flight import acquire_leases
+from .utils.http_client import NotModified, UpstreamValidators
+
+
+async def drain_background_refreshes():
+    """
+    Waits for every scheduled background refresh to finish.
+    """
+    if _background_refreshes:
+        await asyncio.gather(*list(_background_refreshes))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_fetch(fake_redis):
+    """
+    Test that concurrent misses on the same key trigger a single upstream fetch.
+    """
+    async def slow_fetch():
+        await asyncio.sleep(0.05)
+        return {"total_count": 0, "results": []}
+
+    fetch_function = AsyncMock(side_effect=slow_fetch)
+
+    results = await asyncio.gather(*(cache_middleware("coalesced_key", fetch_function, ttl=60) for _ in range(20)))
+
+    assert fetch_function.await_count == 1
+    assert all(result is results[0] for result in results)
+    assert decode(fake_redis.data["coalesced_key"]) == results[0].body
+    # The lease is released once the refresh finishes
+    assert "lease:coalesced_key" not in fake_redis.data
+
+
+@pytest.mark.asyncio
+async def test_lease_held_elsewhere_serves_previous_value(fake_redis):
+    """
+    Test that a worker losing the refresh lease serves the last known value without fetching.
+    """
+    fake_redis.data["lease:busy_key"] = "other-worker"
+
+    async def get(key):
+        # The last known value shows up only once this worker has lost the lease
+        return '{"previous": true}' if key == stale_key("busy_key") else None
+
+    fake_redis.get = get
+    fetch_function = AsyncMock()
+
+    result = await cache_middleware("busy_key", fetch_function, ttl=60)
+
+    assert result.body == b'{"previous": true}'
+    fetch_function.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_past_soft_ttl_serves_stale_and_refreshes_in_background(fake_redis):
+    """
+    Test that a value past its soft TTL is served immediately while it is refreshed in the background.
+    """
+    fake_redis.data[stale_key("soft_key")] = '"old"'
+    fetch_function = AsyncMock(return_value="new")
+
+    result = await cache_middleware("soft_key", fetch_function, ttl=60)
+    assert result.body == b'"old"'
+
+    await drain_background_refreshes()
+    fetch_function.assert_awaited_once()
+    assert decode(fake_redis.data["soft_key"]) == b'"new"'
+
+
+@pytest.mark.asyncio
+async def test_unchanged_version_skips_download(fake_redis):
+    """
+    Test that revalidation re-arms the last known value without fetching when the upstream version is unchanged.
+    """
+    fake_redis.data[stale_key("versioned_key")] = '"old"'
+    fake_redis.data[version_key("versioned_key")] = "v1"
+    fetch_function = AsyncMock(return_value="new")
+
+    await cache_middleware("versioned_key", fetch_function, ttl=60, version_function=AsyncMock(return_value="v1"))
+    await drain_background_refreshes()
+
+    fetch_function.assert_not_awaited()
+    assert decode(fake_redis.data["versioned_key"]) == b'"old"'
+    assert fake_redis.ttls["versioned_key"] == 60
+
+
+@pytest.mark.asyncio
+async def test_unchanged_version_extends_validators_with_the_value(fake_redis):
+    """
+    Test that re-arming on an unchanged version also extends the validators, so they live as long as the value they describe.
+    """
+    fake_redis.data[stale_key("versioned_key")] = '"old"'
+    fake_redis.data[version_key("versioned_key")] = "v1"
+    fake_redis.data[validators_key("versioned_key")] = UpstreamValidators(etag='"v1"').to_json()
+    fake_redis.ttls[validators_key("versioned_key")] = 5
+    fetch_function = AsyncMock(return_value="new")
+
+    await cache_middleware("versioned_key", fetch_function, ttl=60, version_function=AsyncMock(return_value="v1"), conditional=True)
+    await drain_background_refreshes()
+
+    fetch_function.assert_not_awaited()
+    assert fake_redis.ttls[validators_key("versioned_key")] == fake_redis.ttls[stale_key("versioned_key")] == 60 * CACHE_STALE_TTL_FACTOR
+    assert UpstreamValidators.from_json(fake_redis.data[validators_key("versioned_key")]).etag == '"v1"'
+
+
+@pytest.mark.asyncio
+async def test_conditional_refresh_not_modified_rearms_previous_value(fake_redis):
+    """
+    Test that a conditional refresh sends the stored validators and re-arms the last known value on 304.
+    """
+    fake_redis.data[stale_key("conditional_key")] = '"old"'
+    fake_redis.data[validators_key("conditional_key")] = UpstreamValidators(etag='"v1"').to_json()
+    sent_headers = []
+
+    async def fetch_function(validators):
+        sent_headers.append(validators.request_headers())
+        raise NotModified()
+
+    await cache_middleware("conditional_key", fetch_function, ttl=60, conditional=True)
+    await drain_background_refreshes()
+
+    assert sent_headers == [{"If-None-Match": '"v1"'}]
+    assert decode(fake_redis.data["conditional_key"]) == b'"old"'
+    assert fake_redis.ttls["conditional_key"] == 60
+
+
+@pytest.mark.asyncio
+async def test_lookup_during_batch_lease_round_trip_joins_the_batch(fake_redis, monkeypatch):
+    """
+    Test that a lookup of a key arriving while a batch takes its leases joins the batch, instead of losing the lease and waiting for its TTL.
+    """
+    monkeypatch.setattr("app.cache_middleware.CACHE_LEASE_TTL_MS", 5000)
+    single_fetch = AsyncMock(return_value={"value": "single"})
+    batch_fetch = AsyncMock(return_value={"value": "batch"})
+    lookups = []
+
+    async def acquire_leases_then_lookup(keys, ttl_ms):
+        tokens = await acquire_leases(keys, ttl_ms)
+        lookups.append(asyncio.ensure_future(cache_lookup(CacheSpec("shared_key", single_fetch, ttl=60))))
+        await asyncio.sleep(0.01)
+        return tokens
+
+    monkeypatch.setattr("app.cache_middleware.acquire_leases", acquire_leases_then_lookup)
+    batch_payloads = await asyncio.wait_for(refresh_many([CacheSpec("shared_key", batch_fetch, ttl=60), CacheSpec("other_key", batch_fetch, ttl=60)]), 1)
+    single_payload = await asyncio.wait_for(lookups[0], 1)
+
+    assert [payload.body for payload in batch_payloads] == [b'{"value":"batch"}', b'{"value":"batch"}']
+    assert single_payload.body == b'{"value":"batch"}'
+    single_fetch.assert_not_awaited()
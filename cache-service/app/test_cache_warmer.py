@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+from datetime import datetime
+from . import cache_warmer
+from .cache_middleware import CacheSpec
+from .utils.access_log import access_log, ACCESS_LOG_KEY
+from .utils.memory_cache import memory_cache
+from .utils.payload import CachedPayload
+
+
+@pytest.fixture
+def warmer(monkeypatch):
+    """
+    Enables the warmer with its own key families, isolated from the services' registrations.
+    """
+    fetches = []
+
+    def resolver(cache_key):
+        async def fetch():
+            fetches.append(cache_key)
+            return {"key": cache_key}
+        return CacheSpec(cache_key, fetch, ttl=1000) if cache_key.startswith("warm_") else None
+
+    monkeypatch.setattr(cache_warmer, 'CACHE_WARMER_INTERVAL', 60)
+    monkeypatch.setattr(cache_warmer, '_key_resolvers', [resolver])
+    monkeypatch.setattr(cache_warmer, '_pinned_keys', [])
+    monkeypatch.setattr(access_log, 'enabled', True)
+    yield fetches
+    access_log.counts.clear()
+
+
+@pytest.mark.asyncio
+async def test_warmer_refreshes_hot_and_pinned_keys_close_to_expiry(fake_redis, warmer):
+    """
+    Test that a cycle refreshes pinned and hot keys that are missing or close to expiry, and skips unknown keys.
+    """
+    cache_warmer.pin_keys("warm_pinned")
+    fake_redis.data.update({"warm_hot": "{}", "warm_hot:stale": "{}", "warm_fresh": "{}"})
+    fake_redis.ttls.update({"warm_hot": 50, "warm_fresh": 900})
+    for cache_key in ("warm_hot", "warm_hot", "warm_fresh", "unknown_key"):
+        access_log.record(cache_key)
+
+    warmed = await cache_warmer.warm_once()
+
+    assert sorted(warmer) == ["warm_hot", "warm_pinned"]
+    assert warmed == 2
+    assert fake_redis.ttls["warm_hot"] == 1000
+    # Counts reach Redis, decayed once by the cycle
+    assert fake_redis.data[ACCESS_LOG_KEY]["warm_hot"] == pytest.approx(2 * cache_warmer.CACHE_WARMER_DECAY)
+    # Another worker in the same interval does not run a second cycle
+    assert await cache_warmer.warm_once() == 0
+
+
+@pytest.mark.asyncio
+async def test_warmer_respects_upstream_rate_limit(fake_redis, warmer, monkeypatch):
+    """
+    Test that a cycle stops refreshing once the per-minute upstream budget is spent.
+    """
+    monkeypatch.setattr(cache_warmer, 'CACHE_WARMER_RATE_LIMIT', 1)
+    cache_warmer.pin_keys("warm_a", "warm_b")
+
+    await cache_warmer.warm_once()
+
+    assert len(warmer) == 1
+
+
+@pytest.mark.asyncio
+async def test_prefetch_fetches_only_uncached_keys(fake_redis, warmer):
+    """
+    Test that scheduled prefetches fetch the keys cached nowhere and leave the others alone.
+    """
+    fake_redis.data["warm_cached:stale"] = "{}"
+    specs = [cache_warmer.spec_for_key("warm_cached"), cache_warmer.spec_for_key("warm_next")]
+
+    cache_warmer.schedule_prefetch(specs)
+    await asyncio.gather(*list(cache_warmer._prefetch_tasks))
+
+    assert warmer == ["warm_next"]
+    assert "warm_next" in fake_redis.data
+
+
+@pytest.mark.asyncio
+async def test_prefetch_does_not_count_memory_tier_lookups(fake_redis, warmer):
+    """
+    Test that checking which keys are already in memory is not counted in the tier statistics.
+    """
+    memory_cache.set("warm_cached", CachedPayload(b"{}"), ttl=60)
+    hits, misses = memory_cache.stats.hits, memory_cache.stats.misses
+
+    await cache_warmer.prefetch([cache_warmer.spec_for_key("warm_cached")])
+
+    assert (memory_cache.stats.hits, memory_cache.stats.misses) == (hits, misses)
+    assert warmer == []
+
+
+def test_adjacent_weeks_skip_the_future():
+    """
+    Test that the neighbours of the current week do not include next week.
+    """
+    from .services.precipitation_service import adjacent_week_specs
+
+    specs = adjacent_week_specs(datetime(2024, 5, 27), today=datetime(2024, 5, 29))
+
+    assert [spec.cache_key for spec in specs] == ["precipitation_data_2024-05-20 00:00:00_2024-05-26 00:00:00"]
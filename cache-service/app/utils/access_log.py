@@ -0,0 +1,70 @@
+import os
+from collections import Counter
+
+from .redis_client import as_text, get_redis_client
+
+# Sorted set of access counts per cache key, shared by every worker
+ACCESS_LOG_KEY = os.getenv('CACHE_ACCESS_LOG_KEY', 'cache:access')
+# Distinct keys counted between two flushes; accesses to further keys are dropped
+ACCESS_LOG_MAX_KEYS = int(os.getenv('CACHE_ACCESS_LOG_MAX_KEYS', 10000))
+# Keys kept in the sorted set after each decay
+ACCESS_LOG_RETAINED_KEYS = int(os.getenv('CACHE_ACCESS_LOG_RETAINED_KEYS', 1000))
+
+
+class AccessLog:
+    """
+    Counts cache key accesses in-process and adds them to a Redis sorted set in batches.
+
+    Recording an access is a dict increment; the counts reach Redis with one
+    pipelined ZINCRBY per key on the next flush. Nothing is recorded until the
+    log is enabled, so workers without a cache warmer pay nothing.
+    """
+
+    def __init__(self, max_keys: int = ACCESS_LOG_MAX_KEYS):
+        self.max_keys = max_keys
+        self.enabled = False
+        self.counts: Counter = Counter()
+
+    def record(self, cache_key: str) -> None:
+        """
+        Counts one access to a key.
+        """
+        if not self.enabled:
+            return
+        if cache_key in self.counts or len(self.counts) < self.max_keys:
+            self.counts[cache_key] += 1
+
+    async def flush(self) -> int:
+        """
+        Adds the counts recorded since the last flush to the shared sorted set.
+
+        :return: The number of keys flushed.
+        """
+        counts, self.counts = self.counts, Counter()
+        if not counts:
+            return 0
+        async with get_redis_client().pipeline(transaction=False) as pipe:
+            for cache_key, count in counts.items():
+                pipe.zincrby(ACCESS_LOG_KEY, count, cache_key)
+            await pipe.execute()
+        return len(counts)
+
+
+async def hottest_keys(count: int) -> list:
+    """
+    Returns the most accessed keys across every worker, hottest first.
+    """
+    return [as_text(cache_key) for cache_key in await get_redis_client().zrevrange(ACCESS_LOG_KEY, 0, count - 1)]
+
+
+async def decay_access_counts(factor: float) -> None:
+    """
+    Scales every access count by factor and drops the coldest keys, so old popularity fades.
+    """
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        pipe.zunionstore(ACCESS_LOG_KEY, {ACCESS_LOG_KEY: factor})
+        pipe.zremrangebyrank(ACCESS_LOG_KEY, 0, -ACCESS_LOG_RETAINED_KEYS - 1)
+        await pipe.execute()
+
+
+access_log = AccessLog()
@@ -0,0 +1,89 @@
+import os
+import zlib
+from typing import Optional, Union
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, zlib is always available
+    zstandard = None
+
+# Stored values start with NUL, which never starts a JSON document, so
+# values written before the codec existed are still read as plain JSON
+MAGIC = b"\x00"
+# Bumped whenever the layout after the header changes
+FORMAT_VERSION = 1
+HEADER_SIZE = 3
+
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+CODEC_NAMES = {"none": CODEC_RAW, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+# "zstd", "zlib" or "none"; zstd falls back to zlib when the zstandard package is missing
+CACHE_COMPRESSION = os.getenv('CACHE_COMPRESSION', 'zstd')
+# Values smaller than this are stored uncompressed; a week of records is about 450 bytes of JSON
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', 256))
+CACHE_COMPRESSION_LEVEL = int(os.getenv('CACHE_COMPRESSION_LEVEL', 3))
+
+
+class CodecError(ValueError):
+    """
+    Raised for a stored value with an unknown format version or codec.
+    """
+
+
+def default_codec() -> int:
+    codec = CODEC_NAMES.get(CACHE_COMPRESSION, CODEC_ZLIB)
+    if codec == CODEC_ZSTD and zstandard is None:
+        return CODEC_ZLIB
+    return codec
+
+
+_codec = default_codec()
+_zstd_compressor = zstandard.ZstdCompressor(level=CACHE_COMPRESSION_LEVEL) if zstandard is not None else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+
+def encode(body: Union[str, bytes], codec: Optional[int] = None) -> bytes:
+    """
+    Encodes a JSON body into its stored form: a 3-byte header (magic, format version, codec) and the body, compressed if large enough.
+
+    :param body: The JSON body.
+    :param codec: The codec to use, defaults to CACHE_COMPRESSION.
+    :return: The bytes to store in Redis.
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    codec = _codec if codec is None else codec
+    if len(body) < CACHE_COMPRESS_MIN_BYTES:
+        codec = CODEC_RAW
+    if codec == CODEC_ZSTD:
+        body = _zstd_compressor.compress(body)
+    elif codec == CODEC_ZLIB:
+        body = zlib.compress(body, CACHE_COMPRESSION_LEVEL)
+    return MAGIC + bytes((FORMAT_VERSION, codec)) + body
+
+
+def decode(value: Union[str, bytes]) -> bytes:
+    """
+    Returns the JSON body of a stored value, or of a plain JSON value written before the codec existed.
+
+    :param value: The value read from Redis.
+    :return: The JSON body.
+    :raises CodecError: If the value was written by an unknown format version or codec.
+    """
+    if isinstance(value, str):
+        return value.encode()
+    if not value.startswith(MAGIC):
+        return value
+    version, codec = value[1], value[2]
+    if version != FORMAT_VERSION:
+        raise CodecError(f"Unknown cache format version {version}")
+    body = value[HEADER_SIZE:]
+    if codec == CODEC_RAW:
+        return body
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(body)
+    if codec == CODEC_ZSTD and _zstd_decompressor is not None:
+        return _zstd_decompressor.decompress(body)
+    raise CodecError(f"Cannot decode cache codec {codec}")
@@ -1,4 +1,11 @@
+import logging
 from datetime import datetime, timedelta
+from typing import Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Days after a week ends during which late upstream corrections are still expected
+CLOSED_WEEK_GRACE_DAYS = 7
 
 def get_week_range(date: datetime) -> tuple:
     """
@@ -9,9 +16,33 @@ def get_week_range(date: datetime) -> tuple:
     :param date: The date to find the week range for.
     :return: A tuple of two datetime objects: the start and end dates of the week.
     """
-    print(f"Calculating week range for date: {date}")
     start_of_week = date - timedelta(days=date.weekday())
-    print(f"Start of the week (Monday): {start_of_week}")
     end_of_week = start_of_week + timedelta(days=6)
-    print(f"End of the week (Sunday): {end_of_week}")
+    logger.debug("Week of %s runs from %s to %s", date, start_of_week, end_of_week)
     return start_of_week, end_of_week
+
+
+def is_closed_week(week_end: datetime, today: datetime = None) -> bool:
+    """
+    Returns whether a week ended long enough ago that its data is not expected to change.
+
+    :param week_end: The last day of the week.
+    :param today: The current date, defaults to now.
+    :return: True if the week is closed.
+    """
+    today = today or datetime.now()
+    return week_end.date() < (today - timedelta(days=CLOSED_WEEK_GRACE_DAYS)).date()
+
+
+def iter_week_ranges(start_date: datetime, end_date: datetime) -> Iterator[Tuple[datetime, datetime]]:
+    """
+    Yields the Monday-Sunday ranges of every week overlapping the given dates, in order.
+
+    :param start_date: The first date of the range.
+    :param end_date: The last date of the range.
+    :return: An iterator of (start, end) tuples, as returned by get_week_range.
+    """
+    week_start = start_date - timedelta(days=start_date.weekday())
+    while week_start <= end_date:
+        yield week_start, week_start + timedelta(days=6)
+        week_start += timedelta(days=7)
@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Dict, Optional, Set
+
+from .formats import dumps
+from .invalidation import register_invalidation_handler
+from .memory_cache import memory_cache
+from .metrics import Counter, Gauge, registry
+from .payload import CachedPayload
+from .redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# Event stream connections one worker accepts; further ones get 503
+SSE_MAX_CONNECTIONS = int(os.getenv('SSE_MAX_CONNECTIONS', 200))
+# Events buffered per connection; a client this far behind is disconnected and reconnects
+SSE_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', 32))
+# Seconds of silence after which a comment is sent, so proxies keep the connection open
+SSE_KEEPALIVE_INTERVAL = float(os.getenv('SSE_KEEPALIVE_INTERVAL', 15))
+# Payloads larger than this are announced without their body, clients fetch them instead
+SSE_MAX_PAYLOAD_BYTES = int(os.getenv('SSE_MAX_PAYLOAD_BYTES', 65536))
+# How long browsers wait before reconnecting a dropped stream
+SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', 3000))
+
+# Written keys waiting to be broadcast; beyond this, writes are not pushed
+PENDING_KEYS_LIMIT = 1024
+
+SSE_EVENTS = registry.register(Counter(
+    "sse_events_total", "Update events queued to event stream clients."
+))
+SSE_DROPPED = registry.register(Counter(
+    "sse_dropped_clients_total", "Event stream clients disconnected for falling behind."
+))
+
+
+class TooManySubscribers(Exception):
+    """
+    Raised when this worker already serves SSE_MAX_CONNECTIONS event streams.
+    """
+
+
+def format_event(event: str, data: bytes, event_id: Optional[str] = None) -> bytes:
+    """
+    Encodes one Server-Sent Event; data spanning several lines is sent as several data fields.
+    """
+    lines = [b"event: " + event.encode()]
+    if event_id is not None:
+        lines.append(b"id: " + event_id.encode())
+    lines.extend(b"data: " + line for line in data.split(b"\n"))
+    return b"\n".join(lines) + b"\n\n"
+
+
+class Subscription:
+    """
+    One event stream client: the keys it follows, each with the topic it is sent as, and its event buffer.
+    """
+
+    __slots__ = ("topics", "queue")
+
+    def __init__(self, topics: Dict[str, str], queue_size: int):
+        self.topics = topics
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+
+class EventHub:
+    """
+    Pushes refreshed cache values to the event stream clients of this worker.
+
+    Every worker already receives a pub/sub message for each key written in the
+    cluster. For keys some client follows, the hub reads the new value once
+    (from the in-process tier, or Redis) and queues the same encoded event to
+    every client following it, so one refresh fans out to all dashboards.
+    Values whose ETag did not change since the last broadcast are not sent.
+
+    Each client has a bounded buffer: one that falls SSE_QUEUE_SIZE events
+    behind is disconnected instead of buffering without limit, and its browser
+    reconnects and refetches.
+    """
+
+    def __init__(self, max_connections: int = SSE_MAX_CONNECTIONS, queue_size: int = SSE_QUEUE_SIZE):
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self.subscriptions: Set[Subscription] = set()
+        self._by_key: Dict[str, Set[Subscription]] = {}
+        self._last_etags: Dict[str, str] = {}
+        self._pending: Optional[asyncio.Queue] = None
+        self._queued: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+    def subscribe(self, topics: Dict[str, str]) -> Subscription:
+        """
+        Registers a client following the given keys.
+
+        :param topics: The topic each followed cache key is sent as.
+        :raises TooManySubscribers: If the worker is at SSE_MAX_CONNECTIONS.
+        """
+        if len(self.subscriptions) >= self.max_connections:
+            raise TooManySubscribers()
+        subscription = Subscription(topics, self.queue_size)
+        self.subscriptions.add(subscription)
+        for cache_key in topics:
+            self._by_key.setdefault(cache_key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self.subscriptions.discard(subscription)
+        for cache_key in subscription.topics:
+            subscribers = self._by_key.get(cache_key)
+            if subscribers is None:
+                continue
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._by_key[cache_key]
+                self._last_etags.pop(cache_key, None)
+
+    def key_written(self, cache_key: str) -> None:
+        """
+        Queues a written key for broadcast if any client follows it. Called by the invalidation listener.
+        """
+        if self._pending is None or cache_key not in self._by_key or cache_key in self._queued:
+            return
+        try:
+            self._pending.put_nowait(cache_key)
+        except asyncio.QueueFull:
+            logger.warning("Too many pending event stream updates, not pushing '%s'", cache_key)
+            return
+        self._queued.add(cache_key)
+
+    async def load(self, cache_key: str) -> Optional[CachedPayload]:
+        """
+        Returns the current value of a key, from the in-process tier (without counting it as a lookup) or Redis.
+        """
+        payload = memory_cache.peek(cache_key)
+        if payload is not None:
+            return payload
+        value = await get_redis_client().get(cache_key)
+        return CachedPayload.from_json(value) if value else None
+
+    async def broadcast(self, cache_key: str) -> int:
+        """
+        Sends the current value of a key to every client following it, unless it is unchanged.
+
+        :return: The number of clients the event was queued to.
+        """
+        if cache_key not in self._by_key:
+            return 0
+        payload = await self.load(cache_key)
+        if payload is None or self._last_etags.get(cache_key) == payload.etag:
+            return 0
+        self._last_etags[cache_key] = payload.etag
+
+        events: Dict[str, bytes] = {}
+        sent = 0
+        for subscription in list(self._by_key.get(cache_key, ())):
+            topic = subscription.topics[cache_key]
+            event = events.get(topic)
+            if event is None:
+                data = b'{"topic":' + dumps(topic)
+                if len(payload.body) <= SSE_MAX_PAYLOAD_BYTES:
+                    data += b',"data":' + payload.body
+                event = events[topic] = format_event("update", data + b"}", payload.etag.strip('"'))
+            try:
+                subscription.queue.put_nowait(event)
+                sent += 1
+            except asyncio.QueueFull:
+                self.drop(subscription)
+        SSE_EVENTS.inc(amount=sent)
+        return sent
+
+    def close(self, subscription: Subscription) -> None:
+        """
+        Ends a client's stream: its buffered events are replaced by the end-of-stream marker.
+        """
+        self.unsubscribe(subscription)
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def drop(self, subscription: Subscription) -> None:
+        """
+        Disconnects a client that fell behind.
+        """
+        logger.info("Event stream client fell %d events behind, disconnecting it", self.queue_size)
+        SSE_DROPPED.inc()
+        self.close(subscription)
+
+    async def stream(self, subscription: Subscription) -> AsyncIterator[bytes]:
+        """
+        Yields the encoded events of a client until it disconnects or falls behind, with keepalive comments.
+        """
+        try:
+            yield b"retry: %d\n\n" % SSE_RETRY_MS
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.queue.get(), SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            self.unsubscribe(subscription)
+
+    async def run(self) -> None:
+        """
+        Broadcasts written keys until cancelled.
+        """
+        while True:
+            cache_key = await self._pending.get()
+            self._queued.discard(cache_key)
+            try:
+                await self.broadcast(cache_key)
+            except Exception as e:
+                logger.warning("Could not push the update of '%s': %s", cache_key, e)
+
+    def start(self) -> asyncio.Task:
+        """
+        Starts broadcasting written keys. Called from the app lifespan.
+        """
+        if self._task is None or self._task.done():
+            self._pending = asyncio.Queue(maxsize=PENDING_KEYS_LIMIT)
+            self._queued.clear()
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def stop(self) -> None:
+        """
+        Stops broadcasting and ends every open stream.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self._pending = None
+        for subscription in list(self.subscriptions):
+            self.close(subscription)
+
+
+event_hub = EventHub()
+register_invalidation_handler(event_hub.key_written)
+registry.register(Gauge("sse_connections", "Event stream clients connected to this worker.", lambda: len(event_hub)))
@@ -0,0 +1,164 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import Request, Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard json module is the fallback
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow is optional
+    pa = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Short names of the binary formats, used as ETag suffixes
+FORMAT_NAMES = {
+    MSGPACK_MEDIA_TYPE: "msgpack",
+    ARROW_MEDIA_TYPE: "arrow"
+}
+
+# Low-cardinality string columns sent as Arrow dictionaries
+DICTIONARY_COLUMNS = {"stagione", "period"}
+# Daily date columns sent as Arrow date32
+DATE_COLUMNS = {"date"}
+
+
+def dumps(data: Any) -> bytes:
+    """
+    Serializes data to JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data).encode()
+
+
+def loads(body: bytes) -> Any:
+    """
+    Parses JSON bytes, with orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def available_formats() -> List[str]:
+    """
+    Returns the media types this worker can encode, JSON first.
+    """
+    formats = [JSON_MEDIA_TYPE]
+    if msgpack is not None:
+        formats.append(MSGPACK_MEDIA_TYPE)
+    if pa is not None:
+        formats.append(ARROW_MEDIA_TYPE)
+    return formats
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """
+    Picks the response media type from an Accept header.
+
+    The binary formats are only sent to clients asking for them explicitly;
+    wildcards and anything unknown get JSON.
+
+    :param accept: The Accept request header.
+    :return: The media type of the response.
+    """
+    if not accept:
+        return JSON_MEDIA_TYPE
+    best, best_quality = JSON_MEDIA_TYPE, 0.0
+    formats = available_formats()
+    for part in accept.split(","):
+        media_type, _, params = part.strip().partition(";")
+        media_type = media_type.strip().lower()
+        if media_type not in formats:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > best_quality:
+            best, best_quality = media_type, quality
+    return best
+
+
+def to_columns(data: Dict) -> Tuple[Dict, Dict[str, List]]:
+    """
+    Splits a response dict into its scalar fields and its `results` records, turned into columns.
+
+    :param data: A dict with a `results` list of flat records, like PrecipitationResponse.
+    :return: The fields other than `results`, and one list per record key.
+    """
+    results = data.get("results", [])
+    names = list(results[0]) if results else []
+    columns = {name: [record[name] for record in results] for name in names}
+    fields = {name: value for name, value in data.items() if name != "results"}
+    return fields, columns
+
+
+def encode_msgpack(data: Dict) -> bytes:
+    """
+    Encodes a response dict as MessagePack, with the records as columns so every key is sent once.
+    """
+    fields, columns = to_columns(data)
+    return msgpack.packb({**fields, "columns": columns}, use_bin_type=True)
+
+
+def encode_arrow(data: Dict) -> bytes:
+    """
+    Encodes the records of a response dict as an Arrow IPC stream.
+
+    Dates are sent as date32 and categories as dictionaries; the other fields
+    are kept, JSON-encoded, in the schema metadata.
+    """
+    fields, columns = to_columns(data)
+    arrays = {}
+    for name, values in columns.items():
+        if name in DATE_COLUMNS:
+            array = pa.array([value[:10] for value in values]).cast(pa.date32())
+        else:
+            array = pa.array(values)
+        if name in DICTIONARY_COLUMNS:
+            array = array.dictionary_encode()
+        arrays[name] = array
+    table = pa.table(arrays, metadata={name: dumps(value) for name, value in fields.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode(data: Dict, media_type: str) -> bytes:
+    """
+    Encodes a response dict in the given media type.
+    """
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return encode_msgpack(data)
+    if media_type == ARROW_MEDIA_TYPE:
+        return encode_arrow(data)
+    return dumps(data)
+
+
+def format_response(data: Dict, request: Request) -> Response:
+    """
+    Builds a response encoding a dict in the format the client asked for with its Accept header.
+
+    :param data: A dict with a `results` list of records.
+    :param request: The incoming request.
+    :return: A JSON, MessagePack or Arrow response.
+    """
+    media_type = negotiate(request.headers.get("accept"))
+    return Response(content=encode(data, media_type), media_type=media_type, headers={"Vary": "Accept"})
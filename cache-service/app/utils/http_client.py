@@ -0,0 +1,119 @@
+import json
+import os
+from typing import Dict, Mapping, Optional
+
+import aiohttp
+
+# Base URL of the Opendata Explore API, overridable to point the service at a stub
+OPENDATA_API_URL = os.getenv('OPENDATA_API_URL', 'https://opendata.comune.bologna.it/api/explore/v2.1').rstrip('/')
+
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 20))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 60))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', 300))
+
+# Fallback timeout for requests that do not pass their own
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=5, sock_read=20)
+
+_http_client: Optional[aiohttp.ClientSession] = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    """
+    Builds the upstream HTTP session shared by every service in this worker.
+
+    The connector keeps connections alive between requests and caches DNS
+    lookups, so a cache miss does not pay for a new TCP+TLS handshake.
+
+    :return: A pooled aiohttp session.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        use_dns_cache=True
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT, raise_for_status=False)
+
+
+def get_http_client() -> aiohttp.ClientSession:
+    """
+    Returns the shared upstream HTTP session.
+
+    The session is normally created by the app lifespan; it is created lazily
+    here so scripts and tests that never start the app can still fetch data.
+
+    :return: The shared aiohttp session.
+    """
+    global _http_client
+    if _http_client is None or _http_client.closed:
+        _http_client = _create_session()
+    return _http_client
+
+
+async def init_http_client() -> aiohttp.ClientSession:
+    """
+    Creates the shared upstream HTTP session. Called from the app lifespan.
+
+    :return: The shared aiohttp session.
+    """
+    return get_http_client()
+
+
+async def close_http_client() -> None:
+    """
+    Closes the shared session and every pooled upstream connection.
+    """
+    global _http_client
+    if _http_client is not None and not _http_client.closed:
+        await _http_client.close()
+    _http_client = None
+
+
+class NotModified(Exception):
+    """
+    Raised when the upstream answers a conditional request with 304 Not Modified.
+    """
+
+
+class UpstreamValidators:
+    """
+    The ETag and Last-Modified validators the upstream sent with a cached response.
+
+    They are replayed as If-None-Match / If-Modified-Since on the next refresh,
+    so unchanged data costs a header exchange instead of a full download.
+    """
+
+    __slots__ = ("etag", "last_modified")
+
+    def __init__(self, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def request_headers(self) -> Dict[str, str]:
+        """
+        Returns the conditional request headers for these validators.
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def update(self, response_headers: Mapping[str, str]) -> None:
+        """
+        Takes the validators from an upstream response.
+        """
+        self.etag = response_headers.get("ETag")
+        self.last_modified = response_headers.get("Last-Modified")
+
+    def to_json(self) -> str:
+        return json.dumps({"etag": self.etag, "last_modified": self.last_modified})
+
+    @classmethod
+    def from_json(cls, data: Optional[str]) -> "UpstreamValidators":
+        if not data:
+            return cls()
+        return cls(**json.loads(data))
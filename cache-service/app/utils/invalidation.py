@@ -0,0 +1,107 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, List, Optional
+
+from .memory_cache import memory_cache
+from .redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = os.getenv('CACHE_INVALIDATION_CHANNEL', 'cache:invalidate')
+
+# Identifies this worker so it can ignore its own invalidation messages
+WORKER_ID = uuid.uuid4().hex
+
+_listener_task: Optional[asyncio.Task] = None
+# Called with every key written by any worker, this one included
+_key_handlers: List[Callable[[str], None]] = []
+
+
+def register_invalidation_handler(handler: Callable[[str], None]) -> None:
+    """
+    Lets another component react to keys being written anywhere in the cluster.
+
+    :param handler: Called from the listener with the written key; it must not block.
+    """
+    _key_handlers.append(handler)
+
+
+def invalidation_message(cache_key: str) -> str:
+    """
+    Returns the message announcing that this worker wrote a key.
+    """
+    return json.dumps({"key": cache_key, "origin": WORKER_ID})
+
+
+async def publish_invalidation(cache_key: str) -> None:
+    """
+    Tells every other worker that a key was written, so they drop their in-memory copy.
+
+    :param cache_key: The key that was refreshed.
+    """
+    await get_redis_client().publish(INVALIDATION_CHANNEL, invalidation_message(cache_key))
+
+
+def handle_invalidation(message: str) -> None:
+    """
+    Drops the in-memory copy of the key named in an invalidation message, and passes the key to the registered handlers.
+
+    :param message: The raw pub/sub message data.
+    """
+    data = json.loads(message)
+    if data.get("origin") != WORKER_ID:
+        memory_cache.delete(data["key"])
+    for handler in _key_handlers:
+        handler(data["key"])
+
+
+async def listen_for_invalidations() -> None:
+    """
+    Subscribes to the invalidation channel until cancelled, reconnecting on errors.
+
+    The in-memory cache is cleared on every (re)subscription, since messages
+    published while disconnected are lost.
+    """
+    while True:
+        try:
+            pubsub = get_redis_client().pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            memory_cache.clear()
+            try:
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        handle_invalidation(message["data"])
+            finally:
+                await pubsub.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Invalidation listener error, reconnecting: %s", e)
+            await asyncio.sleep(1)
+
+
+def start_invalidation_listener() -> asyncio.Task:
+    """
+    Starts the background invalidation listener. Called from the app lifespan.
+    """
+    global _listener_task
+    if _listener_task is None or _listener_task.done():
+        _listener_task = asyncio.create_task(listen_for_invalidations())
+    return _listener_task
+
+
+async def stop_invalidation_listener() -> None:
+    """
+    Cancels the background invalidation listener.
+    """
+    global _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        try:
+            await _listener_task
+        except asyncio.CancelledError:
+            pass
+    _listener_task = None
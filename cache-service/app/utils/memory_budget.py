@@ -0,0 +1,179 @@
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional
+
+from .metrics import key_family
+from .redis_client import as_text, get_redis_client
+
+# Redis memory allowed per key family, e.g. "precipitation_data=64MB,dataset_records=32MB"; other families are unbounded
+CACHE_MEMORY_BUDGETS = os.getenv('CACHE_MEMORY_BUDGETS', '')
+# Seconds between two budget checks of the same family in this worker
+CACHE_MEMORY_CHECK_INTERVAL = float(os.getenv('CACHE_MEMORY_CHECK_INTERVAL', 10))
+
+FAMILIES_KEY = "cache:memory:families"
+# Keys that never expire are ordered after every expiring key, oldest first
+PERSISTENT_HORIZON = 10 * 365 * 86400
+# Expired keys dropped from a family's accounting by each write, so it stays bounded by the keys alive
+PRUNE_BATCH = 100
+
+# Drops the accounting of up to ARGV[2] keys of a family whose last known value expired before ARGV[1]
+PRUNE_EXPIRED_SCRIPT = """
+local expired = redis.call('zrangebyscore', KEYS[2], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #expired > 0 then
+    redis.call('hdel', KEYS[1], unpack(expired))
+    redis.call('zrem', KEYS[2], unpack(expired))
+end
+return #expired
+"""
+
+SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2, "G": 1024 ** 3, "GB": 1024 ** 3}
+
+_last_checks: Dict[str, float] = {}
+
+
+def parse_size(value: str) -> int:
+    """
+    Parses a size such as "512", "64KB" or "1.5GB" into bytes.
+    """
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?B?)\s*", value.upper())
+    if match is None:
+        raise ValueError(f"Invalid size '{value}'")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def parse_budgets(value: str) -> Dict[str, int]:
+    """
+    Parses CACHE_MEMORY_BUDGETS into a mapping of key family to bytes.
+    """
+    budgets = {}
+    for item in value.split(","):
+        if item.strip():
+            family, _, size = item.partition("=")
+            budgets[family.strip()] = parse_size(size)
+    return budgets
+
+
+budgets = parse_budgets(CACHE_MEMORY_BUDGETS)
+
+
+def sizes_key(family: str) -> str:
+    """
+    Returns the hash holding the stored bytes of every key of a family.
+    """
+    return f"cache:memory:{family}"
+
+
+def expiry_key(family: str) -> str:
+    """
+    Returns the sorted set of the keys of a family, scored by when their last known value expires.
+    """
+    return f"cache:memory:{family}:expiry"
+
+
+def queue_accounting(pipe, cache_key: str, size: int, hard_ttl: Optional[int]) -> None:
+    """
+    Queues the accounting of a write on the pipeline that performs it.
+
+    The write also drops the accounting of up to PRUNE_BATCH keys of the family
+    that have expired, so families that are never checked against a budget do
+    not grow without bound.
+
+    :param pipe: The Redis pipeline.
+    :param cache_key: The key written.
+    :param size: The bytes stored for it.
+    :param hard_ttl: Seconds until its last known value expires, None if it never does.
+    """
+    family = key_family(cache_key)
+    now = time.time()
+    expires_at = now + (PERSISTENT_HORIZON if hard_ttl is None else hard_ttl)
+    pipe.sadd(FAMILIES_KEY, family)
+    pipe.eval(PRUNE_EXPIRED_SCRIPT, 2, sizes_key(family), expiry_key(family), now, PRUNE_BATCH)
+    pipe.hset(sizes_key(family), cache_key, size)
+    pipe.zadd(expiry_key(family), {cache_key: expires_at})
+
+
+async def prune_expired(family: str) -> None:
+    """
+    Drops the accounting of keys whose last known value has expired.
+    """
+    redis_client = get_redis_client()
+    expired = await redis_client.zrangebyscore(expiry_key(family), "-inf", time.time())
+    if expired:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hdel(sizes_key(family), *expired)
+            pipe.zrem(expiry_key(family), *expired)
+            await pipe.execute()
+
+
+async def family_usage(family: str) -> Dict[str, int]:
+    """
+    Returns the bytes and number of keys a family currently holds in Redis.
+    """
+    await prune_expired(family)
+    sizes = await get_redis_client().hgetall(sizes_key(family))
+    return {"bytes": sum(int(size) for size in sizes.values()), "keys": len(sizes)}
+
+
+async def memory_usage() -> Dict[str, dict]:
+    """
+    Returns the Redis usage of every key family, with its budget if one is configured.
+    """
+    families = sorted(as_text(family) for family in await get_redis_client().smembers(FAMILIES_KEY))
+    usage = {}
+    for family in families:
+        usage[family] = await family_usage(family)
+        if family in budgets:
+            usage[family]["budget"] = budgets[family]
+    return usage
+
+
+def families_due_for_check(cache_keys: Iterable[str]) -> List[str]:
+    """
+    Returns the budgeted families of the given keys not checked by this worker for CACHE_MEMORY_CHECK_INTERVAL.
+    """
+    now = time.monotonic()
+    due = []
+    for family in dict.fromkeys(map(key_family, cache_keys)):
+        if family in budgets and now - _last_checks.get(family, float("-inf")) >= CACHE_MEMORY_CHECK_INTERVAL:
+            _last_checks[family] = now
+            due.append(family)
+    return due
+
+
+async def select_evictions(family: str, keep: Iterable[str] = ()) -> List[str]:
+    """
+    Picks the keys to evict to bring a family back under its budget, and drops their accounting.
+
+    Keys whose last known value expires soonest are evicted first, like Redis'
+    volatile-ttl policy; keys that never expire go last.
+
+    :param family: The key family.
+    :param keep: Keys never to evict, e.g. the ones just written.
+    :return: The keys to delete.
+    """
+    budget = budgets.get(family)
+    if budget is None:
+        return []
+    redis_client = get_redis_client()
+    await prune_expired(family)
+    sizes = {as_text(key): int(size) for key, size in (await redis_client.hgetall(sizes_key(family))).items()}
+    overflow = sum(sizes.values()) - budget
+    if overflow <= 0:
+        return []
+
+    keep = set(keep)
+    victims = []
+    for cache_key in map(as_text, await redis_client.zrange(expiry_key(family), 0, -1)):
+        if overflow <= 0:
+            break
+        if cache_key in keep:
+            continue
+        victims.append(cache_key)
+        overflow -= sizes.get(cache_key, 0)
+    if victims:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hdel(sizes_key(family), *victims)
+            pipe.zrem(expiry_key(family), *victims)
+            await pipe.execute()
+    return victims
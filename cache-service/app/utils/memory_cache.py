@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+MEMORY_CACHE_MAX_BYTES = int(os.getenv('MEMORY_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+MEMORY_CACHE_MAX_ENTRIES = int(os.getenv('MEMORY_CACHE_MAX_ENTRIES', 10000))
+
+
+class TierStats:
+    """
+    Hit and miss counters for one cache tier.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class MemoryCache:
+    """
+    In-process LRU cache with per-key expiry and a memory budget.
+
+    Entries are evicted least recently used first once either the entry count
+    or the accounted size goes over its limit. Expired entries are dropped
+    lazily when they are read or reach the LRU end.
+    """
+
+    def __init__(self, max_bytes: int = MEMORY_CACHE_MAX_BYTES, max_entries: int = MEMORY_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.current_bytes = 0
+        self.stats = TierStats()
+        # key -> (expires_at, size, value)
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def sizeof(value: Any) -> int:
+        """
+        Returns the number of bytes accounted for a cached value.
+        """
+        return sys.getsizeof(value)
+
+    def __contains__(self, key: str) -> bool:
+        return self.peek(key) is not None
+
+    def peek(self, key: str) -> Optional[Any]:
+        """
+        Returns the cached value for the key like get, without counting a hit or miss nor refreshing its LRU position.
+
+        For background work (warming, event streams) that must not skew the tier statistics or keep cold keys alive.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[2]
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the cached value for the key, or None if it is missing or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            self.delete(key)
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        size = self.sizeof(value)
+        if size != entry[1]:
+            # Values may grow once stored, e.g. payloads keep the variants encoded on first request
+            self._entries[key] = (expires_at, size, value)
+            self.current_bytes += size - entry[1]
+            self._evict()
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """
+        Stores a value for ttl seconds, evicting older entries to stay within budget.
+        """
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            # Never let a single oversized value flush the whole cache
+            return
+        self.delete(key)
+        self._entries[key] = (time.monotonic() + ttl, size, value)
+        self.current_bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        """
+        Evicts least recently used entries until the cache is within budget.
+        """
+        while self.current_bytes > self.max_bytes or len(self._entries) > self.max_entries:
+            _, (_, evicted_size, _) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_size
+
+    def delete(self, key: str) -> None:
+        """
+        Removes a key if present.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def clear(self) -> None:
+        """
+        Removes every entry.
+        """
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def usage(self) -> Dict[str, Any]:
+        """
+        Returns the current memory accounting of the cache.
+        """
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries
+        }
+
+
+memory_cache = MemoryCache()
@@ -0,0 +1,199 @@
+import bisect
+import re
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Latency buckets in seconds, from in-process hits to slow upstream pages
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A named family of samples, one per combination of label values.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing count.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        if not self.labels and not self.values:
+            return [f"{self.name} 0"]
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value read from a callback when the metrics are scraped.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def render(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.function())}"]
+
+
+class Histogram(Metric):
+    """
+    Observations counted into cumulative latency buckets.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # Per label values: bucket counts (the last one is +Inf), sum
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts, total = self.values.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        """
+        Observes the duration of the enclosed block.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics exposed by this worker.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CACHE_REQUESTS = registry.register(Counter(
+    "cache_requests_total", "Cache lookups by key family, tier and result.", ("family", "tier", "result")
+))
+UPSTREAM_LATENCY = registry.register(Histogram(
+    "upstream_request_duration_seconds", "Opendata API request latency by endpoint and status.", ("endpoint", "status")
+))
+REDIS_LATENCY = registry.register(Histogram(
+    "redis_command_duration_seconds", "Redis round trip latency by command.", ("command",)
+))
+HTTP_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "Latency of the service's own endpoints.", ("method", "route", "status")
+))
+COALESCED_REQUESTS = registry.register(Counter(
+    "single_flight_coalesced_total", "Cache misses that joined a fetch already in flight in this worker."
+))
+
+
+def key_family(cache_key: str) -> str:
+    """
+    Returns the family of a cache key, its name without dates, versions or digests.
+
+    :param cache_key: The cache key, e.g. precipitation_data_2023-01-02 00:00:00_2023-01-08 00:00:00.
+    :return: The key family, e.g. precipitation_data.
+    """
+    if cache_key.startswith("dataset:"):
+        parts = cache_key.split(":")
+        return "dataset_" + parts[2] if len(parts) > 2 else "dataset"
+    return re.sub(r"_\d.*$", "", cache_key)
+
+
+def record_cache_result(tier: str, cache_key: str, hit: bool) -> None:
+    """
+    Counts one lookup of a key in a cache tier.
+    """
+    CACHE_REQUESTS.inc(key_family(cache_key), tier, "hit" if hit else "miss")
+
+
+@contextmanager
+def upstream_timer(endpoint: str) -> Iterator[Dict[str, Optional[int]]]:
+    """
+    Observes the latency of one upstream request; the caller sets the response status in the yielded dict.
+    """
+    outcome: Dict[str, Optional[int]] = {"status": None}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    finally:
+        status = outcome["status"]
+        UPSTREAM_LATENCY.observe(time.perf_counter() - start, endpoint, str(status) if status is not None else "error")
@@ -0,0 +1,196 @@
+import gzip
+import hashlib
+import os
+from typing import Dict, Optional, Union
+
+from fastapi import Request, Response
+
+from .codec import decode
+from .formats import JSON_MEDIA_TYPE, FORMAT_NAMES, encode, loads, negotiate
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Content encodings offered for large bodies, preferred first
+AVAILABLE_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Marks a response served from the last known value past its expiry
+STALE_WARNING = '110 - "Response is Stale"'
+
+
+class CachedPayload:
+    """
+    An already-validated JSON body, with its compressed variants.
+
+    Cache hits are served from these bytes as-is, so no model is built,
+    validated or serialized again on the hot path. The strong ETag is computed
+    when the payload is built; each compressed variant and binary representation
+    (MessagePack, Arrow) is encoded on its first request and kept alongside, so
+    payloads only read once, e.g. for a batch or a range, are never compressed.
+
+    A stale payload is a last known value served past its expiry, because it
+    is being revalidated or because the upstream is unavailable.
+    """
+
+    __slots__ = ("body", "encodings", "etag", "representations", "stale")
+
+    def __init__(self, body: bytes, stale: bool = False):
+        self.body = body
+        self.stale = stale
+        # Strong validator: changes whenever a single byte of the body changes
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.encodings: Dict[str, bytes] = {}
+        self.representations: Dict[str, bytes] = {}
+
+    @classmethod
+    def from_json(cls, data: Union[str, bytes], stale: bool = False) -> "CachedPayload":
+        """
+        Builds a payload from a value stored in Redis, decoding the storage codec.
+        """
+        return cls(decode(data), stale)
+
+    def __sizeof__(self) -> int:
+        return (
+            len(self.body)
+            + sum(len(variant) for variant in self.encodings.values())
+            + sum(len(variant) for variant in self.representations.values())
+        )
+
+    def compressed(self, encoding: str) -> bytes:
+        """
+        Returns the body compressed with the given content encoding, compressing and keeping it on first use.
+
+        :param encoding: "br" or "gzip", as returned by select_encoding.
+        """
+        variant = self.encodings.get(encoding)
+        if variant is None:
+            if encoding == "br":
+                variant = brotli.compress(self.body, quality=BROTLI_QUALITY)
+            else:
+                variant = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+            self.encodings[encoding] = variant
+        return variant
+
+    def render(self, media_type: str) -> bytes:
+        """
+        Returns the body encoded in the given media type, encoding and keeping it on first use.
+        """
+        if media_type == JSON_MEDIA_TYPE:
+            return self.body
+        representation = self.representations.get(media_type)
+        if representation is None:
+            representation = encode(loads(self.body), media_type)
+            self.representations[media_type] = representation
+        return representation
+
+    def etag_for(self, encoding: Optional[str]) -> str:
+        """
+        Returns the ETag of the given representation, distinct per content encoding and format.
+        """
+        if encoding is None:
+            return self.etag
+        return self.etag[:-1] + "-" + encoding + '"'
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """
+        Returns whether an If-None-Match header names any representation of this body.
+
+        :param if_none_match: The If-None-Match request header.
+        :return: True if the client already has this body.
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        base = self.etag[1:-1]
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            tag = tag.strip('"')
+            if tag == base or tag.startswith(base + "-"):
+                return True
+        return False
+
+    def select_encoding(self, accept_encoding: Optional[str]) -> Optional[str]:
+        """
+        Picks the best encoding the client accepts, or None for the identity body.
+
+        :param accept_encoding: The Accept-Encoding request header.
+        :return: "br", "gzip" or None.
+        """
+        if not accept_encoding or len(self.body) < COMPRESS_MIN_BYTES:
+            return None
+        accepted = {}
+        for part in accept_encoding.split(","):
+            coding, _, params = part.strip().partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[coding.strip().lower()] = quality
+        for coding in AVAILABLE_ENCODINGS:
+            if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+                return coding
+        return None
+
+
+def payload_response(
+    payload: CachedPayload,
+    request: Request,
+    cache_control: Optional[str] = None,
+    media_type: str = "application/json",
+    negotiate_format: bool = False
+) -> Response:
+    """
+    Builds a response sending the stored bytes as the body, compressed if the client allows it.
+
+    A request whose If-None-Match names the payload's ETag gets an empty 304.
+    A stale payload is sent with a `Warning: 110` header and `Cache-Control: no-cache`,
+    so clients revalidate it on their next request instead of keeping it.
+
+    :param payload: The cached payload.
+    :param request: The incoming request, for its Accept-Encoding and If-None-Match headers.
+    :param cache_control: The Cache-Control policy of the endpoint.
+    :param media_type: The content type of the body.
+    :param negotiate_format: Whether to honor an Accept header asking for MessagePack or Arrow.
+    :return: A response whose body is the stored bytes, or a 304.
+    """
+    if payload.stale:
+        cache_control = "no-cache"
+
+    if negotiate_format:
+        requested = negotiate(request.headers.get("accept"))
+        if requested != JSON_MEDIA_TYPE:
+            # Binary formats are compact already, they are sent uncompressed
+            headers = {"Vary": "Accept, Accept-Encoding", "ETag": payload.etag_for(FORMAT_NAMES[requested])}
+            if cache_control:
+                headers["Cache-Control"] = cache_control
+            if payload.stale:
+                headers["Warning"] = STALE_WARNING
+            if payload.matches(request.headers.get("if-none-match")):
+                return Response(status_code=304, headers=headers)
+            return Response(content=payload.render(requested), media_type=requested, headers=headers)
+
+    encoding = payload.select_encoding(request.headers.get("accept-encoding"))
+    headers = {"Vary": "Accept, Accept-Encoding" if negotiate_format else "Accept-Encoding", "ETag": payload.etag_for(encoding)}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    if payload.stale:
+        headers["Warning"] = STALE_WARNING
+
+    if payload.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        return Response(content=payload.body, media_type=media_type, headers=headers)
+    headers["Content-Encoding"] = encoding
+    return Response(content=payload.compressed(encoding), media_type=media_type, headers=headers)
@@ -1,12 +1,134 @@
-import redis
 import os
+import random
+from typing import Dict, Iterable, List, Optional, Union
+
+import redis.asyncio as redis
 from dotenv import load_dotenv
 
 load_dotenv()  # Load environment variables from .env file
 
-redis_client = redis.StrictRedis(
-    host=os.getenv('REDIS_HOST', 'localhost'),
-    port=os.getenv('REDIS_PORT', 6379),
-    db=0,
-    decode_responses=True
-)
+REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+REDIS_DB = int(os.getenv('REDIS_DB', 0))
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 64))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', 2.0))
+# Seconds a command waits for a free pooled connection once all REDIS_MAX_CONNECTIONS are busy
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', 5.0))
+# Expiries are randomly stretched or shortened by up to this fraction, so keys written together do not expire together
+CACHE_TTL_JITTER = float(os.getenv('CACHE_TTL_JITTER', 0.1))
+
+_redis_pool: Optional[redis.ConnectionPool] = None
+_redis_client: Optional[redis.Redis] = None
+
+
+def _create_pool(**connection_kwargs) -> redis.ConnectionPool:
+    """
+    Builds the connection pool shared by every coroutine in this worker.
+
+    Once all REDIS_MAX_CONNECTIONS connections are busy, further commands wait
+    up to REDIS_POOL_TIMEOUT seconds for one to be released instead of failing
+    with "Too many connections", so bursts of lookups queue up. Responses are
+    not decoded, so compressed values come back as bytes.
+
+    :param connection_kwargs: Extra connection options, e.g. another connection class in tests.
+    :return: A Redis connection pool, shared by the asyncio client.
+    """
+    return redis.BlockingConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        db=REDIS_DB,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        decode_responses=False,
+        **connection_kwargs
+    )
+
+
+def get_redis_client() -> redis.Redis:
+    """
+    Returns the shared asyncio Redis client.
+
+    The pool is normally created by the app lifespan; it is created lazily here
+    so scripts and tests that never start the app can still use the cache.
+
+    :return: The shared asyncio Redis client.
+    """
+    global _redis_pool, _redis_client
+    if _redis_client is None:
+        _redis_pool = _create_pool()
+        _redis_client = redis.Redis(connection_pool=_redis_pool)
+    return _redis_client
+
+
+async def init_redis_client() -> redis.Redis:
+    """
+    Creates the shared connection pool and client. Called from the app lifespan.
+
+    :return: The shared asyncio Redis client.
+    """
+    return get_redis_client()
+
+
+async def close_redis_client() -> None:
+    """
+    Closes the shared client and disconnects every pooled connection.
+    """
+    global _redis_pool, _redis_client
+    if _redis_client is not None:
+        await _redis_client.close()
+    if _redis_pool is not None:
+        await _redis_pool.disconnect()
+    _redis_pool = None
+    _redis_client = None
+
+
+def as_text(value: Union[str, bytes, None]) -> Optional[str]:
+    """
+    Returns a value read from Redis as a string, e.g. a stored version or a key name.
+    """
+    if isinstance(value, bytes):
+        return value.decode()
+    return value
+
+
+def jittered_ttl(ttl: int, jitter: Optional[float] = None) -> int:
+    """
+    Returns the expiry randomly moved by up to jitter * ttl in either direction, at least 1 second.
+
+    :param ttl: The expiry in seconds.
+    :param jitter: The largest relative change, defaults to CACHE_TTL_JITTER.
+    """
+    jitter = CACHE_TTL_JITTER if jitter is None else jitter
+    if jitter <= 0:
+        return ttl
+    return max(1, round(ttl * random.uniform(1 - jitter, 1 + jitter)))
+
+
+async def mget(keys: Iterable[str]) -> List[Optional[bytes]]:
+    """
+    Reads several keys in a single round trip.
+
+    :param keys: The keys to read.
+    :return: The values in the same order as the keys, None for missing keys.
+    """
+    keys = list(keys)
+    if not keys:
+        return []
+    return await get_redis_client().mget(keys)
+
+
+async def setex_many(items: Dict[str, Union[str, bytes]], ttl: int) -> None:
+    """
+    Writes several keys with the same expiry, jittered per key, in a single pipelined round trip.
+
+    :param items: A mapping of key to value.
+    :param ttl: The expiry in seconds applied to every key.
+    """
+    if not items:
+        return
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for key, value in items.items():
+            pipe.set(key, value, ex=jittered_ttl(ttl))
+        await pipe.execute()
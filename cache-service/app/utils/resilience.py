@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Mapping, Optional
+
+import aiohttp
+
+from .http_client import get_http_client
+from .metrics import Counter, Gauge, registry, upstream_timer
+
+logger = logging.getLogger(__name__)
+
+# Extra attempts after a failed upstream request, 0 disables retries
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', 2))
+# Retries wait a random time up to base * 2^attempt seconds, capped
+UPSTREAM_RETRY_BACKOFF = float(os.getenv('UPSTREAM_RETRY_BACKOFF', 0.2))
+UPSTREAM_RETRY_BACKOFF_MAX = float(os.getenv('UPSTREAM_RETRY_BACKOFF_MAX', 2.0))
+# Timeouts adapt to this percentile of recent latencies times the multiplier,
+# never below the minimum nor above the endpoint's configured timeout
+UPSTREAM_TIMEOUT_PERCENTILE = float(os.getenv('UPSTREAM_TIMEOUT_PERCENTILE', 99))
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.getenv('UPSTREAM_TIMEOUT_MULTIPLIER', 3))
+UPSTREAM_MIN_TIMEOUT = float(os.getenv('UPSTREAM_MIN_TIMEOUT', 1.0))
+# Send a second, hedged request once the first is slower than this percentile of recent latencies, 0 disables hedging
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv('UPSTREAM_HEDGE_PERCENTILE', 0))
+# Consecutive failed calls that open the circuit, and how long it stays open before a probe
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv('UPSTREAM_BREAKER_THRESHOLD', 5))
+UPSTREAM_BREAKER_RESET = float(os.getenv('UPSTREAM_BREAKER_RESET', 30))
+
+# Latencies kept per endpoint, and how many are needed before adapting
+LATENCY_WINDOW = 200
+LATENCY_MIN_SAMPLES = 20
+
+# Statuses worth another attempt; other errors would fail the same way again
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """
+    Raised when the Opendata API could not answer a request, after retries.
+
+    :param message: What failed.
+    :param status: The last HTTP status received, None for timeouts and connection errors.
+    """
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message, status)
+        self.message = message
+        self.status = status
+
+    def __str__(self) -> str:
+        return self.message if self.status is None else f"{self.message} ({self.status})"
+
+
+class CircuitOpen(UpstreamError):
+    """
+    Raised instead of calling the Opendata API while the circuit breaker is open.
+
+    :param retry_after: Seconds until the breaker lets a probe request through.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__("The Opendata API is unavailable, not calling it")
+        self.retry_after = retry_after
+
+
+class LatencyTracker:
+    """
+    The latencies of the last successful requests to one upstream endpoint.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples: Deque[float] = deque(maxlen=window)
+
+    def observe(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        Returns the given percentile in seconds, or None until enough requests were observed.
+        """
+        if len(self.samples) < LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def timeout(self, configured: aiohttp.ClientTimeout) -> aiohttp.ClientTimeout:
+        """
+        Returns the configured timeout, shortened to a multiple of the recent latency percentile.
+
+        :param configured: The endpoint's timeout, used as is until enough requests were observed.
+        """
+        observed = self.percentile(UPSTREAM_TIMEOUT_PERCENTILE)
+        if observed is None or configured.total is None:
+            return configured
+        total = min(configured.total, max(UPSTREAM_MIN_TIMEOUT, observed * UPSTREAM_TIMEOUT_MULTIPLIER))
+        sock_read = min(configured.sock_read, total) if configured.sock_read else None
+        return aiohttp.ClientTimeout(total=total, connect=configured.connect, sock_read=sock_read)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Returns how long to wait before hedging a request, or None if hedging is disabled or not yet calibrated.
+        """
+        if UPSTREAM_HEDGE_PERCENTILE <= 0:
+            return None
+        return self.percentile(UPSTREAM_HEDGE_PERCENTILE)
+
+
+class CircuitBreaker:
+    """
+    Stops calling the upstream after consecutive failures.
+
+    After `threshold` failed calls in a row the circuit opens and calls fail
+    immediately with CircuitOpen. Once `reset_timeout` seconds have passed a
+    single probe call is let through: its success closes the circuit, its
+    failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int = UPSTREAM_BREAKER_THRESHOLD, reset_timeout: float = UPSTREAM_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def retry_after(self) -> float:
+        """
+        Returns the seconds until the next probe is allowed, 0 if calls are allowed.
+
+        While a probe is in flight its outcome is not known yet; should it fail the
+        circuit opens for another reset_timeout, so that is the wait reported.
+        """
+        if self.state == self.HALF_OPEN:
+            return self.reset_timeout
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """
+        Returns whether a call may go to the upstream, letting one probe through once the circuit has been open long enough.
+        """
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self.retry_after() == 0:
+            self.state = self.HALF_OPEN
+            return True
+        # Open, or a probe is already in flight
+        return False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Opendata API recovered, closing the circuit")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def release_probe(self) -> None:
+        """
+        Lets another probe through at once, when the current one was cancelled before it got an answer.
+        """
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+            logger.warning("Opendata API failing, opening the circuit for %.0f seconds", self.reset_timeout)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class UpstreamResponse:
+    """
+    The status, headers and parsed JSON body (for 200 responses) of an upstream request.
+    """
+
+    __slots__ = ("status", "headers", "data")
+
+    def __init__(self, status: int, headers: Mapping[str, str], data: Any = None):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+
+# Every endpoint is on the same host, so one breaker covers them all
+upstream_breaker = CircuitBreaker()
+_latency_trackers: Dict[str, LatencyTracker] = {}
+
+HEDGED_REQUESTS = registry.register(Counter(
+    "upstream_hedged_requests_total", "Hedged second requests sent to slow upstream endpoints.", ("endpoint",)
+))
+UPSTREAM_RETRIES_TOTAL = registry.register(Counter(
+    "upstream_retries_total", "Upstream requests retried after a failure.", ("endpoint",)
+))
+registry.register(Gauge(
+    "upstream_circuit_open", "1 while the circuit breaker stops calls to the Opendata API.",
+    lambda: int(upstream_breaker.state == CircuitBreaker.OPEN)
+))
+
+
+def latency_tracker(endpoint: str) -> LatencyTracker:
+    tracker = _latency_trackers.get(endpoint)
+    if tracker is None:
+        tracker = _latency_trackers[endpoint] = LatencyTracker()
+    return tracker
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Returns a random wait before the given retry (0 for the first), with full jitter so retries from many workers spread out.
+    """
+    return random.uniform(0, min(UPSTREAM_RETRY_BACKOFF_MAX, UPSTREAM_RETRY_BACKOFF * 2 ** attempt))
+
+
+async def hedge(attempt: Callable[[], Awaitable[Any]], delay: Optional[float], endpoint: str) -> Any:
+    """
+    Runs the attempt, and a second copy of it if the first has not finished after delay seconds.
+
+    :return: The result of whichever copy succeeds first; the other one is cancelled.
+    :raises Exception: The error of the first copy, if both fail.
+    """
+    first = asyncio.ensure_future(attempt())
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            HEDGED_REQUESTS.inc(endpoint)
+            pending.add(asyncio.ensure_future(attempt()))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+        return first.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def fetch_upstream(
+    endpoint: str,
+    url: str,
+    params: Optional[Mapping[str, Any]] = None,
+    headers: Optional[Mapping[str, str]] = None,
+    timeout: Optional[aiohttp.ClientTimeout] = None
+) -> UpstreamResponse:
+    """
+    GETs a JSON document from the Opendata API, protected against a slow or failing upstream.
+
+    The timeout adapts to the endpoint's recent latencies, a slow request may be
+    hedged with a second one, failures are retried with jittered backoff, and
+    while the circuit breaker is open no request is made at all.
+
+    Responses other than 5xx/429 are returned to the caller, which decides what
+    a 304 or a 404 means.
+
+    :param endpoint: The endpoint name, for latency tracking and metrics.
+    :param url: The URL to GET.
+    :param params: The query parameters.
+    :param headers: The request headers.
+    :param timeout: The endpoint's timeout, an upper bound for the adaptive one.
+    :return: The response, with the parsed JSON body if the status is 200.
+    :raises CircuitOpen: If the breaker is open.
+    :raises UpstreamError: If every attempt failed.
+    """
+    if not upstream_breaker.allow():
+        raise CircuitOpen(upstream_breaker.retry_after())
+
+    tracker = latency_tracker(endpoint)
+    session = get_http_client()
+    attempt_timeout = tracker.timeout(timeout or session.timeout)
+
+    async def attempt() -> UpstreamResponse:
+        start = time.perf_counter()
+        with upstream_timer(endpoint) as upstream:
+            async with session.get(url, params=params, headers=headers, timeout=attempt_timeout) as response:
+                upstream["status"] = response.status
+                if response.status in RETRYABLE_STATUSES:
+                    raise UpstreamError(f"The {endpoint} request failed", response.status)
+                data = await response.json() if response.status == 200 else None
+        tracker.observe(time.perf_counter() - start)
+        return UpstreamResponse(response.status, response.headers, data)
+
+    error = None
+    try:
+        for retry in range(UPSTREAM_RETRIES + 1):
+            if retry:
+                UPSTREAM_RETRIES_TOTAL.inc(endpoint)
+                await asyncio.sleep(backoff_delay(retry - 1))
+            try:
+                response = await hedge(attempt, tracker.hedge_delay(), endpoint)
+            except UpstreamError as e:
+                error = e
+            except Exception as e:
+                # Timeouts and connection errors, but also e.g. a body that is not JSON:
+                # every failed attempt counts, or a failed probe would leave the circuit half open
+                error = UpstreamError(f"The {endpoint} request failed: {e!r}")
+            else:
+                upstream_breaker.record_success()
+                return response
+            logger.info("Attempt %d of the %s request failed: %s", retry + 1, endpoint, error)
+    except asyncio.CancelledError:
+        upstream_breaker.release_probe()
+        raise
+
+    upstream_breaker.record_failure()
+    raise error
@@ -0,0 +1,121 @@
+import asyncio
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .metrics import COALESCED_REQUESTS
+from .redis_client import get_redis_client
+
+# Compare-and-delete, so a worker never releases a lease that expired and was taken by another
+RELEASE_LEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key inside one process.
+
+    The first caller starts the work as a task; every caller that arrives while
+    it is running awaits the same task instead of starting its own. The task is
+    shielded, so a cancelled caller (e.g. a client disconnect) does not cancel
+    the work the other callers are waiting for.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+
+    def in_flight(self, key: str) -> bool:
+        """
+        Returns whether a call for the key is currently running.
+        """
+        return key in self._calls
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def start(self, key: str, function: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Starts the function for the key as a task, or returns the task already running for it.
+
+        The task is registered before this returns, so callers can register
+        several keys without another coroutine starting its own call in between.
+
+        :param key: The key identifying the work.
+        :param function: The coroutine function doing the work.
+        :return: The task of the single shared call.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(function())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            COALESCED_REQUESTS.inc()
+        return task
+
+    async def do(self, key: str, function: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs the function for the key, or joins the call already running for it.
+
+        :param key: The key identifying the work.
+        :param function: The coroutine function doing the work.
+        :return: The result of the single shared call.
+        """
+        return await asyncio.shield(self.start(key, function))
+
+
+async def acquire_lease(key: str, ttl_ms: int) -> Optional[str]:
+    """
+    Tries to take the cross-worker refresh lease for a cache key.
+
+    :param key: The cache key to refresh.
+    :param ttl_ms: How long the lease is held before it expires on its own.
+    :return: The lease token if acquired, None if another worker holds it.
+    """
+    token = uuid.uuid4().hex
+    acquired = await get_redis_client().set(f"lease:{key}", token, nx=True, px=ttl_ms)
+    return token if acquired else None
+
+
+async def release_lease(key: str, token: str) -> None:
+    """
+    Releases a lease previously returned by acquire_lease.
+
+    :param key: The cache key the lease was taken for.
+    :param token: The token returned by acquire_lease.
+    """
+    await get_redis_client().eval(RELEASE_LEASE_SCRIPT, 1, f"lease:{key}", token)
+
+
+async def acquire_leases(keys: List[str], ttl_ms: int) -> Dict[str, Optional[str]]:
+    """
+    Tries to take the refresh leases of many cache keys in one pipelined round trip.
+
+    :param keys: The cache keys to refresh.
+    :param ttl_ms: How long each lease is held before it expires on its own.
+    :return: The lease token of each key, None for keys another worker holds.
+    """
+    tokens = {key: uuid.uuid4().hex for key in keys}
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for key, token in tokens.items():
+            pipe.set(f"lease:{key}", token, nx=True, px=ttl_ms)
+        acquired = await pipe.execute()
+    return {key: token if ok else None for (key, token), ok in zip(tokens.items(), acquired)}
+
+
+async def release_leases(tokens: Dict[str, Optional[str]]) -> None:
+    """
+    Releases the leases returned by acquire_leases in one pipelined round trip.
+
+    :param tokens: The tokens returned by acquire_leases; keys without one are skipped.
+    """
+    held = {key: token for key, token in tokens.items() if token is not None}
+    if not held:
+        return
+    async with get_redis_client().pipeline(transaction=False) as pipe:
+        for key, token in held.items():
+            pipe.eval(RELEASE_LEASE_SCRIPT, 1, f"lease:{key}", token)
+        await pipe.execute()
@@ -0,0 +1,40 @@
+import json
+import pytest
+from . import codec
+from .codec import CODEC_RAW, CODEC_ZLIB, CODEC_ZSTD, CodecError, decode, encode
+from .redis_client import jittered_ttl
+
+
+def test_large_values_are_compressed_and_round_trip():
+    """
+    Test that values above the threshold are stored compressed behind the header and decode to the same JSON.
+    """
+    body = json.dumps({"results": [{"date": f"2023-01-{day:02d}", "avg_184_d": 0.0, "stagione": "Inverno"} for day in range(1, 32)]}).encode()
+    for compression in (CODEC_ZLIB, CODEC_ZSTD) if codec.zstandard is not None else (CODEC_ZLIB,):
+        stored = encode(body, compression)
+        assert stored[:3] == bytes((0, codec.FORMAT_VERSION, compression))
+        assert len(stored) < len(body) / 3
+        assert decode(stored) == body
+
+
+def test_small_and_legacy_values():
+    """
+    Test that small values are stored uncompressed and that plain JSON written before the codec still decodes.
+    """
+    stored = encode('"small"')
+    assert stored == b'\x00' + bytes((codec.FORMAT_VERSION, CODEC_RAW)) + b'"small"'
+    assert decode(stored) == b'"small"'
+    assert decode('{"legacy": true}') == b'{"legacy": true}'
+    assert decode(b'{"legacy": true}') == b'{"legacy": true}'
+    with pytest.raises(CodecError):
+        decode(b'\x00\x09\x00{}')
+
+
+def test_ttl_jitter_stays_within_bounds():
+    """
+    Test that jittered expiries spread around the TTL without leaving the jitter range.
+    """
+    ttls = {jittered_ttl(3600, 0.1) for _ in range(200)}
+    assert len(ttls) > 1
+    assert all(3240 <= ttl <= 3960 for ttl in ttls)
+    assert jittered_ttl(3600, 0) == 3600
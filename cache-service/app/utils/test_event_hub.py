@@ -0,0 +1,108 @@
+import asyncio
+import json
+import pytest
+from .codec import encode
+from .event_hub import EventHub, TooManySubscribers
+from . import invalidation
+from .memory_cache import memory_cache
+from .payload import CachedPayload
+
+
+def parse_event(event: bytes) -> dict:
+    """
+    Returns the fields of one encoded Server-Sent Event.
+    """
+    fields = dict(line.split(b": ", 1) for line in event.strip().split(b"\n"))
+    return {"event": fields[b"event"].decode(), "id": fields[b"id"].decode(), "data": json.loads(fields[b"data"])}
+
+
+@pytest.mark.asyncio
+async def test_refresh_fans_out_once_to_every_follower(fake_redis):
+    """
+    Test that a written key is read once and pushed to every client following it, and not again while unchanged.
+    """
+    hub = EventHub()
+    first = hub.subscribe({"week_key": "precipitation:2023-01-02"})
+    second = hub.subscribe({"week_key": "precipitation:2023-01-02", "dataset_key": "dataset"})
+    fake_redis.data["week_key"] = encode(b'{"total_count":0,"results":[]}')
+    gets = []
+    original_get = fake_redis.get
+
+    async def counting_get(key):
+        gets.append(key)
+        return await original_get(key)
+
+    fake_redis.get = counting_get
+
+    assert await hub.broadcast("week_key") == 2
+    assert await hub.broadcast("week_key") == 0
+    assert await hub.broadcast("unfollowed_key") == 0
+
+    assert gets == ["week_key", "week_key"]
+    event = parse_event(first.queue.get_nowait())
+    assert event["event"] == "update"
+    assert event["data"] == {"topic": "precipitation:2023-01-02", "data": {"total_count": 0, "results": []}}
+    assert second.queue.get_nowait() is not None
+    assert first.queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_broadcast_reads_memory_tier_without_counting_it(fake_redis):
+    """
+    Test that pushing a value held in the in-process tier neither counts a lookup nor refreshes its LRU position.
+    """
+    hub = EventHub()
+    follower = hub.subscribe({"week_key": "precipitation:2023-01-02"})
+    memory_cache.set("week_key", CachedPayload(b'{"total_count":0,"results":[]}'), ttl=60)
+    memory_cache.set("newer_key", CachedPayload(b"{}"), ttl=60)
+    hits, misses = memory_cache.stats.hits, memory_cache.stats.misses
+
+    assert await hub.broadcast("week_key") == 1
+
+    assert (memory_cache.stats.hits, memory_cache.stats.misses) == (hits, misses)
+    assert next(iter(memory_cache._entries)) == "week_key"
+    assert parse_event(follower.queue.get_nowait())["data"]["data"] == {"total_count": 0, "results": []}
+
+
+@pytest.mark.asyncio
+async def test_invalidation_messages_are_broadcast_by_the_hub_task(fake_redis, monkeypatch):
+    """
+    Test that a pub/sub write notification reaches the stream of a client following the key.
+    """
+    hub = EventHub()
+    monkeypatch.setattr(invalidation, "_key_handlers", [hub.key_written])
+    hub.start()
+    try:
+        subscription = hub.subscribe({"dataset_key": "dataset"})
+        stream = hub.stream(subscription)
+        assert await stream.__anext__() == b"retry: 3000\n\n"
+        fake_redis.data["dataset_key"] = b'{"modified":"2024-01-02"}'
+
+        invalidation.handle_invalidation(invalidation.invalidation_message("dataset_key"))
+        event = parse_event(await asyncio.wait_for(stream.__anext__(), 1))
+
+        assert event["data"] == {"topic": "dataset", "data": {"modified": "2024-01-02"}}
+        await stream.aclose()
+        assert len(hub) == 0
+    finally:
+        await hub.stop()
+
+
+@pytest.mark.asyncio
+async def test_connection_cap_and_slow_clients_are_dropped(fake_redis):
+    """
+    Test that connections past the cap are refused, and a client whose buffer is full is disconnected.
+    """
+    hub = EventHub(max_connections=1, queue_size=1)
+    subscription = hub.subscribe({"week_key": "precipitation:2023-01-02"})
+    with pytest.raises(TooManySubscribers):
+        hub.subscribe({"week_key": "precipitation:2023-01-02"})
+
+    fake_redis.data["week_key"] = b'{"version":1}'
+    await hub.broadcast("week_key")
+    fake_redis.data["week_key"] = b'{"version":2}'
+    await hub.broadcast("week_key")
+
+    assert len(hub) == 0
+    assert subscription.queue.get_nowait() is None
+    hub.subscribe({"week_key": "precipitation:2023-01-02"})
@@ -0,0 +1,61 @@
+import msgpack
+import pyarrow as pa
+from starlette.requests import Request
+from .formats import negotiate, encode, loads, MSGPACK_MEDIA_TYPE, ARROW_MEDIA_TYPE, JSON_MEDIA_TYPE
+from .payload import CachedPayload, payload_response
+
+DATA = {
+    "total_count": 2,
+    "results": [
+        {"date": "2023-01-02", "avg_184_d": 2.5, "stagione": "Inverno"},
+        {"date": "2023-01-03", "avg_184_d": 0.0, "stagione": "Inverno"}
+    ]
+}
+
+
+def make_request(**headers):
+    return Request({"type": "http", "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+def test_negotiate_prefers_explicit_binary_formats():
+    """
+    Test that binary formats are only picked when asked for, by quality.
+    """
+    assert negotiate(None) == JSON_MEDIA_TYPE
+    assert negotiate("*/*") == JSON_MEDIA_TYPE
+    assert negotiate("application/msgpack") == MSGPACK_MEDIA_TYPE
+    assert negotiate("application/msgpack;q=0.5, application/vnd.apache.arrow.stream") == ARROW_MEDIA_TYPE
+
+
+def test_binary_formats_are_columnar():
+    """
+    Test that MessagePack and Arrow carry the records as columns and keep the other fields.
+    """
+    packed = msgpack.unpackb(encode(DATA, MSGPACK_MEDIA_TYPE))
+    assert packed == {
+        "total_count": 2,
+        "columns": {"date": ["2023-01-02", "2023-01-03"], "avg_184_d": [2.5, 0.0], "stagione": ["Inverno", "Inverno"]}
+    }
+
+    table = pa.ipc.open_stream(encode(DATA, ARROW_MEDIA_TYPE)).read_all()
+    assert table.column("avg_184_d").to_pylist() == [2.5, 0.0]
+    assert table.schema.field("date").type == pa.date32()
+    assert pa.types.is_dictionary(table.schema.field("stagione").type)
+    assert loads(table.schema.metadata[b"total_count"]) == 2
+
+
+def test_payload_response_negotiates_format():
+    """
+    Test that a cached JSON payload is served as MessagePack with its own ETag, and revalidated with it.
+    """
+    payload = CachedPayload(encode(DATA, JSON_MEDIA_TYPE))
+
+    response = payload_response(payload, make_request(accept=MSGPACK_MEDIA_TYPE), negotiate_format=True)
+    assert response.media_type == MSGPACK_MEDIA_TYPE
+    assert msgpack.unpackb(response.body)["columns"]["stagione"] == ["Inverno", "Inverno"]
+    assert response.headers["etag"] == payload.etag_for("msgpack")
+
+    revalidated = payload_response(payload, make_request(accept=MSGPACK_MEDIA_TYPE, if_none_match=response.headers["etag"]), negotiate_format=True)
+    assert revalidated.status_code == 304
+
+    assert payload_response(payload, make_request(accept=MSGPACK_MEDIA_TYPE)).body == payload.body
@@ -0,0 +1,53 @@
+import pytest
+from unittest.mock import AsyncMock
+from . import memory_budget
+from .memory_budget import expiry_key, memory_usage, parse_budgets, sizes_key
+from .memory_cache import memory_cache
+from ..cache_middleware import cache_middleware, stale_key
+
+
+def test_parse_budgets():
+    """
+    Test that budgets are parsed per key family with size units.
+    """
+    assert parse_budgets("precipitation_data=64MB, dataset_records=512K,small=100") == {
+        "precipitation_data": 64 * 1024 ** 2, "dataset_records": 512 * 1024, "small": 100
+    }
+    assert parse_budgets("") == {}
+
+
+@pytest.mark.asyncio
+async def test_family_over_budget_evicts_keys_expiring_soonest(fake_redis, monkeypatch):
+    """
+    Test that writes are accounted per family and a family over budget evicts its keys expiring soonest.
+    """
+    monkeypatch.setattr(memory_budget, "budgets", {"budget": 60})
+    monkeypatch.setattr(memory_budget, "CACHE_MEMORY_CHECK_INTERVAL", 0)
+
+    await cache_middleware("budget_1", AsyncMock(return_value="a" * 10), ttl=60)
+    await cache_middleware("budget_2", AsyncMock(return_value="b" * 10), ttl=600)
+    usage = await memory_usage()
+    assert usage["budget"] == {"bytes": 2 * 2 * 15, "keys": 2, "budget": 60}
+
+    await cache_middleware("budget_3", AsyncMock(return_value="c" * 10), ttl=3600)
+
+    assert "budget_1" not in fake_redis.data
+    assert stale_key("budget_1") not in fake_redis.data
+    assert memory_cache.get("budget_1") is None
+    assert "budget_2" in fake_redis.data and "budget_3" in fake_redis.data
+    assert (await memory_usage())["budget"]["keys"] == 2
+
+
+@pytest.mark.asyncio
+async def test_writes_prune_expired_accounting(fake_redis, monkeypatch):
+    """
+    Test that a write drops the accounting of expired keys of its family, even without a budget.
+    """
+    monkeypatch.setattr(memory_budget, "PRUNE_BATCH", 2)
+    fake_redis.data[sizes_key("pruned")] = {f"pruned_{index}": "10" for index in range(3)}
+    fake_redis.data[expiry_key("pruned")] = {f"pruned_{index}": 1.0 + index for index in range(3)}
+
+    await cache_middleware("pruned_9", AsyncMock(return_value="a"), ttl=60)
+
+    assert set(fake_redis.data[sizes_key("pruned")]) == {"pruned_2", "pruned_9"}
+    assert set(fake_redis.data[expiry_key("pruned")]) == {"pruned_2", "pruned_9"}
@@ -0,0 +1,97 @@
+import json
+from unittest.mock import patch
+from .memory_cache import MemoryCache
+from .payload import CachedPayload, COMPRESS_MIN_BYTES
+from .invalidation import handle_invalidation, WORKER_ID
+from . import invalidation
+
+
+def test_get_returns_stored_value_and_counts_hits():
+    """
+    Test that a stored value is returned and counted as a hit, and a missing key as a miss.
+    """
+    cache = MemoryCache()
+    cache.set("key", "value", ttl=60)
+
+    assert cache.get("key") == "value"
+    assert cache.get("missing") is None
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+
+
+def test_expired_entry_is_a_miss():
+    """
+    Test that an entry past its TTL is dropped and reported as a miss.
+    """
+    cache = MemoryCache()
+    with patch("time.monotonic", return_value=1000.0):
+        cache.set("key", "value", ttl=10)
+    with patch("time.monotonic", return_value=1011.0):
+        assert cache.get("key") is None
+    assert len(cache) == 0
+    assert cache.current_bytes == 0
+
+
+def test_least_recently_used_entry_is_evicted_over_budget():
+    """
+    Test that going over the memory budget evicts the least recently used entry.
+    """
+    value_size = MemoryCache.sizeof("x" * 100)
+    cache = MemoryCache(max_bytes=value_size * 2)
+    cache.set("a", "a" * 100, ttl=60)
+    cache.set("b", "b" * 100, ttl=60)
+    # Touch "a" so "b" becomes the least recently used entry
+    cache.get("a")
+    cache.set("c", "c" * 100, ttl=60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def test_peek_leaves_stats_and_lru_order_unchanged():
+    """
+    Test that peeking at entries neither counts hits or misses nor saves them from eviction.
+    """
+    value_size = MemoryCache.sizeof("x" * 100)
+    cache = MemoryCache(max_bytes=value_size * 2)
+    cache.set("a", "a" * 100, ttl=60)
+    cache.set("b", "b" * 100, ttl=60)
+
+    assert cache.peek("a") == "a" * 100
+    assert "a" in cache and "missing" not in cache
+    cache.set("c", "c" * 100, ttl=60)
+
+    assert cache.peek("a") is None
+    assert cache.stats.hits == 0 and cache.stats.misses == 0
+
+
+def test_variants_encoded_after_storing_are_accounted():
+    """
+    Test that a payload compressed after it was stored is accounted at its new size on the next read.
+    """
+    cache = MemoryCache()
+    payload = CachedPayload(b'{"results": [' + b'{"avg_184_d": 0.0},' * COMPRESS_MIN_BYTES + b'{}]}')
+    cache.set("payload", payload, ttl=60)
+    stored_bytes = cache.current_bytes
+
+    cache.get("payload").compressed("gzip")
+    cache.get("payload")
+
+    assert cache.current_bytes == stored_bytes + len(payload.encodings["gzip"])
+
+
+def test_invalidation_from_other_worker_drops_entry():
+    """
+    Test that an invalidation published by another worker drops the in-memory copy,
+    while this worker's own messages are ignored.
+    """
+    cache = MemoryCache()
+    cache.set("key", "value", ttl=60)
+    with patch.object(invalidation, "memory_cache", cache):
+        handle_invalidation(json.dumps({"key": "key", "origin": WORKER_ID}))
+        assert cache.get("key") == "value"
+
+        handle_invalidation(json.dumps({"key": "key", "origin": "other-worker"}))
+        assert cache.get("key") is None
@@ -0,0 +1,70 @@
+import json
+import logging
+import pytest
+from .metrics import Counter, Histogram, CACHE_REQUESTS, key_family
+from .logging_config import JsonFormatter
+from ..cache_middleware import cache_middleware
+
+
+def test_histogram_renders_cumulative_buckets():
+    """
+    Test that histograms render cumulative buckets, sum and count in the Prometheus text format.
+    """
+    histogram = Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "/a")
+    histogram.observe(0.5, "/a")
+    histogram.observe(5.0, "/a")
+
+    assert histogram.render() == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.55',
+        'latency_seconds_count{route="/a"} 3'
+    ]
+    assert Counter("empty_total", "Nothing yet.").render() == ["empty_total 0"]
+
+
+def test_key_family_drops_dates_and_digests():
+    """
+    Test that keys of the same family share one label value.
+    """
+    assert key_family("precipitation_data_2023-01-02 00:00:00_2023-01-08 00:00:00") == "precipitation_data"
+    assert key_family("opendata_bologna_dataset") == "opendata_bologna_dataset"
+    assert key_family("dataset:parcheggi:records:abc123") == "dataset_records"
+
+
+@pytest.mark.asyncio
+async def test_cache_lookups_are_counted_per_family_and_tier(fake_redis):
+    """
+    Test that a miss and a following hit are counted on the right tiers.
+    """
+    async def fetch():
+        return {"total_count": 0, "results": []}
+
+    before = dict(CACHE_REQUESTS.values)
+    await cache_middleware("metrics_family_1", fetch)
+    await cache_middleware("metrics_family_2", fetch)
+    await cache_middleware("metrics_family_1", fetch)
+
+    def delta(tier, result):
+        key = ("metrics_family", tier, result)
+        return CACHE_REQUESTS.values.get(key, 0) - before.get(key, 0)
+
+    assert delta("memory", "miss") == 2
+    assert delta("redis", "miss") == 2
+    assert delta("memory", "hit") == 1
+
+
+def test_json_log_lines_carry_extra_fields():
+    """
+    Test that structured fields passed with extra= become top-level JSON keys.
+    """
+    record = logging.LogRecord("app.test", logging.INFO, __file__, 1, "Refreshed %s", ("key",), None)
+    record.cache_key = "key"
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "Refreshed key"
+    assert entry["cache_key"] == "key"
+    assert entry["level"] == "INFO"
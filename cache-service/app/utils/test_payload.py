@@ -0,0 +1,41 @@
+import gzip
+from .payload import CachedPayload, COMPRESS_MIN_BYTES
+
+
+def test_small_body_is_not_compressed():
+    """
+    Test that bodies under the compression threshold are only served as identity.
+    """
+    payload = CachedPayload.from_json('{"total_count": 0, "results": []}')
+
+    assert payload.encodings == {}
+    assert payload.select_encoding("gzip, deflate, br") is None
+
+
+def test_large_body_serves_accepted_encoding():
+    """
+    Test that a large body is compressed on the first request of an encoding, once, and the accepted encoding is picked.
+    """
+    body = b'{"results": [' + b'{"avg_184_d": 0.0},' * COMPRESS_MIN_BYTES + b'{}]}'
+    payload = CachedPayload(body)
+    assert payload.encodings == {}
+
+    assert gzip.decompress(payload.compressed("gzip")) == body
+    assert payload.compressed("gzip") is payload.encodings["gzip"]
+    assert payload.select_encoding("gzip") == "gzip"
+    assert payload.select_encoding("gzip;q=0, identity") is None
+    assert payload.select_encoding(None) is None
+
+
+def test_etag_matches_any_representation():
+    """
+    Test that If-None-Match matches the identity and encoded ETags of the same body only.
+    """
+    payload = CachedPayload(b'{"total_count": 0, "results": []}')
+    other = CachedPayload(b'{"total_count": 1, "results": []}')
+
+    assert payload.matches(payload.etag)
+    assert payload.matches(f'"unrelated", {payload.etag_for("gzip")}')
+    assert payload.matches(f"W/{payload.etag}")
+    assert not payload.matches(other.etag)
+    assert not payload.matches(None)
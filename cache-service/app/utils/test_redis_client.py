@@ -0,0 +1,27 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock
+from . import redis_client as redis_client_module
+from ..cache_middleware import CacheSpec, cache_lookup
+
+fakeredis = pytest.importorskip("fakeredis")
+fakeredis_aioredis = pytest.importorskip("fakeredis.aioredis")
+
+
+@pytest.mark.asyncio
+async def test_lookups_beyond_the_pool_size_wait_for_a_connection(monkeypatch):
+    """
+    Test that more concurrent lookups than REDIS_MAX_CONNECTIONS queue for a connection instead of failing.
+    """
+    monkeypatch.setattr(redis_client_module, "REDIS_MAX_CONNECTIONS", 4)
+    pool = redis_client_module._create_pool(connection_class=getattr(fakeredis_aioredis, "FakeAsyncRedisConnection", fakeredis_aioredis.FakeConnection), server=fakeredis.FakeServer())
+    client = redis_client_module.redis.Redis(connection_pool=pool)
+    monkeypatch.setattr(redis_client_module, "_redis_client", client)
+    fetch_function = AsyncMock(return_value={"value": 1})
+
+    specs = [CacheSpec(f"pool_key_{index % 10}", fetch_function, ttl=60) for index in range(100)]
+    payloads = await asyncio.gather(*(cache_lookup(spec) for spec in specs))
+
+    assert all(payload.body == b'{"value":1}' for payload in payloads)
+    assert fetch_function.call_count == 10
+    await pool.disconnect()
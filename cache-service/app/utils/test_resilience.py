@@ -0,0 +1,182 @@
+import asyncio
+import pytest
+import aiohttp
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi import Request
+from . import resilience
+from .resilience import CircuitBreaker, CircuitOpen, LatencyTracker, UpstreamError, fetch_upstream, hedge, upstream_breaker
+from .payload import CachedPayload, STALE_WARNING, payload_response
+from ..cache_middleware import refresh, CacheSpec, stale_key
+from ..conftest import mock_api_response
+
+
+def mock_api_statuses(*statuses):
+    """
+    Builds a mock for aiohttp.ClientSession.get answering with the given statuses in turn.
+    """
+    responses = []
+    for status in statuses:
+        response = MagicMock()
+        response.status = status
+        response.headers = {}
+        response.json = AsyncMock(return_value={"status": status})
+        context = MagicMock()
+        context.__aenter__ = AsyncMock(return_value=response)
+        context.__aexit__ = AsyncMock(return_value=False)
+        responses.append(context)
+    return MagicMock(side_effect=responses)
+
+
+def test_breaker_opens_after_consecutive_failures_and_probes_after_reset():
+    """
+    Test that the circuit opens at the threshold, lets a single probe through after the reset timeout, and closes on success.
+    """
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_adaptive_timeout_follows_observed_latency():
+    """
+    Test that the timeout shrinks to a multiple of the observed p99, within the configured bounds.
+    """
+    configured = aiohttp.ClientTimeout(total=15, connect=3, sock_read=12)
+    tracker = LatencyTracker()
+    assert tracker.timeout(configured) is configured
+
+    for _ in range(50):
+        tracker.observe(0.5)
+    assert tracker.timeout(configured).total == 1.5
+    assert tracker.timeout(configured).sock_read == 1.5
+
+    for _ in range(200):
+        tracker.observe(10.0)
+    assert tracker.timeout(configured).total == 15
+
+
+@pytest.mark.asyncio
+async def test_hedge_returns_the_faster_copy():
+    """
+    Test that a request still running after the hedge delay is raced against a second copy.
+    """
+    delays = [1.0, 0.01]
+    cancelled = []
+
+    async def attempt():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    assert await hedge(attempt, 0.01, "test") == 0.01
+    await asyncio.sleep(0)
+    assert cancelled == [1.0]
+
+
+@pytest.mark.asyncio
+async def test_fetch_upstream_retries_server_errors(monkeypatch):
+    """
+    Test that 5xx responses are retried and a later success is returned.
+    """
+    monkeypatch.setattr(resilience, "UPSTREAM_RETRY_BACKOFF", 0)
+    mock_get = mock_api_statuses(503, 200)
+
+    with patch('aiohttp.ClientSession.get', mock_get):
+        response = await fetch_upstream("test", "http://upstream/test")
+
+    assert response.status == 200
+    assert response.data == {"status": 200}
+    assert mock_get.call_count == 2
+    assert upstream_breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_stops_calling_upstream(monkeypatch):
+    """
+    Test that once the breaker opens, calls fail immediately without a request.
+    """
+    monkeypatch.setattr(resilience, "UPSTREAM_RETRIES", 0)
+    mock_get = mock_api_response({}, status=500)
+
+    with patch('aiohttp.ClientSession.get', mock_get):
+        for _ in range(upstream_breaker.threshold):
+            with pytest.raises(UpstreamError):
+                await fetch_upstream("test", "http://upstream/test")
+        with pytest.raises(CircuitOpen):
+            await fetch_upstream("test", "http://upstream/test")
+
+    assert mock_get.call_count == upstream_breaker.threshold
+
+
+@pytest.mark.asyncio
+async def test_failed_probe_with_unreadable_body_reopens_the_circuit(monkeypatch):
+    """
+    Test that a half-open probe failing with an unexpected error, e.g. a body that is not JSON, opens the circuit again.
+    """
+    monkeypatch.setattr(resilience, "UPSTREAM_RETRIES", 0)
+    upstream_breaker.state = CircuitBreaker.OPEN
+    upstream_breaker.opened_at = 0.0
+    mock_get = MagicMock()
+    mock_get.return_value.__aenter__.return_value.status = 200
+    mock_get.return_value.__aenter__.return_value.json = AsyncMock(side_effect=ValueError("Expecting value"))
+
+    with patch('aiohttp.ClientSession.get', mock_get):
+        with pytest.raises(UpstreamError):
+            await fetch_upstream("test", "http://upstream/test")
+
+    assert upstream_breaker.state == CircuitBreaker.OPEN
+    assert upstream_breaker.retry_after() > 0
+
+
+def test_retry_after_while_probe_is_in_flight():
+    """
+    Test that callers turned away while the probe is in flight are told to wait, not to retry at once.
+    """
+    breaker = CircuitBreaker(threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    breaker.opened_at -= 30
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+
+@pytest.mark.asyncio
+async def test_refresh_serves_last_known_value_marked_stale_while_circuit_is_open(fake_redis):
+    """
+    Test that a refresh failing on an open circuit returns the last known value, sent with a stale warning.
+    """
+    fake_redis.data[stale_key("outage_key")] = '"old"'
+    fetch_function = AsyncMock(side_effect=CircuitOpen(30))
+
+    payload = await refresh(CacheSpec("outage_key", fetch_function, ttl=60), force=True)
+
+    assert payload.body == b'"old"'
+    assert payload.stale
+    response = payload_response(payload, Request({"type": "http", "headers": []}), "public, max-age=3600")
+    assert response.headers["Warning"] == STALE_WARNING
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert "Warning" not in payload_response(CachedPayload(b'"new"'), Request({"type": "http", "headers": []})).headers
+
+
+@pytest.mark.asyncio
+async def test_refresh_without_fallback_raises_upstream_error(fake_redis):
+    """
+    Test that an upstream failure with no cached copy propagates, for the endpoint to answer 502/503.
+    """
+    fetch_function = AsyncMock(side_effect=CircuitOpen(30))
+
+    with pytest.raises(CircuitOpen):
+        await refresh(CacheSpec("missing_key", fetch_function, ttl=60))
@@ -0,0 +1,108 @@
+"""
+Measures event-loop latency while many coroutines read the same cached key.
+
+Runs the same workload twice against a live Redis (REDIS_HOST/REDIS_PORT):
+once with the blocking redis.StrictRedis client called from coroutines, as the
+service used to do, and once with the shared asyncio connection pool. A ticker
+coroutine sleeping 1 ms records how late the loop wakes it up; that lag is what
+every other in-flight request waits for.
+
+Usage:
+    python -m benchmarks.event_loop_latency --requests 5000 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import redis
+
+from app.utils.redis_client import REDIS_HOST, REDIS_PORT, get_redis_client, close_redis_client
+
+CACHE_KEY = "benchmark_event_loop_key"
+
+
+def percentile(values, pct):
+    """
+    Returns the given percentile of a list of values using nearest-rank.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def measure_loop_lag(stop: asyncio.Event, lags: list) -> None:
+    """
+    Records how late a 1 ms sleep wakes up until stop is set.
+    """
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append((time.perf_counter() - start - 0.001) * 1000)
+
+
+async def run_scenario(name: str, read, requests: int, concurrency: int) -> dict:
+    """
+    Issues the given number of cache reads with bounded concurrency and reports loop lag.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    stop = asyncio.Event()
+    lags = []
+
+    async def one_read():
+        async with semaphore:
+            await read()
+
+    ticker = asyncio.create_task(measure_loop_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(one_read() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticker
+
+    return {
+        "scenario": name,
+        "requests": requests,
+        "requests_per_second": round(requests / elapsed, 1),
+        "loop_lag_ms_p50": round(percentile(lags, 50), 3),
+        "loop_lag_ms_p99": round(percentile(lags, 99), 3),
+        "loop_lag_ms_max": round(max(lags, default=0.0), 3),
+        "loop_lag_ms_mean": round(statistics.fmean(lags), 3) if lags else 0.0,
+    }
+
+
+async def main(requests: int, concurrency: int) -> None:
+    payload = json.dumps({"total_count": 7, "results": [{"date": "2023-01-02", "avg_184_d": 1.5, "stagione": "Inverno"}] * 7})
+
+    blocking_client = redis.StrictRedis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+    blocking_client.set(CACHE_KEY, payload)
+
+    async def blocking_read():
+        blocking_client.get(CACHE_KEY)
+
+    async_client = get_redis_client()
+
+    async def async_read():
+        await async_client.get(CACHE_KEY)
+
+    results = [
+        await run_scenario("blocking StrictRedis", blocking_read, requests, concurrency),
+        await run_scenario("asyncio pool", async_read, requests, concurrency),
+    ]
+
+    blocking_client.delete(CACHE_KEY)
+    blocking_client.close()
+    await close_redis_client()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency))
@@ -0,0 +1,282 @@
+"""
+Measures latency and throughput of the service against a local Opendata API stub.
+
+Starts `benchmarks.opendata_stub` on a free port, points OPENDATA_API_URL at
+it and drives the app in process through httpx's ASGI transport, so the runs
+are reproducible offline. Redis is an in-memory fakeredis by default, or the
+configured Redis with `--redis real` (only the service's own keys are deleted
+between scenarios). Every scenario starts from empty Redis and in-memory caches:
+
+- cold-miss: concurrent requests for distinct, uncached weeks
+- warm-hit: concurrent requests for one cached week
+- stampede-on-expiry: a burst of requests right after a cached week expired,
+  reporting how many upstream requests it caused
+- large-range: a 10-year `/precipitation/range` request, first cold then warm
+
+Reports p50/p95/p99 latency and requests/s per scenario as JSON. With
+`--compare`, exits with status 1 if a scenario regressed beyond `--tolerance`
+against a previous result file.
+
+Usage:
+    python -m benchmarks.load_test --output results.json
+    python -m benchmarks.load_test --compare results.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+from typing import Awaitable, Callable, Dict, List
+
+from benchmarks.opendata_stub import OpendataStub, start_stub
+
+# Key prefixes written by the service, deleted between scenarios on a real Redis
+SERVICE_KEY_PATTERNS = ("precipitation_data_*", "opendata_bologna_dataset*", "dataset:*", "cache:*")
+
+WARM_WEEK = "2023-01-02"
+LARGE_RANGE = ("2014-01-01", "2023-12-31")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Returns the given percentile of a list of values using nearest-rank.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int, concurrency: int) -> dict:
+    """
+    Returns the latency percentiles in milliseconds and the throughput of one scenario.
+    """
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(max(latencies, default=0.0) * 1000, 3)
+    }
+
+
+async def run_load(client, urls: List[str], concurrency: int) -> dict:
+    """
+    Requests every URL with at most concurrency requests in flight.
+    """
+    latencies: List[float] = []
+    errors = 0
+    queue = iter(urls)
+
+    async def worker():
+        nonlocal errors
+        for url in queue:
+            start = time.perf_counter()
+            response = await client.get(url)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(urls)))))
+    return summarize(latencies, time.perf_counter() - start, errors, concurrency)
+
+
+class Harness:
+    """
+    The app, its HTTP client and the stub, with helpers to reset the caches between scenarios.
+    """
+
+    def __init__(self, client, stub: OpendataStub):
+        self.client = client
+        self.stub = stub
+
+    async def reset(self) -> None:
+        from app.utils.memory_cache import memory_cache
+        from app.utils.redis_client import get_redis_client
+
+        redis = get_redis_client()
+        for pattern in SERVICE_KEY_PATTERNS:
+            keys = [key async for key in redis.scan_iter(match=pattern, count=1000)]
+            if keys:
+                await redis.delete(*keys)
+        memory_cache.clear()
+        self.stub.requests.clear()
+
+    async def settle(self) -> None:
+        """
+        Waits for background refreshes started by the last requests.
+        """
+        from app.cache_middleware import single_flight
+
+        while len(single_flight):
+            await asyncio.sleep(0.01)
+
+    def upstream_requests(self) -> Dict[str, int]:
+        return dict(self.stub.requests)
+
+
+async def cold_miss(harness: Harness, args) -> dict:
+    first = date(2020, 1, 6)
+    urls = [f"/precipitation?date={first + timedelta(weeks=week)}" for week in range(args.cold_requests)]
+    result = await run_load(harness.client, urls, args.concurrency)
+    await harness.settle()
+    return result
+
+
+async def warm_hit(harness: Harness, args) -> dict:
+    await harness.client.get(f"/precipitation?date={WARM_WEEK}")
+    await harness.settle()
+    harness.stub.requests.clear()
+    return await run_load(harness.client, [f"/precipitation?date={WARM_WEEK}"] * args.warm_requests, args.concurrency)
+
+
+async def stampede_on_expiry(harness: Harness, args) -> dict:
+    from app.utils.memory_cache import memory_cache
+    from app.utils.redis_client import get_redis_client
+
+    await harness.client.get(f"/precipitation?date={WARM_WEEK}")
+    await harness.settle()
+    # Expire the fresh copy everywhere; the stale copy outlives it, as in production
+    cache_keys = [key.decode() async for key in get_redis_client().scan_iter(match="precipitation_data_*") if not key.endswith((b":stale", b":version", b":validators"))]
+    await get_redis_client().delete(*cache_keys)
+    for cache_key in cache_keys:
+        memory_cache.delete(cache_key)
+    harness.stub.requests.clear()
+
+    result = await run_load(harness.client, [f"/precipitation?date={WARM_WEEK}"] * args.stampede_requests, args.stampede_requests)
+    await harness.settle()
+    return result
+
+
+async def large_range(harness: Harness, args) -> dict:
+    url = f"/precipitation/range?start={LARGE_RANGE[0]}&end={LARGE_RANGE[1]}"
+    start = time.perf_counter()
+    response = await harness.client.get(url)
+    cold_ms = round((time.perf_counter() - start) * 1000, 3)
+    await harness.settle()
+    result = await run_load(harness.client, [url] * args.range_requests, args.range_concurrency)
+    result["cold_ms"] = cold_ms
+    result["bytes"] = len(response.content)
+    return result
+
+
+SCENARIOS: Dict[str, Callable[[Harness, argparse.Namespace], Awaitable[dict]]] = {
+    "cold-miss": cold_miss,
+    "warm-hit": warm_hit,
+    "stampede-on-expiry": stampede_on_expiry,
+    "large-range": large_range
+}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    stub = OpendataStub(args.latency_ms, args.jitter_ms, args.padding_bytes)
+    runner, base_url = await start_stub(stub)
+    # The service reads its configuration at import time
+    os.environ["OPENDATA_API_URL"] = base_url
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import httpx
+    from app.main import app, lifespan
+    from app.utils import redis_client
+
+    if args.redis == "fake":
+        import fakeredis
+        import fakeredis.aioredis
+        # The service's own blocking pool over an in-memory server, so bursts queue for connections as on a real Redis
+        pool = redis_client._create_pool(connection_class=fakeredis.aioredis.FakeAsyncRedisConnection, server=fakeredis.FakeServer())
+        redis_client._redis_client = redis_client.redis.Redis(connection_pool=pool)
+
+    results = {}
+    try:
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+                harness = Harness(client, stub)
+                for name in args.scenarios:
+                    await harness.reset()
+                    results[name] = await SCENARIOS[name](harness, args)
+                    results[name]["upstream_requests"] = harness.upstream_requests()
+                    print(f"{name}: {results[name]}", file=sys.stderr)
+    finally:
+        await runner.cleanup()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "redis": args.redis,
+            "upstream_latency_ms": args.latency_ms,
+            "upstream_jitter_ms": args.jitter_ms,
+            "padding_bytes": args.padding_bytes
+        },
+        "scenarios": results
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Returns the regressions of current against baseline: p95 latency up or throughput down by more than tolerance.
+    """
+    regressions = []
+    for name, result in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        if result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} ms -> {result['p95_ms']} ms")
+        if result["requests_per_second"] < previous["requests_per_second"] * (1 - tolerance):
+            regressions.append(f"{name}: {previous['requests_per_second']} -> {result['requests_per_second']} requests/s")
+        upstream, previous_upstream = sum(result["upstream_requests"].values()), sum(previous["upstream_requests"].values())
+        if upstream > previous_upstream:
+            regressions.append(f"{name}: {previous_upstream} -> {upstream} upstream requests")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--redis", choices=["fake", "real"], default="fake")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--cold-requests", type=int, default=200)
+    parser.add_argument("--warm-requests", type=int, default=5000)
+    parser.add_argument("--stampede-requests", type=int, default=200)
+    parser.add_argument("--range-requests", type=int, default=20)
+    parser.add_argument("--range-concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--padding-bytes", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this file instead of stdout")
+    parser.add_argument("--compare", help="A previous result file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
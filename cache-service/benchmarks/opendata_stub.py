@@ -0,0 +1,223 @@
+"""
+A local stand-in for the Opendata Bologna Explore API, for offline benchmarks.
+
+Serves the `precipitazioni_bologna` metadata, records (filtered by the date
+range in `where`, paginated with `limit`/`offset`), CSV export and catalog
+listing, with the same JSON shapes as the real API. Every day has exactly one
+deterministic record. Responses are delayed by a configurable latency, and
+records can be padded to simulate larger payloads.
+
+Usage:
+    python -m benchmarks.opendata_stub --port 8081 --latency-ms 80 --jitter-ms 20
+    OPENDATA_API_URL=http://127.0.0.1:8081 uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import re
+from collections import Counter
+from datetime import date, timedelta
+from typing import List, Optional
+
+from aiohttp import web
+
+DATASET_ID = "precipitazioni_bologna"
+DATA_PROCESSED = "2024-05-31T06:00:00+00:00"
+HISTORY_START = date(1990, 1, 1)
+
+DATE_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})")
+
+
+def stagione(day: date) -> str:
+    if day.month in (12, 1, 2):
+        return "Inverno"
+    if day.month in (3, 4, 5):
+        return "Primavera"
+    if day.month in (6, 7, 8):
+        return "Estate"
+    return "Autunno"
+
+
+def make_record(day: date, padding_bytes: int = 0) -> dict:
+    """
+    Returns the deterministic record of one day: about 30% of days are rainy.
+    """
+    rng = random.Random(day.toordinal())
+    record = {
+        "date": day.isoformat(),
+        "avg_184_d": round(rng.expovariate(0.25), 1) if rng.random() < 0.3 else 0.0,
+        "stagione": stagione(day)
+    }
+    if padding_bytes:
+        record["note"] = "x" * padding_bytes
+    return record
+
+
+def make_dataset_metadata(dataset_id: str = DATASET_ID, records_count: int = 0) -> dict:
+    """
+    Returns catalog metadata shaped like the real `precipitazioni_bologna` document.
+    """
+    return {
+        "visibility": "domain",
+        "dataset_id": dataset_id,
+        "dataset_uid": "da_" + hashlib.blake2b(dataset_id.encode(), digest_size=4).hexdigest(),
+        "has_records": True,
+        "features": ["timeserie", "analyze"],
+        "attachments": [],
+        "alternative_exports": [],
+        "data_visible": True,
+        "fields": [
+            {"name": "date", "description": None, "annotations": {"timeserie_precision": "day"}, "label": "Data", "type": "date"},
+            {"name": "avg_184_d", "description": "Precipitazione media giornaliera (mm)", "annotations": {}, "label": "Precipitazione", "type": "double"},
+            {"name": "stagione", "description": None, "annotations": {"facet": True}, "label": "Stagione", "type": "text"}
+        ],
+        "metas": {
+            "dcat": {
+                "contact_name": "Comune di Bologna",
+                "contact_email": "opendata@comune.bologna.it",
+                "accrualperiodicity": "http://publications.europa.eu/resource/authority/frequency/DAILY"
+            },
+            "semantic": {},
+            "dcat_ap_it": {},
+            "default": {
+                "title": "Precipitazioni giornaliere a Bologna",
+                "description": "Precipitazioni medie giornaliere registrate a Bologna",
+                "theme": ["Ambiente"],
+                "license": "CC BY 4.0",
+                "license_url": "https://creativecommons.org/licenses/by/4.0/",
+                "language": "it",
+                "metadata_languages": ["it"],
+                "timezone": "UTC",
+                "modified": DATA_PROCESSED,
+                "modified_updates_on_metadata_change": False,
+                "modified_updates_on_data_change": True,
+                "data_processed": DATA_PROCESSED,
+                "metadata_processed": DATA_PROCESSED,
+                "geographic_reference_auto": False,
+                "references": "https://opendata.comune.bologna.it",
+                "records_count": records_count,
+                "federated": False,
+                "update_frequency": "daily"
+            }
+        }
+    }
+
+
+class OpendataStub:
+    """
+    The stub application, with its latency settings and a count of the requests it served.
+
+    :param latency_ms: Delay added to every response.
+    :param jitter_ms: Uniform random extra delay, up to this many milliseconds.
+    :param padding_bytes: Extra bytes added to every record.
+    :param history_end: The last day with data, defaults to today.
+    """
+
+    def __init__(self, latency_ms: float = 50, jitter_ms: float = 0, padding_bytes: int = 0, history_end: Optional[date] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.padding_bytes = padding_bytes
+        self.history_end = history_end or date.today()
+        self.requests: Counter = Counter()
+        self.rng = random.Random(0)
+
+    async def delay(self) -> None:
+        latency = self.latency_ms + self.rng.uniform(0, self.jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def days(self, where: Optional[str]) -> List[date]:
+        """
+        Returns the days selected by a `date >= 'a' AND date <= 'b'` (or `date > 'a'`) filter.
+        """
+        first, last = HISTORY_START, self.history_end
+        bounds = DATE_PATTERN.findall(where or "")
+        if len(bounds) >= 1:
+            first = max(first, date.fromisoformat(bounds[0]) + timedelta(days=1 if "date >" in where and "date >=" not in where else 0))
+        if len(bounds) >= 2:
+            last = min(last, date.fromisoformat(bounds[1]))
+        if last < first:
+            return []
+        return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+    async def metadata(self, request: web.Request) -> web.Response:
+        self.requests["metadata"] += 1
+        await self.delay()
+        dataset_id = request.match_info["dataset_id"]
+        records_count = (self.history_end - HISTORY_START).days + 1
+        body = make_dataset_metadata(dataset_id, records_count)
+        etag = '"' + hashlib.blake2b(repr(body).encode(), digest_size=8).hexdigest() + '"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.json_response(body, headers={"ETag": etag})
+
+    async def records(self, request: web.Request) -> web.Response:
+        self.requests["records"] += 1
+        await self.delay()
+        days = self.days(request.query.get("where"))
+        limit = min(int(request.query.get("limit", 10)), 100)
+        offset = int(request.query.get("offset", 0))
+        results = [make_record(day, self.padding_bytes) for day in days[offset:offset + limit]]
+        return web.json_response({"total_count": len(days), "results": results})
+
+    async def export_csv(self, request: web.Request) -> web.StreamResponse:
+        self.requests["export"] += 1
+        await self.delay()
+        response = web.StreamResponse(headers={"Content-Type": "text/csv; charset=utf-8"})
+        await response.prepare(request)
+        await response.write(b"date;avg_184_d;stagione\n")
+        lines = []
+        for day in self.days(request.query.get("where")):
+            record = make_record(day)
+            lines.append(f"{record['date']};{record['avg_184_d']};{record['stagione']}\n")
+            if len(lines) >= 1000:
+                await response.write("".join(lines).encode())
+                lines = []
+        await response.write("".join(lines).encode())
+        await response.write_eof()
+        return response
+
+    async def catalog(self, request: web.Request) -> web.Response:
+        self.requests["catalog"] += 1
+        await self.delay()
+        limit = min(int(request.query.get("limit", 10)), 100)
+        offset = int(request.query.get("offset", 0))
+        dataset_ids = [DATASET_ID] + [f"dataset_{index:03d}" for index in range(249)]
+        results = [make_dataset_metadata(dataset_id) for dataset_id in dataset_ids[offset:offset + limit]]
+        return web.json_response({"total_count": len(dataset_ids), "results": results})
+
+    def application(self) -> web.Application:
+        app = web.Application()
+        prefix = "/catalog/datasets"
+        app.router.add_get(prefix, self.catalog)
+        app.router.add_get(prefix + "/{dataset_id}", self.metadata)
+        app.router.add_get(prefix + "/{dataset_id}/records", self.records)
+        app.router.add_get(prefix + "/{dataset_id}/exports/csv", self.export_csv)
+        return app
+
+
+async def start_stub(stub: OpendataStub, host: str = "127.0.0.1", port: int = 0) -> tuple:
+    """
+    Serves the stub in the running event loop.
+
+    :return: The runner, to clean up when done, and the base URL to use as OPENDATA_API_URL.
+    """
+    runner = web.AppRunner(stub.application(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--padding-bytes", type=int, default=0)
+    args = parser.parse_args()
+    stub = OpendataStub(args.latency_ms, args.jitter_ms, args.padding_bytes)
+    web.run_app(stub.application(), host=args.host, port=args.port)
@@ -0,0 +1,95 @@
+"""
+Compares memory and construction time of the precipitation record containers.
+
+Builds synthetic `{date, avg_184_d, stagione}` records into the Pydantic
+PrecipitationResponse model (one object per record) and into the columnar
+PrecipitationColumns, from parsed dicts and from a JSON body, and measures
+the memory each container holds and the time to turn it back into JSON.
+Runs offline, without Redis or the Opendata API.
+
+Usage:
+    python -m benchmarks.record_containers --rows 1000 100000 --repeat 5
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from app.models.precipitation_columns import PrecipitationColumns
+from app.models.precipitation_model import PrecipitationResponse
+from app.utils.formats import dumps, loads
+from benchmarks.response_formats import make_records
+
+CONTAINERS = {
+    "pydantic": {
+        "from dicts": lambda data, body: PrecipitationResponse(**data),
+        "from json": lambda data, body: PrecipitationResponse.model_validate_json(body),
+        "to json": lambda container: container.model_dump_json().encode()
+    },
+    "columns": {
+        "from dicts": lambda data, body: PrecipitationColumns.from_records(data["results"]),
+        "from json": lambda data, body: PrecipitationColumns.from_json(body),
+        "to json": lambda container: container.to_json()
+    }
+}
+
+
+def best_time(function, repeat: int) -> tuple:
+    """
+    Returns the best run time in milliseconds over repeat runs, and the last result.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return round(best * 1000, 3), result
+
+
+def retained_bytes(build) -> int:
+    """
+    Returns the bytes still allocated by what build returns, once it has returned.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        container = build()
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del container
+    return retained
+
+
+def run(rows: int, repeat: int) -> list:
+    data = make_records(rows)
+    body = dumps(data)
+    # The records as parsed from a JSON body, not sharing strings with the ones built above
+    data = loads(body)
+
+    results = []
+    for name, operations in CONTAINERS.items():
+        from_dicts_ms, container = best_time(lambda: operations["from dicts"](data, body), repeat)
+        from_json_ms, _ = best_time(lambda: operations["from json"](data, body), repeat)
+        to_json_ms, _ = best_time(lambda: operations["to json"](container), repeat)
+        results.append({
+            "rows": rows,
+            "container": name,
+            "from_dicts_ms": from_dicts_ms,
+            "from_json_ms": from_json_ms,
+            "to_json_ms": to_json_ms,
+            "bytes": retained_bytes(lambda: operations["from json"](data, body))
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps([result for rows in args.rows for result in run(rows, args.repeat)], indent=2))
@@ -0,0 +1,81 @@
+"""
+Compares payload size and encode time of the precipitation response formats.
+
+Encodes synthetic `{date, avg_184_d, stagione}` records with every available
+serializer: the Pydantic model (the service's original path), the standard
+json module, orjson, and the columnar MessagePack and Arrow IPC encodings.
+Runs offline, without Redis or the Opendata API.
+
+Usage:
+    python -m benchmarks.response_formats --rows 1000 100000 --repeat 5
+"""
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+
+from app.models.precipitation_model import PrecipitationResponse
+from app.utils import formats
+
+STAGIONI = ["Inverno", "Primavera", "Estate", "Autunno"]
+
+
+def make_records(rows: int) -> dict:
+    """
+    Builds a response dict with one record per day, starting 1990-01-01.
+    """
+    rng = random.Random(rows)
+    first = date(1990, 1, 1)
+    results = [
+        {
+            "date": (first + timedelta(days=day)).isoformat(),
+            "avg_184_d": round(rng.expovariate(0.5), 2) if rng.random() < 0.3 else 0.0,
+            "stagione": STAGIONI[(day // 91) % 4]
+        }
+        for day in range(rows)
+    ]
+    return {"total_count": rows, "results": results}
+
+
+def time_encoder(encoder, repeat: int) -> tuple:
+    """
+    Returns the best encode time in milliseconds over repeat runs, and the encoded size.
+    """
+    best = float("inf")
+    body = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = encoder()
+        best = min(best, time.perf_counter() - start)
+    return round(best * 1000, 3), len(body)
+
+
+def run(rows: int, repeat: int) -> list:
+    data = make_records(rows)
+    model = PrecipitationResponse(**data)
+
+    encoders = {
+        "pydantic model_dump_json": lambda: model.model_dump_json().encode(),
+        "json": lambda: json.dumps(data).encode(),
+    }
+    if formats.orjson is not None:
+        encoders["orjson"] = lambda: formats.orjson.dumps(data)
+    if formats.msgpack is not None:
+        encoders["msgpack columnar"] = lambda: formats.encode_msgpack(data)
+    if formats.pa is not None:
+        encoders["arrow ipc columnar"] = lambda: formats.encode_arrow(data)
+
+    results = []
+    for name, encoder in encoders.items():
+        encode_ms, size = time_encoder(encoder, repeat)
+        results.append({"rows": rows, "format": name, "encode_ms": encode_ms, "bytes": size})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(json.dumps([result for rows in args.rows for result in run(rows, args.repeat)], indent=2))
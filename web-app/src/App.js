@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import {
   AppBar,
   Box,
@@ -78,15 +78,20 @@ const WeatherDashboard = () => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [tabValue, setTabValue] = useState(0);
+  // The date whose week is shown, followed for pushed updates
+  const [shownDate, setShownDate] = useState(null);
+  // Read by the event handler without reopening the stream on every dataset change
+  const datasetRef = useRef(null);
 
-  const fetchPrecipitation = async () => {
+  const fetchPrecipitation = async (requestedDate = date) => {
     setLoading(true);
     setError(null);
     try {
-      const response = await fetch(`http://localhost:8000/precipitation?date=${date}`);
+      const response = await fetch(`http://localhost:8000/precipitation?date=${requestedDate}`);
       if (!response.ok) throw new Error('Failed to fetch precipitation data');
       const data = await response.json();
       setPrecipitationData(data);
+      setShownDate(requestedDate);
     } catch (err) {
       setError(err.message);
     } finally {
@@ -113,6 +118,31 @@ const WeatherDashboard = () => {
     fetchPrecipitation();
   }, []);
 
+  useEffect(() => {
+    datasetRef.current = dataset;
+  }, [dataset]);
+
+  // Follow the shown week and the dataset, so refreshes are pushed instead of polled
+  useEffect(() => {
+    if (!shownDate || typeof EventSource === 'undefined') return undefined;
+    const events = new EventSource(`http://localhost:8000/events?dates=${shownDate}&dataset=true`);
+    events.addEventListener('update', (event) => {
+      const update = JSON.parse(event.data);
+      if (update.topic === 'dataset') {
+        // Only refresh the dataset if it is shown; large payloads are announced without data
+        if (!datasetRef.current) return;
+        if (update.data) setDataset(update.data);
+        else fetchDataset();
+      } else if (update.data) {
+        setPrecipitationData(update.data);
+      } else {
+        fetchPrecipitation(shownDate);
+      }
+    });
+    // The browser reconnects on its own after errors
+    return () => events.close();
+  }, [shownDate]);
+
   const handleTabChange = (event, newValue) => {
     setTabValue(newValue);
   };
@@ -149,7 +179,7 @@ const WeatherDashboard = () => {
                     <Button
                       variant="contained"
                       color="primary"
-                      onClick={fetchPrecipitation}
+                      onClick={() => fetchPrecipitation()}
                       startIcon={<Opacity />}
                     >
                       Fetch Precipitation